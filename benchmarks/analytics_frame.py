@@ -0,0 +1,108 @@
+"""
+Compare building DataFrames from analytics reports row by row and by column.
+
+Builds a `RunReportResponse` of the analytics dimensions and metrics, then converts
+it with the former row by row builder, with the columnar `analytics_frame`, and
+with `create_df_from_analytics_response`, which adapts the columnar frame to the
+layout of the report sheet.
+
+Usage:
+    python -m benchmarks.analytics_frame [--rows 10000 50000 100000] [--repeat 5]
+"""
+
+import argparse
+import time
+
+import pandas as pd
+from google.analytics.data_v1beta.types import (
+    DimensionHeader,
+    DimensionValue,
+    MetricHeader,
+    MetricType,
+    MetricValue,
+    Row,
+    RunReportResponse,
+)
+
+from gdrive import analytics_client
+
+
+def make_response(rows: int) -> RunReportResponse:
+    return RunReportResponse(
+        dimension_headers=[
+            DimensionHeader(name=name) for name in analytics_client.DIMENSIONS
+        ],
+        metric_headers=[
+            MetricHeader(name=name, type_=MetricType.TYPE_INTEGER)
+            for name in analytics_client.METRICS
+        ],
+        rows=[
+            Row(
+                dimension_values=[
+                    DimensionValue(value=f"{name}-{idx % 97}")
+                    for name in analytics_client.DIMENSIONS
+                ],
+                metric_values=[
+                    MetricValue(value=str(idx % 1000)) for _ in analytics_client.METRICS
+                ],
+            )
+            for idx in range(rows)
+        ],
+        row_count=rows,
+    )
+
+
+def row_by_row(response: RunReportResponse) -> pd.DataFrame:
+    """The builder `create_df_from_analytics_response` used before"""
+    all_headers = []
+    for _, header in enumerate(response.dimension_headers):
+        all_headers += [header.name]
+    for _, header in enumerate(response.metric_headers):
+        all_headers += [header.name]
+
+    arr = [all_headers]
+    for _, row in enumerate(response.rows):
+        row_li = []
+        for _, val in enumerate(row.dimension_values):
+            row_li += [val.value]
+        for _, val in enumerate(row.metric_values):
+            row_li += [val.value]
+        arr += [row_li]
+
+    return pd.DataFrame(arr)
+
+
+BUILDERS = {
+    "rows": row_by_row,
+    "columns": analytics_client.analytics_frame,
+    "sheet": analytics_client.create_df_from_analytics_response,
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--rows", type=int, nargs="+", default=[10000, 50000, 100000])
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    print(f"best of {args.repeat}")
+    print(f"{'rows':>8}{'builder':>10}{'ms':>10}{'us/row':>10}{'memory MB':>12}")
+    for rows in args.rows:
+        response = make_response(rows)
+        for label, build in BUILDERS.items():
+            best = None
+            for _ in range(args.repeat):
+                start = time.perf_counter()
+                df = build(response)
+                elapsed = time.perf_counter() - start
+                best = elapsed if best is None else min(best, elapsed)
+
+            memory = df.memory_usage(deep=True).sum() / 1024 / 1024
+            print(
+                f"{rows:>8}{label:>10}{best * 1000:>10.1f}"
+                f"{best * 1e6 / rows:>10.2f}{memory:>12.1f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
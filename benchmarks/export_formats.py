@@ -0,0 +1,110 @@
+"""
+Compare the bytes uploaded and the wall time of the analytics export formats.
+
+Generates synthetic flow analytics events shaped like the documents returned by
+`export_client.export` and serializes them in each `ExportFormatEnum` format, as
+`export_api.upload_file` does. The serialized file is then read through the
+`MediaIoBaseUpload` that `drive_client.upload_basic` sends, into a local sink
+rather than Drive, so the upload time excludes the network.
+
+Usage:
+    python -m benchmarks.export_formats [--events 1000] [--repeat 5]
+"""
+
+import argparse
+import hashlib
+import time
+import uuid
+
+from googleapiclient.http import MediaIoBaseUpload
+
+from gdrive import export_client, settings
+from gdrive.export_client import ExportFormatEnum
+
+WORDS = ["verified", "document", "selfie", "retry", "address", "match", "timeout"]
+
+
+def make_events(count: int) -> list:
+    """
+    Events are generated deterministically, so every run serializes the same data
+    """
+    interaction_id = str(uuid.UUID(int=count))
+    events = []
+    for idx in range(count):
+        digest = hashlib.sha256(b"%d" % idx).digest()
+        events.append(
+            {
+                "interactionId": interaction_id,
+                "capabilityName": "logOutcome",
+                "tsEms": 1700000000000 + idx,
+                "companyId": str(uuid.UUID(bytes=digest[:16])),
+                "connectionId": digest[16:].hex(),
+                "connectorId": ["httpConnector", "functionsConnector"][digest[0] % 2],
+                "properties": {
+                    "outcomeType": {
+                        "value": ["survey_data", "parent_id"][digest[1] % 2]
+                    },
+                    "outcomeStatus": {"value": ["success", "failure"][digest[2] % 2]},
+                    "outcomeDescription": {
+                        "value": " ".join(WORDS[byte % len(WORDS)] for byte in digest)
+                    },
+                    "outcomeDetail": {"value": {"step": idx, "vendor": "Acme"}},
+                },
+            }
+        )
+    return events
+
+
+def upload(spool, format: ExportFormatEnum) -> int:
+    """
+    Read the serialized file in the chunks a Drive upload requests
+
+    Returns:
+        int: bytes uploaded
+    """
+    spool.seek(0)
+    _, mimetype = export_client.EXPORT_FILES[format]
+    media = MediaIoBaseUpload(spool, mimetype=mimetype, resumable=True)
+    sent = 0
+    while sent < media.size():
+        sent += len(media.getbytes(sent, media.chunksize()))
+    return sent
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--events", type=int, default=1000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    settings.CODE_NAMES = {"acme": "vendor-a"}
+    events = make_events(args.events)
+
+    print(f"{args.events} events, best of {args.repeat}")
+    print(
+        f"{'format':<10}{'bytes uploaded':>16}{'ratio':>8}"
+        f"{'serialize ms':>14}{'upload ms':>11}{'total ms':>10}"
+    )
+    baseline = None
+    for format in ExportFormatEnum:
+        best = None
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            spool = export_client.serialize(events, format)
+            serialized = time.perf_counter()
+            size = upload(spool, format)
+            uploaded = time.perf_counter()
+            spool.close()
+            if best is None or uploaded - start < best[2]:
+                best = (serialized - start, uploaded - serialized, uploaded - start)
+
+        baseline = baseline or size
+        serialize_ms, upload_ms, total_ms = (seconds * 1000 for seconds in best)
+        print(
+            f"{format.value:<10}{size:>16,}{size / baseline:>8.2f}"
+            f"{serialize_ms:>14.1f}{upload_ms:>11.1f}{total_ms:>10.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+"""
+Compare building the pivot table definitions of many reports with and without the cache.
+
+Builds the nine pivot table definitions of each analytics report with
+`IDVAPivotDirector`, as `flow_analytics.plan_pivot_tables` does, and encodes them
+as they would be sent to the Sheets API. Reports share a handful of column
+mappings, like reports of several properties would.
+
+Usage:
+    python -m benchmarks.pivot_specs [--reports 500] [--mappings 3] [--repeat 5]
+"""
+
+import argparse
+import json
+import time
+
+from gdrive.idva.pivot_director import IDVAPivotDirector
+
+# Header of the analytics data, see `analytics_client.DIMENSIONS` and `METRICS`
+HEADER = [
+    "eventName",
+    "firstUserCampaignName",
+    "firstUserMedium",
+    "firstUserSource",
+    "isConversionEvent",
+    "linkUrl",
+    "eventCount",
+    "sessions",
+    "totalUsers",
+    "eventCountPerUser",
+    "conversions",
+]
+
+PIVOTS = [
+    "facebook",
+    "craigslist",
+    "reddit",
+    "twitter_x",
+    "linkedin",
+    "linked",
+    "pllpl",
+    "ffg",
+    "clicks",
+]
+
+
+def make_mappings(count: int) -> list:
+    return [
+        {name: (idx + offset) % len(HEADER) for idx, name in enumerate(HEADER)}
+        for offset in range(count)
+    ]
+
+
+def build_reports(director, mappings: list, reports: int, cached: bool) -> int:
+    size = 0
+    for report in range(reports):
+        col_dict = mappings[report % len(mappings)]
+        for pivot in PIVOTS:
+            if cached:
+                spec = getattr(director, pivot)(col_dict)
+            else:
+                spec = getattr(IDVAPivotDirector, pivot).__wrapped__(director, col_dict)
+            size += len(json.dumps(spec))
+    return size
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--reports", type=int, default=500)
+    parser.add_argument("--mappings", type=int, default=3)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    mappings = make_mappings(args.mappings)
+
+    print(
+        f"{args.reports} reports, {args.mappings} column mappings, best of {args.repeat}"
+    )
+    print(f"{'specs':<10}{'bytes':>14}{'ms':>10}{'ms/report':>12}")
+    for cached in [False, True]:
+        best = None
+        for _ in range(args.repeat):
+            director = IDVAPivotDirector()
+            start = time.perf_counter()
+            size = build_reports(director, mappings, args.reports, cached)
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+
+        label = "cached" if cached else "rebuilt"
+        print(
+            f"{label:<10}{size:>14,}{best * 1000:>10.1f}"
+            f"{best * 1000 / args.reports:>12.3f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
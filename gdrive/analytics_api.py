@@ -9,12 +9,28 @@ from typing import Optional
 import fastapi
 from pydantic import BaseModel
 from fastapi import responses
-from gdrive import analytics_client, error
+from gdrive import analytics_client, error, settings
 from gdrive.idva import flow_analytics
+from gdrive.idva.backfill import BackfillRunner
 
 log = logging.getLogger(__name__)
 router = fastapi.APIRouter()
 
+backfills = BackfillRunner(
+    lambda day, dry_run, df: flow_analytics.create_report(day, day, dry_run, df),
+    workers=settings.ANALYTICS_BACKFILL_WORKERS,
+    max_attempts=settings.ANALYTICS_BACKFILL_MAX_ATTEMPTS,
+    retry_backoff=settings.ANALYTICS_BACKFILL_RETRY_BACKOFF,
+    # Created once, so reports created at once do not each create the folder
+    prepare=lambda dry_run: None if dry_run else flow_analytics.analytics_folder(),
+    max_days=settings.ANALYTICS_BACKFILL_MAX_DAYS,
+    keep=settings.ANALYTICS_BACKFILL_KEEP,
+    download=lambda days: analytics_client.download_frames(
+        settings.ANALYTICS_PROPERTY_ID, days
+    ),
+    batch=analytics_client.BATCH_REPORTS,
+)
+
 
 class AnalyticsRequest(BaseModel):
     startDate: str
@@ -22,7 +38,9 @@ class AnalyticsRequest(BaseModel):
 
 
 @router.post("/analytics")
-async def run_analytics_default(req: Optional[AnalyticsRequest] = None):
+async def run_analytics_default(
+    req: Optional[AnalyticsRequest] = None, dryRun: bool = False, backfill: bool = False
+):
     start = None
     end = None
     message = None
@@ -44,16 +62,83 @@ async def run_analytics_default(req: Optional[AnalyticsRequest] = None):
                 content="Failed (invalid date parameters): %s" % (err),
             )
 
+    if backfill:
+        try:
+            started = backfills.start(start, end or start, dryRun)
+        except ValueError as err:
+            # @suppress("py/stack-trace-exposure")
+            return responses.JSONResponse(
+                status_code=422,
+                content="Failed (invalid date parameters): %s" % (err),
+            )
+        except Exception as err:
+            log.exception(err)
+            return responses.JSONResponse(
+                status_code=500, content="Backfill failed to start"
+            )
+        return responses.JSONResponse(
+            status_code=202, content=backfills.status(started.id)
+        )
+
     try:
-        run_analytics(start, end)
+        run_analytics(start, end, dryRun)
     except Exception as err:
         return responses.JSONResponse(
             status_code=500, content="Report generation failed"
         )
 
+    if dryRun:
+        message = "Dry run: %s" % (message)
     return responses.JSONResponse(status_code=202, content=message)
 
 
+@router.get("/analytics/backfill/{backfillId}")
+async def backfill_status(backfillId: str):
+    """
+    Progress of a backfill, with the state of each day
+    """
+    status = backfills.status(backfillId)
+    if status is None:
+        return responses.JSONResponse(
+            status_code=404, content=f"No backfill found for {backfillId}"
+        )
+    return responses.JSONResponse(status_code=200, content=status)
+
+
+@router.post("/analytics/backfill/{backfillId}/retry")
+async def retry_backfill(backfillId: str):
+    """
+    Queue the failed days of a backfill again
+    """
+    started = backfills.retry(backfillId)
+    if started is None:
+        return responses.JSONResponse(
+            status_code=404, content=f"No backfill found for {backfillId}"
+        )
+    return responses.JSONResponse(status_code=202, content=backfills.status(started.id))
+
+
+@router.post("/analytics/template")
+async def create_template(dryRun: bool = False):
+    try:
+        template_id = flow_analytics.create_template(dryRun)
+    except Exception as err:
+        log.exception(err)
+        return responses.JSONResponse(
+            status_code=500, content="Template generation failed"
+        )
+
+    if dryRun:
+        return responses.JSONResponse(
+            status_code=202, content="Dry run: Analytics report template complete."
+        )
+    return responses.JSONResponse(
+        status_code=202,
+        content="Analytics report template %s complete. Set it as "
+        "GDRIVE_ANALYTICS_TEMPLATE_ID to copy reports from it." % (template_id),
+    )
+
+
 @router.post("/analytics/list")
 async def list_accounts():
     list_accounts()
@@ -62,9 +147,9 @@ async def list_accounts():
     )
 
 
-def run_analytics(start_date: datetime, end_date: datetime):
+def run_analytics(start_date: datetime, end_date: datetime, dry_run: bool = False):
     try:
-        flow_analytics.create_report(start_date, end_date)
+        flow_analytics.create_report(start_date, end_date, dry_run)
     except Exception as e:
         log.exception(e)
         raise error("Report generation failed")
@@ -1,30 +1,77 @@
 import datetime
+import functools
+import threading
+from concurrent import futures
+from typing import List, Tuple
 
 from google.oauth2 import service_account
 from google.analytics.admin import AnalyticsAdminServiceClient
 from google.analytics.data_v1beta import BetaAnalyticsDataClient
 from google.analytics.data_v1beta.types import (
+    BatchRunReportsRequest,
     DateRange,
     Dimension,
     Metric,
+    MetricType,
     RunReportRequest,
     RunReportResponse,
 )
 
 import logging
+import numpy as np
 import pandas as pd
 
-from gdrive import settings
+from gdrive import disk_cache, settings
+from gdrive.rate_limit import RateLimiter
 
 log = logging.getLogger(__name__)
 
-creds = service_account.Credentials.from_service_account_info(
-    settings.ANALYTICS_CREDENTIALS
-)
 
 API_DATE_FORMAT = "%Y-%m-%d"
 
-TRANSPORT = "rest"
+# "rest" or "grpc", see `ANALYTICS_TRANSPORT`
+TRANSPORT = settings.ANALYTICS_TRANSPORT
+
+# Reports requested in a single batchRunReports call, at most 5 in the GA4 API
+BATCH_REPORTS = 5
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+# Reports of complete days, as parquet files, disabled when no directory is
+# configured. The version changes with the layout of cached frames.
+report_cache = (
+    disk_cache.DiskCache(
+        settings.ANALYTICS_CACHE_DIR, settings.ANALYTICS_CACHE_MAX_BYTES, "analytics"
+    )
+    if settings.ANALYTICS_CACHE_DIR
+    else None
+)
+CACHE_VERSION = "parquet-1"
+
+# Shared by every download, including the pages and days downloaded at once
+limiter = RateLimiter(
+    settings.ANALYTICS_REQUESTS_PER_SECOND,
+    settings.ANALYTICS_REQUESTS_BURST,
+    name="analytics",
+)
+
+# https://developers.google.com/analytics/devguides/reporting/data/v1/api-schema
+DIMENSIONS = [
+    "eventName",
+    "firstUserCampaignName",
+    "firstUserMedium",
+    "firstUserSource",
+    "isConversionEvent",
+    "linkUrl",
+]
+METRICS = [
+    "eventCount",
+    "sessions",
+    "totalUsers",
+    "eventCountPerUser",
+    "conversions",
+]
 
 """
 Client for the Google Analytics (GA4) API
@@ -34,45 +81,310 @@ for the IDVA flow.
 """
 
 
+@functools.lru_cache(maxsize=None)
+def credentials() -> service_account.Credentials:
+    """
+    Service account credentials of the analytics APIs, loaded on first use
+    """
+    return service_account.Credentials.from_service_account_info(
+        settings.ANALYTICS_CREDENTIALS
+    )
+
+
+def data_client(transport: str = None) -> BetaAnalyticsDataClient:
+    """
+    Data API client of the transport, created on first use and shared by every
+    download, so its connections and credentials are reused between reports.
+    """
+    transport = transport or TRANSPORT
+    with _clients_lock:
+        if transport not in _clients:
+            _clients[transport] = BetaAnalyticsDataClient(
+                credentials=credentials(), transport=transport
+            )
+        return _clients[transport]
+
+
 def download(
-    property_id, target_date: datetime, end_date: datetime = None
+    property_id,
+    target_date: datetime,
+    end_date: datetime = None,
+    client: BetaAnalyticsDataClient = None,
+    page_size: int = None,
+    workers: int = None,
+    dimensions: List[str] = None,
+    metrics: List[str] = None,
 ) -> RunReportResponse:
     """
     Access Google Analytics (GA4) api and download desired analytics report.
+
+    The report is downloaded in pages of `page_size` rows. The first page gives the
+    total number of rows, the remaining pages are then downloaded with up to
+    `workers` requests at once and their rows added to the first page in order.
+
+    Args:
+        property_id: GA4 property of the report
+        target_date (datetime): First day of the report
+        end_date (datetime): Last day of the report, the target date by default
+        client (BetaAnalyticsDataClient): Client sending the requests, the shared
+            client of `data_client` by default
+        page_size (int): Rows requested at once, see `ANALYTICS_PAGE_SIZE`
+        workers (int): Pages requested at once, see `ANALYTICS_DOWNLOAD_WORKERS`
+        dimensions (List[str]): Dimensions of the report, `DIMENSIONS` by default
+        metrics (List[str]): Metrics of the report, `METRICS` by default
+
+    Returns:
+        RunReportResponse: the first page, holding the rows of every page
+    """
+    if end_date is None:
+        end_date = target_date
+    client = client or data_client()
+
+    request = report_request(
+        property_id,
+        target_date,
+        end_date,
+        limit=page_size,
+        dimensions=dimensions,
+        metrics=metrics,
+    )
+    limiter.acquire()
+    return download_pages(client, request, client.run_report(request), workers)
+
+
+def download_frame(
+    property_id,
+    target_date: datetime,
+    end_date: datetime = None,
+    client: BetaAnalyticsDataClient = None,
+    dimensions: List[str] = None,
+    metrics: List[str] = None,
+) -> pd.DataFrame:
+    """
+    Download an analytics report as a frame of `analytics_frame`, served from the
+    local report cache when the date range is complete, see `is_complete`.
     """
     if end_date is None:
         end_date = target_date
+    key = cache_key(property_id, target_date, end_date, dimensions, metrics)
+    cached = report_cache is not None and is_complete(end_date)
+
+    if cached:
+        df = cached_frame(key)
+        if df is not None:
+            return df
+
+    df = analytics_frame(
+        download(
+            property_id,
+            target_date,
+            end_date,
+            client=client,
+            dimensions=dimensions,
+            metrics=metrics,
+        )
+    )
+    if cached:
+        cache_frame(key, df)
+    return df
+
+
+def download_frames(
+    property_id,
+    days: List[datetime],
+    client: BetaAnalyticsDataClient = None,
+) -> List[pd.DataFrame]:
+    """
+    Download the report of each single day as in `download_frame`. The days missing
+    from the report cache are requested together through `batch_download`, so up to
+    `BATCH_REPORTS` days take a single batchRunReports call.
+
+    Returns:
+        List[pd.DataFrame]: frame of `analytics_frame` of each day, in order
+    """
+    frames = [None] * len(days)
+    missing = []
+    for idx, day in enumerate(days):
+        if report_cache is not None and is_complete(day):
+            frames[idx] = cached_frame(cache_key(property_id, day, day))
+        if frames[idx] is None:
+            missing.append(idx)
+
+    if missing:
+        reports = batch_download(
+            property_id,
+            date_range_requests(
+                property_id, [(days[idx], days[idx]) for idx in missing]
+            ),
+            client=client,
+        )
+        for idx, report in zip(missing, reports):
+            frames[idx] = analytics_frame(report)
+            if report_cache is not None and is_complete(days[idx]):
+                cache_frame(cache_key(property_id, days[idx], days[idx]), frames[idx])
+    return frames
+
+
+def cached_frame(key: str) -> pd.DataFrame | None:
+    file = report_cache.open(key, CACHE_VERSION)
+    if file is None:
+        return None
+    with file:
+        return pd.read_parquet(file)
+
+
+def cache_frame(key: str, df: pd.DataFrame) -> None:
+    try:
+        with report_cache.writer(key, CACHE_VERSION) as file:
+            df.to_parquet(file, index=False)
+    except OSError as e:
+        log.warning(f"Unable to cache analytics report {key}: {e}")
+
+
+def cache_key(
+    property_id,
+    target_date: datetime,
+    end_date: datetime,
+    dimensions: List[str] = None,
+    metrics: List[str] = None,
+) -> str:
+    return "%s/%s/%s/%s/%s" % (
+        property_id,
+        format_date_for_api(target_date),
+        format_date_for_api(end_date),
+        ",".join(dimensions or DIMENSIONS),
+        ",".join(metrics or METRICS),
+    )
 
-    request = RunReportRequest(
+
+def is_complete(end_date: datetime, today: datetime = None) -> bool:
+    """
+    Whether the analytics data of every day up to the end date is final. Google
+    Analytics keeps processing the data of a day for a while after it ends, so
+    days within `ANALYTICS_CACHE_SETTLE_DAYS` of today are incomplete.
+    """
+    today = (today or datetime.datetime.now()).date()
+    end = end_date.date() if isinstance(end_date, datetime.datetime) else end_date
+    return (today - end).days >= settings.ANALYTICS_CACHE_SETTLE_DAYS
+
+
+def batch_download(
+    property_id,
+    requests: List[RunReportRequest],
+    client: BetaAnalyticsDataClient = None,
+    workers: int = None,
+) -> List[RunReportResponse]:
+    """
+    Download several reports of the property, i.e. of different date ranges or
+    dimensions, with up to `BATCH_REPORTS` reports per batchRunReports call.
+    Reports with more rows than their page size are completed as in `download`.
+
+    Args:
+        property_id: GA4 property of the reports
+        requests (List[RunReportRequest]): Reports to download, see `report_request`
+        client (BetaAnalyticsDataClient): Client sending the requests
+        workers (int): Pages of a report requested at once
+
+    Returns:
+        List[RunReportResponse]: each report, in the order of the requests
+    """
+    client = client or data_client()
+
+    reports = []
+    for idx in range(0, len(requests), BATCH_REPORTS):
+        limiter.acquire()
+        response = client.batch_run_reports(
+            BatchRunReportsRequest(
+                property=f"properties/{property_id}",
+                requests=requests[idx : idx + BATCH_REPORTS],
+            )
+        )
+        reports.extend(response.reports)
+
+    return [
+        download_pages(client, request, report, workers)
+        for request, report in zip(requests, reports)
+    ]
+
+
+def download_pages(
+    client: BetaAnalyticsDataClient,
+    request: RunReportRequest,
+    response: RunReportResponse,
+    workers: int = None,
+) -> RunReportResponse:
+    """
+    Download the pages of a report after its first, adding their rows to the
+    response of the first page
+    """
+    workers = workers or settings.ANALYTICS_DOWNLOAD_WORKERS
+    offsets = range(request.offset + request.limit, response.row_count, request.limit)
+    if not offsets:
+        return response
+
+    log.info(
+        f"Downloading {response.row_count} rows in {len(offsets) + 1} pages "
+        f"of {request.limit}"
+    )
+
+    def page(offset: int) -> RunReportResponse:
+        page_request = RunReportRequest(request)
+        page_request.offset = offset
+        limiter.acquire()
+        return client.run_report(page_request)
+
+    with futures.ThreadPoolExecutor(
+        max_workers=max(min(workers, len(offsets)), 1)
+    ) as executor:
+        for rows in executor.map(page, offsets):
+            response.rows.extend(rows.rows)
+
+    if len(response.rows) != response.row_count:
+        log.warning(
+            f"Downloaded {len(response.rows)} of {response.row_count} rows, "
+            "the report changed while it was downloaded"
+        )
+    return response
+
+
+def report_request(
+    property_id,
+    target_date: datetime,
+    end_date: datetime = None,
+    offset: int = 0,
+    limit: int = None,
+    dimensions: List[str] = None,
+    metrics: List[str] = None,
+) -> RunReportRequest:
+    """
+    Request for a single page of the analytics report of the date range, of the
+    `DIMENSIONS` and `METRICS` unless others are given
+    """
+    return RunReportRequest(
         property=f"properties/{property_id}",
-        limit="250",
-        # https://developers.google.com/analytics/devguides/reporting/data/v1/api-schema
-        dimensions=[
-            Dimension(name="eventName"),
-            Dimension(name="firstUserCampaignName"),
-            Dimension(name="firstUserMedium"),
-            Dimension(name="firstUserSource"),
-            Dimension(name="isConversionEvent"),
-            Dimension(name="linkUrl"),
-        ],
-        metrics=[
-            Metric(name="eventCount"),
-            Metric(name="sessions"),
-            Metric(name="totalUsers"),
-            Metric(name="eventCountPerUser"),
-            Metric(name="conversions"),
-        ],
+        offset=offset,
+        limit=limit or settings.ANALYTICS_PAGE_SIZE,
+        dimensions=[Dimension(name=name) for name in dimensions or DIMENSIONS],
+        metrics=[Metric(name=name) for name in metrics or METRICS],
         date_ranges=[
             DateRange(
                 start_date=format_date_for_api(target_date),
-                end_date=format_date_for_api(end_date),
+                end_date=format_date_for_api(end_date or target_date),
             )
         ],
     )
 
-    return BetaAnalyticsDataClient(credentials=creds, transport=TRANSPORT).run_report(
-        request
-    )
+
+def date_range_requests(
+    property_id, date_ranges: List[Tuple[datetime, datetime]], limit: int = None
+) -> List[RunReportRequest]:
+    """
+    Requests for the analytics report of each (start, end) date range
+    """
+    return [
+        report_request(property_id, start, end, limit=limit)
+        for start, end in date_ranges
+    ]
 
 
 def list():
@@ -80,7 +392,7 @@ def list():
     List the available properties the user has access to. Can be run to
     verify setup of the enviornment is correct.
     """
-    client = AnalyticsAdminServiceClient(credentials=creds, transport=TRANSPORT)
+    client = AnalyticsAdminServiceClient(credentials=credentials(), transport=TRANSPORT)
     return client.list_accounts()
 
 
@@ -91,26 +403,55 @@ def format_date_for_api(date: datetime):
     return date.strftime(API_DATE_FORMAT)
 
 
+def analytics_frame(response: RunReportResponse) -> pd.DataFrame:
+    """
+    Columnar DataFrame of an analytics report, with a column named after each
+    dimension and metric. Dimensions are strings, integer metrics are int64 and
+    every other metric is float64.
+
+    One array is allocated per column and filled from the raw protobuf rows, which
+    avoids building a list for every row and wrapping every value.
+    """
+    pb = RunReportResponse.pb(response)
+    count = len(pb.rows)
+    dimensions = [np.empty(count, dtype=object) for _ in pb.dimension_headers]
+    metrics = [np.empty(count, dtype=object) for _ in pb.metric_headers]
+
+    for idx, row in enumerate(pb.rows):
+        for column, value in zip(dimensions, row.dimension_values):
+            column[idx] = value.value
+        for column, value in zip(metrics, row.metric_values):
+            column[idx] = value.value
+
+    columns = {}
+    for header, values in zip(pb.dimension_headers, dimensions):
+        columns[header.name] = values
+    for header, values in zip(pb.metric_headers, metrics):
+        dtype = np.int64 if header.type_ == MetricType.TYPE_INTEGER else np.float64
+        columns[header.name] = values.astype(dtype)
+    return pd.DataFrame(columns)
+
+
+def sheet_frame(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Adapt a frame of `analytics_frame` to the layout written to the report sheet:
+    integer column labels, with the column names as the first row. The columns are
+    copied as they are, without converting the rows to lists.
+    """
+    header = pd.DataFrame([df.columns.tolist()])
+    return pd.concat(
+        [header, df.set_axis(range(len(df.columns)), axis=1)], ignore_index=True
+    )
+
+
 def create_df_from_analytics_response(response: RunReportResponse):
     """
     Extracts values from Google Analytics API response and transforms
     them into pandas DataFrame for ease of use. This enables the analytics
     client to do any processing of the data desired, if something comes up in
     the future we want to do but isnt supported in GA4.
+
+    The first row holds the column names, see `analytics_frame` for a frame with
+    named and typed columns.
     """
-    all_headers = []
-    for _, header in enumerate(response.dimension_headers):
-        all_headers += [header.name]
-    for _, header in enumerate(response.metric_headers):
-        all_headers += [header.name]
-
-    arr = [all_headers]
-    for _, row in enumerate(response.rows):
-        row_li = []
-        for _, val in enumerate(row.dimension_values):
-            row_li += [val.value]
-        for _, val in enumerate(row.metric_values):
-            row_li += [val.value]
-        arr += [row_li]
-
-    return pd.DataFrame(arr)
+    return sheet_frame(analytics_frame(response))
@@ -50,18 +50,19 @@ async def upload_file(
 
         stream = io.BytesIO(body)
 
-        parent = drive_client.create_folder(id, settings.ROOT_DIRECTORY)
-
         if zip:
             with zipfile.ZipFile(stream) as archive:
                 files = archive.filelist
                 for file in files:
                     image = io.BytesIO(archive.read(file))
-                    drive_client.upload_basic(
-                        f"{filename}_{file.filename}", parent, image
+                    drive_client.upload_to_folder(
+                        id,
+                        settings.ROOT_DIRECTORY,
+                        f"{filename}_{file.filename}",
+                        image,
                     )
         else:
-            drive_client.upload_basic(filename, parent, stream)
+            drive_client.upload_to_folder(id, settings.ROOT_DIRECTORY, filename, stream)
 
     except HttpError as error:
         log.error(f"An error occurred: {error}")
@@ -75,10 +76,11 @@ async def delete_file(filename, response: Response):
     """
 
     try:
-        files = drive_client.get_files(filename)
-        if files:
-            for file in files:
-                drive_client.delete_file(file["id"])
+        # Collect every page first, deleting while paging could skip results
+        ids = [file["id"] for file in drive_client.get_files(filename, fields="id")]
+        if ids:
+            for id in ids:
+                drive_client.delete_file(id)
         else:
             response.status_code = status.HTTP_404_NOT_FOUND
 
@@ -0,0 +1,155 @@
+"""
+Micro-batches of rows appended to a spreadsheet.
+
+Rows appended from many threads are collected and written together, once the
+buffer holds `max_rows` rows or its oldest row has waited `max_latency` seconds.
+Each caller gets a future of the outcome of its own row. Rows still buffered when
+the buffer is stopped are written before it returns.
+"""
+
+import logging
+import threading
+import time
+from concurrent.futures import Future
+from typing import Callable, List
+
+import prometheus_client
+
+log = logging.getLogger(__name__)
+
+BUFFER_ROWS = prometheus_client.Gauge(
+    "gdrive_append_buffer_rows", "Rows waiting to be appended", ["buffer"]
+)
+FLUSH_ROWS = prometheus_client.Histogram(
+    "gdrive_append_buffer_flush_rows",
+    "Rows written by a single append",
+    ["buffer"],
+    buckets=(1, 2, 5, 10, 25, 50, 100, 250, 500, float("inf")),
+)
+FLUSH_LATENCY = prometheus_client.Histogram(
+    "gdrive_append_buffer_latency_seconds",
+    "Time from a row being buffered until it was written",
+    ["buffer"],
+    buckets=(0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, float("inf")),
+)
+FLUSHES = prometheus_client.Counter(
+    "gdrive_append_buffer_flushes_total", "Appends by outcome", ["buffer", "outcome"]
+)
+
+
+class AppendBuffer:
+    """
+    Args:
+        write (Callable): Writes a list of rows in a single transaction, returning
+            the outcome of each row in the same order. Raising fails every row.
+        max_rows (int): Rows written at once, a full buffer is written right away
+        max_latency (float): Seconds a row waits for others before it is written
+        name (str): Label of the buffer's metrics
+    """
+
+    def __init__(
+        self,
+        write: Callable[[List[list]], list],
+        max_rows: int,
+        max_latency: float,
+        name: str = "default",
+    ) -> None:
+        self.write = write
+        self.max_rows = max(max_rows, 1)
+        self.max_latency = max_latency
+        self.name = name
+        self._rows = []
+        self._stopping = False
+        self._cond = threading.Condition()
+        self._thread = None
+
+    def __len__(self) -> int:
+        with self._cond:
+            return len(self._rows)
+
+    def start(self) -> None:
+        with self._cond:
+            self._stopping = False
+        self._thread = threading.Thread(
+            target=self._run, name=f"append-buffer-{self.name}", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self, timeout: float = None) -> None:
+        """
+        Stop the buffer, writing every row that is still buffered
+        """
+        with self._cond:
+            self._stopping = True
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+        while self.flush():
+            pass
+
+    def append(self, row: list) -> Future:
+        """
+        Buffer a row. Rows are written right away while the buffer is not started.
+
+        Returns:
+            Future: outcome of the row, as returned by `write`
+        """
+        entry = (row, Future(), time.monotonic())
+        with self._cond:
+            if self._thread is not None:
+                self._rows.append(entry)
+                BUFFER_ROWS.labels(self.name).set(len(self._rows))
+                # The first row starts the latency timer, a full buffer is written
+                if len(self._rows) in (1, self.max_rows):
+                    self._cond.notify_all()
+                return entry[1]
+
+        self._write([entry])
+        return entry[1]
+
+    def flush(self) -> int:
+        """
+        Write up to `max_rows` buffered rows
+
+        Returns:
+            int: number of rows written
+        """
+        with self._cond:
+            entries = self._rows[: self.max_rows]
+            self._rows = self._rows[self.max_rows :]
+            BUFFER_ROWS.labels(self.name).set(len(self._rows))
+        if entries:
+            self._write(entries)
+        return len(entries)
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                while not self._stopping and len(self._rows) < self.max_rows:
+                    timeout = None
+                    if self._rows:
+                        timeout = self._rows[0][2] + self.max_latency - time.monotonic()
+                        if timeout <= 0:
+                            break
+                    self._cond.wait(timeout)
+                if self._stopping and not self._rows:
+                    return
+            self.flush()
+
+    def _write(self, entries: list) -> None:
+        try:
+            outcomes = self.write([row for row, _, _ in entries])
+        except Exception as e:
+            FLUSHES.labels(self.name, "error").inc()
+            log.error(f"Unable to append {len(entries)} rows: {e}")
+            for _, future, _ in entries:
+                future.set_exception(e)
+            return
+
+        FLUSHES.labels(self.name, "success").inc()
+        FLUSH_ROWS.labels(self.name).observe(len(entries))
+        now = time.monotonic()
+        for (_, future, queued_at), outcome in zip(entries, outcomes):
+            FLUSH_LATENCY.labels(self.name).observe(now - queued_at)
+            future.set_result(outcome)
@@ -0,0 +1,151 @@
+"""
+Zip archives streamed as they are written.
+
+Archive entries are downloaded concurrently by a pool of threads while the archive
+is written in order. Memory is bounded by the prefetch window: at most `window`
+entries are downloaded at once, each buffering at most `buffer_chunks` chunks.
+"""
+
+import io
+import logging
+import queue
+import threading
+import time
+import zipfile
+from concurrent import futures
+from typing import Any, Callable, Iterable, Iterator, List, Tuple
+
+log = logging.getLogger(__name__)
+
+# Content that is already compressed is stored as is
+STORED_MIMETYPES = (
+    "image/",
+    "video/",
+    "audio/",
+    "application/zip",
+    "application/gzip",
+    "application/pdf",
+)
+
+_DONE = object()
+
+
+class _StreamBuffer(io.RawIOBase):
+    """
+    Unseekable file collecting the bytes written to it until they are taken
+    """
+
+    def __init__(self) -> None:
+        super().__init__()
+        self._buffer = bytearray()
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        self._buffer += data
+        return len(data)
+
+    def take(self) -> bytes:
+        data = bytes(self._buffer)
+        self._buffer.clear()
+        return data
+
+
+def compress_type(mimetype: str | None) -> int:
+    if mimetype and mimetype.startswith(STORED_MIMETYPES):
+        return zipfile.ZIP_STORED
+    return zipfile.ZIP_DEFLATED
+
+
+def unique_names(names: List[str]) -> List[str]:
+    """
+    Archive names for the files, made unique by numbering repeated names
+    """
+    seen = {}
+    unique = []
+    for name in names:
+        name = name.replace("/", "_") or "untitled"
+        count = seen.get(name, 0)
+        seen[name] = count + 1
+        if count:
+            stem, dot, ext = name.rpartition(".")
+            name = f"{stem} ({count}).{ext}" if dot and stem else f"{name} ({count})"
+        unique.append(name)
+    return unique
+
+
+def stream_zip(
+    entries: List[Tuple[str, int, Any]],
+    fetch: Callable[[Any], Iterable[bytes]],
+    window: int,
+    buffer_chunks: int,
+) -> Iterator[bytes]:
+    """
+    Write a zip archive of the entries, yielding it in chunks as it is written.
+
+    Args:
+        entries (List[Tuple[str, int, Any]]): (archive name, compress type, source)
+            of each archive entry
+        fetch (Callable): Returns the content of a source in chunks, called from
+            worker threads
+        window (int): Most entries downloaded at once
+        buffer_chunks (int): Most chunks buffered per entry
+    Yields:
+        bytes: the archive
+    """
+    window = max(window, 1)
+    stop = threading.Event()
+
+    def produce(source, chunks: queue.Queue) -> None:
+        def put(item) -> bool:
+            while not stop.is_set():
+                try:
+                    chunks.put(item, timeout=0.5)
+                    return True
+                except queue.Full:
+                    continue
+            return False
+
+        try:
+            for chunk in fetch(source):
+                if not put(chunk):
+                    return
+            put(_DONE)
+        except Exception as e:
+            put(e)
+
+    buffer = _StreamBuffer()
+    with futures.ThreadPoolExecutor(max_workers=window) as executor:
+        pending = []
+        remaining = iter(entries)
+
+        def submit() -> None:
+            entry = next(remaining, None)
+            if entry is not None:
+                chunks = queue.Queue(maxsize=max(buffer_chunks, 1))
+                executor.submit(produce, entry[2], chunks)
+                pending.append((entry, chunks))
+
+        try:
+            for _ in range(window):
+                submit()
+
+            with zipfile.ZipFile(buffer, "w") as archive:
+                while pending:
+                    (name, compression, _), chunks = pending.pop(0)
+                    info = zipfile.ZipInfo(name, date_time=time.localtime()[:6])
+                    info.compress_type = compression
+                    with archive.open(info, "w", force_zip64=True) as file:
+                        while (chunk := chunks.get()) is not _DONE:
+                            if isinstance(chunk, Exception):
+                                raise chunk
+                            file.write(chunk)
+                            if data := buffer.take():
+                                yield data
+                    submit()
+            if data := buffer.take():
+                yield data
+        finally:
+            # Release producers blocked on a full buffer if the download was cut short
+            stop.set()
@@ -1,5 +1,7 @@
+import datetime
+
 import sqlalchemy
-from sqlalchemy import orm
+from sqlalchemy import exc, orm
 
 from gdrive.database import database, models
 
@@ -11,3 +13,405 @@ def create_participant(db_item: models.ParticipantModel):
     session.refresh(db_item)
     session.close()
     return db_item
+
+
+def create_participants(db_items: list) -> None:
+    """
+    Insert participants in one bulk statement
+    """
+    with database.SessionLocal() as session:
+        session.bulk_save_objects(db_items)
+        session.commit()
+
+
+def participant_response_ids(response_ids: list) -> set:
+    """
+    Subset of the response ids that already have a participant
+    """
+    if not response_ids:
+        return set()
+
+    with database.SessionLocal() as session:
+        return {
+            row.response_id
+            for row in session.query(models.ParticipantModel.response_id).filter(
+                models.ParticipantModel.response_id.in_(response_ids)
+            )
+        }
+
+
+def participant_exists(response_id: str) -> bool:
+    with database.SessionLocal() as session:
+        query = session.query(models.ParticipantModel.id).filter(
+            models.ParticipantModel.response_id == response_id
+        )
+        return session.query(query.exists()).scalar()
+
+
+# ------------------------------- Export Queue -------------------------------------
+
+
+def enqueue_export_job(
+    response_id: str,
+    survey_id: str,
+    payload: str,
+    force: bool = False,
+    batch_id: str = None,
+) -> models.ExportJobModel:
+    """
+    Add a survey export job to the queue. A job that is already queued or running
+    for the response id is returned as is, as is a job that already succeeded unless
+    `force` is set. Failed jobs are queued again.
+    """
+    now = datetime.datetime.utcnow()
+    with database.SessionLocal() as session:
+        job = (
+            session.query(models.ExportJobModel)
+            .filter(models.ExportJobModel.response_id == response_id)
+            .first()
+        )
+        if job is None:
+            job = models.ExportJobModel(response_id=response_id)
+            session.add(job)
+        elif job.state in (
+            models.ExportJobState.QUEUED,
+            models.ExportJobState.RUNNING,
+        ):
+            return job
+        elif job.state == models.ExportJobState.SUCCEEDED and not force:
+            return job
+
+        job.survey_id = survey_id
+        job.batch_id = batch_id
+        job.payload = payload
+        job.state = models.ExportJobState.QUEUED
+        job.attempts = 0
+        job.last_error = None
+        job.available_at = now
+        job.created_at = now
+        job.started_at = None
+        job.finished_at = None
+
+        try:
+            session.commit()
+        except exc.IntegrityError:
+            # Another instance queued the same response id first
+            session.rollback()
+            return get_export_job(response_id)
+
+        session.refresh(job)
+        return job
+
+
+def enqueue_export_jobs(items: list, batch_id: str) -> list:
+    """
+    Add the jobs of a bulk request to the queue in one transaction. Jobs are
+    de-duplicated as in `enqueue_export_job`.
+
+    Args:
+        items (list): (response_id, survey_id, payload, force) tuples
+        batch_id (str): Id shared by the jobs of the bulk request
+    """
+    now = datetime.datetime.utcnow()
+    with database.SessionLocal() as session:
+        existing = {
+            job.response_id: job
+            for job in session.query(models.ExportJobModel).filter(
+                models.ExportJobModel.response_id.in_([item[0] for item in items])
+            )
+        }
+
+        jobs = {}
+        for response_id, survey_id, payload, force in items:
+            job = existing.get(response_id)
+            if job is None:
+                job = models.ExportJobModel(response_id=response_id)
+                session.add(job)
+                existing[response_id] = job
+            elif job.state in (
+                models.ExportJobState.QUEUED,
+                models.ExportJobState.RUNNING,
+            ) or (job.state == models.ExportJobState.SUCCEEDED and not force):
+                jobs[response_id] = job
+                continue
+
+            job.survey_id = survey_id
+            job.batch_id = batch_id
+            job.payload = payload
+            job.state = models.ExportJobState.QUEUED
+            job.attempts = 0
+            job.last_error = None
+            job.available_at = now
+            job.created_at = now
+            job.started_at = None
+            job.finished_at = None
+            jobs[response_id] = job
+
+        try:
+            session.commit()
+        except exc.IntegrityError:
+            # Another instance queued some of the same response ids first
+            session.rollback()
+            return [enqueue_export_job(*item, batch_id=batch_id) for item in items]
+
+        for job in jobs.values():
+            session.refresh(job)
+        return [*jobs.values()]
+
+
+def claim_export_job(
+    visibility_timeout: int, max_attempts: int = None
+) -> models.ExportJobModel | None:
+    """
+    Claim the next available job, marking it running and hiding it from other
+    workers for `visibility_timeout` seconds. A job whose worker disappeared
+    becomes claimable again once that time has passed, unless it was already
+    attempted `max_attempts` times: it is then marked failed instead.
+    """
+    jobs = claim_export_jobs(visibility_timeout, max_attempts=max_attempts)
+    return jobs[0] if jobs else None
+
+
+def claim_export_jobs(
+    visibility_timeout: int,
+    batch_id: str = None,
+    limit: int = 1,
+    max_attempts: int = None,
+) -> list:
+    """
+    Claim up to `limit` available jobs, optionally only those of a bulk request.
+    See `claim_export_job`.
+    """
+    claimed = []
+    if limit < 1:
+        return claimed
+
+    with database.SessionLocal() as session:
+        now = datetime.datetime.utcnow()
+        if max_attempts is not None:
+            # The worker of each of these jobs disappeared during its last attempt
+            session.query(models.ExportJobModel).filter(
+                models.ExportJobModel.state == models.ExportJobState.RUNNING,
+                models.ExportJobModel.available_at <= now,
+                models.ExportJobModel.attempts >= max_attempts,
+            ).update(
+                {
+                    "state": models.ExportJobState.FAILED,
+                    "last_error": "Abandoned during attempt %s" % (max_attempts),
+                    "finished_at": now,
+                    "payload": None,
+                },
+                synchronize_session=False,
+            )
+
+        query = session.query(models.ExportJobModel).filter(
+            models.ExportJobModel.state.in_(
+                [models.ExportJobState.QUEUED, models.ExportJobState.RUNNING]
+            ),
+            models.ExportJobModel.available_at <= now,
+        )
+        if max_attempts is not None:
+            query = query.filter(models.ExportJobModel.attempts < max_attempts)
+        if batch_id is not None:
+            query = query.filter(models.ExportJobModel.batch_id == batch_id)
+
+        candidates = (
+            query.order_by(models.ExportJobModel.available_at)
+            .limit(limit)
+            .with_for_update(skip_locked=True)
+            .all()
+        )
+        for job in candidates:
+            # Guard against a concurrent claim on databases without row locks
+            updated = (
+                session.query(models.ExportJobModel)
+                .filter(
+                    models.ExportJobModel.id == job.id,
+                    models.ExportJobModel.available_at == job.available_at,
+                )
+                .update(
+                    {
+                        "state": models.ExportJobState.RUNNING,
+                        "attempts": job.attempts + 1,
+                        "started_at": now,
+                        "available_at": now
+                        + datetime.timedelta(seconds=visibility_timeout),
+                    },
+                    synchronize_session=False,
+                )
+            )
+            if updated:
+                claimed.append(job.id)
+        session.commit()
+
+        return (
+            session.query(models.ExportJobModel)
+            .filter(models.ExportJobModel.id.in_(claimed))
+            .order_by(models.ExportJobModel.id)
+            .all()
+        )
+
+
+def complete_export_job(job_id: int) -> models.ExportJobModel:
+    with database.SessionLocal() as session:
+        job = session.get(models.ExportJobModel, job_id)
+        job.state = models.ExportJobState.SUCCEEDED
+        job.finished_at = datetime.datetime.utcnow()
+        job.last_error = None
+        job.payload = None
+        session.commit()
+        session.refresh(job)
+        return job
+
+
+def fail_export_job(
+    job_id: int, error: str, max_attempts: int, backoff: int
+) -> models.ExportJobModel:
+    """
+    Record a failed attempt. The job is retried after an exponential backoff
+    until it has been attempted `max_attempts` times.
+    """
+    with database.SessionLocal() as session:
+        job = session.get(models.ExportJobModel, job_id)
+        now = datetime.datetime.utcnow()
+        job.last_error = error
+        if job.attempts >= max_attempts:
+            job.state = models.ExportJobState.FAILED
+            job.finished_at = now
+            job.payload = None
+        else:
+            job.state = models.ExportJobState.QUEUED
+            job.available_at = now + datetime.timedelta(
+                seconds=backoff * 2 ** (job.attempts - 1)
+            )
+        session.commit()
+        session.refresh(job)
+        return job
+
+
+def get_export_job(response_id: str) -> models.ExportJobModel | None:
+    with database.SessionLocal() as session:
+        return (
+            session.query(models.ExportJobModel)
+            .filter(models.ExportJobModel.response_id == response_id)
+            .first()
+        )
+
+
+def get_export_batch(batch_id: str) -> list:
+    with database.SessionLocal() as session:
+        return (
+            session.query(models.ExportJobModel)
+            .filter(models.ExportJobModel.batch_id == batch_id)
+            .order_by(models.ExportJobModel.id)
+            .all()
+        )
+
+
+def count_export_jobs(state: models.ExportJobState) -> int:
+    with database.SessionLocal() as session:
+        return (
+            session.query(sqlalchemy.func.count(models.ExportJobModel.id))
+            .filter(models.ExportJobModel.state == state)
+            .scalar()
+        )
+
+
+# ------------------------------- Export Ledger ------------------------------------
+
+
+def get_export_ledger(interaction_id: str) -> models.ExportLedgerModel | None:
+    with database.SessionLocal() as session:
+        return (
+            session.query(models.ExportLedgerModel)
+            .filter(models.ExportLedgerModel.interaction_id == interaction_id)
+            .first()
+        )
+
+
+def record_export(
+    interaction_id: str, content_hash: str, drive_file_id: str
+) -> models.ExportLedgerModel:
+    """
+    Create or update the ledger entry for an exported interaction
+    """
+    now = datetime.datetime.utcnow()
+    with database.SessionLocal() as session:
+        entry = (
+            session.query(models.ExportLedgerModel)
+            .filter(models.ExportLedgerModel.interaction_id == interaction_id)
+            .first()
+        )
+        if entry is None:
+            entry = models.ExportLedgerModel(
+                interaction_id=interaction_id, created_at=now
+            )
+            session.add(entry)
+
+        entry.content_hash = content_hash
+        entry.drive_file_id = drive_file_id
+        entry.updated_at = now
+
+        try:
+            session.commit()
+        except exc.IntegrityError:
+            # Exported concurrently, the other entry describes the same content
+            session.rollback()
+            return get_export_ledger(interaction_id)
+
+        session.refresh(entry)
+        return entry
+
+
+def delete_export_ledger(drive_file_id: str) -> None:
+    """
+    Forget the exports uploaded to a Drive file, i.e. once the file was deleted
+    """
+    with database.SessionLocal() as session:
+        session.query(models.ExportLedgerModel).filter(
+            models.ExportLedgerModel.drive_file_id == drive_file_id
+        ).delete()
+        session.commit()
+
+
+# ------------------------------- Drive Folders ------------------------------------
+
+
+def get_drive_folder(name: str, parent_id: str) -> str | None:
+    """
+    Id of the recorded folder with the name within the parent folder
+    """
+    with database.SessionLocal() as session:
+        return (
+            session.query(models.DriveFolderModel.folder_id)
+            .filter(
+                models.DriveFolderModel.name == name,
+                models.DriveFolderModel.parent_id == parent_id,
+            )
+            .scalar()
+        )
+
+
+def record_drive_folder(name: str, parent_id: str, folder_id: str) -> None:
+    with database.SessionLocal() as session:
+        session.add(
+            models.DriveFolderModel(
+                name=name,
+                parent_id=parent_id,
+                folder_id=folder_id,
+                created_at=datetime.datetime.utcnow(),
+            )
+        )
+        try:
+            session.commit()
+        except exc.IntegrityError:
+            # Recorded concurrently by another instance
+            session.rollback()
+
+
+def delete_drive_folder(folder_id: str) -> None:
+    with database.SessionLocal() as session:
+        session.query(models.DriveFolderModel).filter(
+            models.DriveFolderModel.folder_id == folder_id
+        ).delete()
+        session.commit()
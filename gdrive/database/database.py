@@ -4,7 +4,7 @@ DB Connection for Gdrive
 
 import logging
 import sqlalchemy
-from sqlalchemy import orm
+from sqlalchemy import orm, pool
 
 from gdrive import settings
 from gdrive.database import models
@@ -21,8 +21,25 @@ if settings.DB_URI:
 
 
 else:
-    log.info("No database configuration found. Creating in memory DB.")
-    engine = sqlalchemy.create_engine("sqlite+pysqlite:///:memory:")
+    # The export workers use the database from their own threads, so the SQLite
+    # connection must be shareable. An in memory DB only exists on the connection
+    # that created it, so it is pinned to a single static connection.
+    if settings.SQLITE_PATH == ":memory:":
+        log.info("No database configuration found. Creating in memory DB.")
+        engine = sqlalchemy.create_engine(
+            "sqlite+pysqlite:///:memory:",
+            connect_args={"check_same_thread": False},
+            poolclass=pool.StaticPool,
+        )
+    else:
+        log.info(
+            "No database configuration found. Using SQLite DB %s."
+            % (settings.SQLITE_PATH)
+        )
+        engine = sqlalchemy.create_engine(
+            "sqlite+pysqlite:///%s" % (settings.SQLITE_PATH),
+            connect_args={"check_same_thread": False},
+        )
     models.Base.metadata.create_all(bind=engine)
 
 
@@ -1,3 +1,5 @@
+from enum import Enum
+
 import sqlalchemy as sqla
 from sqlalchemy.ext import declarative
 
@@ -37,3 +39,92 @@ class ParticipantModel(Base):
             self.income,
             self.skin_tone,
         ]
+
+
+class ExportJobState(str, Enum):
+    QUEUED = "queued"
+    RUNNING = "running"
+    SUCCEEDED = "succeeded"
+    FAILED = "failed"
+
+
+class ExportJobModel(Base):
+    """
+    A `/survey-export` request waiting in, or processed by, the export work queue.
+    Jobs are unique per response id, so duplicate webhook calls share one job.
+    """
+
+    __tablename__ = "export_job"
+    __table_args__ = (
+        sqla.Index("ix_export_job_state_available_at", "state", "available_at"),
+    )
+
+    id = sqla.Column(sqla.Integer, primary_key=True, index=True)
+    response_id = sqla.Column(sqla.String, unique=True, index=True, nullable=False)
+    survey_id = sqla.Column(sqla.String)
+    # Set for jobs queued by a bulk request, which are processed together
+    batch_id = sqla.Column(sqla.String, index=True)
+    # Serialized request body. Cleared once the job finishes, as it holds
+    # participant contact information.
+    payload = sqla.Column(sqla.Text)
+    state = sqla.Column(sqla.String, nullable=False)
+    attempts = sqla.Column(sqla.Integer, nullable=False, default=0)
+    last_error = sqla.Column(sqla.Text)
+    # Jobs are not claimable before this time. Set on claim (visibility timeout)
+    # and on failure (retry backoff).
+    available_at = sqla.Column(sqla.DateTime, nullable=False)
+    created_at = sqla.Column(sqla.DateTime, nullable=False)
+    started_at = sqla.Column(sqla.DateTime)
+    finished_at = sqla.Column(sqla.DateTime)
+
+    def as_status(self) -> dict:
+        def seconds(start, end):
+            if start is None or end is None:
+                return None
+            return (end - start).total_seconds()
+
+        return {
+            "responseId": self.response_id,
+            "batchId": self.batch_id,
+            "state": self.state,
+            "attempts": self.attempts,
+            "error": self.last_error,
+            "createdAt": self.created_at.isoformat() if self.created_at else None,
+            "startedAt": self.started_at.isoformat() if self.started_at else None,
+            "finishedAt": self.finished_at.isoformat() if self.finished_at else None,
+            "waitSeconds": seconds(self.created_at, self.started_at),
+            "runSeconds": seconds(self.started_at, self.finished_at),
+        }
+
+
+class ExportLedgerModel(Base):
+    """
+    Record of the last analytics export uploaded to gdrive for an interaction
+    """
+
+    __tablename__ = "export_ledger"
+
+    id = sqla.Column(sqla.Integer, primary_key=True, index=True)
+    interaction_id = sqla.Column(sqla.String, unique=True, index=True, nullable=False)
+    content_hash = sqla.Column(sqla.String, nullable=False)
+    drive_file_id = sqla.Column(sqla.String)
+    created_at = sqla.Column(sqla.DateTime, nullable=False)
+    updated_at = sqla.Column(sqla.DateTime, nullable=False)
+
+
+class DriveFolderModel(Base):
+    """
+    Drive folder found or created by name within a parent folder, i.e. the folder of
+    an interaction within the root directory
+    """
+
+    __tablename__ = "drive_folder"
+    __table_args__ = (
+        sqla.UniqueConstraint("name", "parent_id", name="uq_drive_folder_name_parent"),
+    )
+
+    id = sqla.Column(sqla.Integer, primary_key=True, index=True)
+    name = sqla.Column(sqla.String, nullable=False)
+    parent_id = sqla.Column(sqla.String, nullable=False)
+    folder_id = sqla.Column(sqla.String, index=True, nullable=False)
+    created_at = sqla.Column(sqla.DateTime, nullable=False)
@@ -0,0 +1,167 @@
+"""
+Size capped, least recently used cache of files on local disk.
+
+Entries are keyed by a string and tagged with a version, i.e. a checksum of the
+cached content. Entries are written to a temporary file and moved into place once
+complete, so readers never see partial content, and the least recently used entries
+are removed once the cache grows beyond its size cap.
+"""
+
+import contextlib
+import glob
+import hashlib
+import logging
+import os
+import tempfile
+import threading
+from typing import BinaryIO, Iterable, Iterator
+
+import prometheus_client
+
+log = logging.getLogger(__name__)
+
+CACHE_HITS = prometheus_client.Counter(
+    "gdrive_cache_hits_total", "Disk cache lookups served from disk", ["cache"]
+)
+CACHE_MISSES = prometheus_client.Counter(
+    "gdrive_cache_misses_total", "Disk cache lookups not found on disk", ["cache"]
+)
+CACHE_EVICTIONS = prometheus_client.Counter(
+    "gdrive_cache_evictions_total", "Disk cache entries removed by size cap", ["cache"]
+)
+CACHE_BYTES = prometheus_client.Gauge(
+    "gdrive_cache_bytes", "Size of the disk cache after the last write", ["cache"]
+)
+
+SUFFIX = ".cache"
+
+
+class DiskCache:
+    """
+    Args:
+        directory (str): Directory holding the cache files, created if missing
+        max_bytes (int): Size cap of the cache
+        name (str): Cache name used to label metrics
+    """
+
+    def __init__(self, directory: str, max_bytes: int, name: str) -> None:
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.name = name
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def _prefix(self, key: str) -> str:
+        return os.path.join(self.directory, hashlib.sha256(key.encode()).hexdigest())
+
+    def path(self, key: str, version: str) -> str:
+        version_hash = hashlib.sha256(version.encode()).hexdigest()[:16]
+        return f"{self._prefix(key)}-{version_hash}{SUFFIX}"
+
+    def open(self, key: str, version: str) -> BinaryIO | None:
+        """
+        Open the cached entry for this version of the key, or None if not cached.
+        The open file stays readable if the entry is evicted meanwhile.
+        """
+        path = self.path(key, version)
+        try:
+            file = open(path, "rb")
+        except FileNotFoundError:
+            CACHE_MISSES.labels(self.name).inc()
+            return None
+
+        try:
+            # Recency for eviction is tracked with the modification time
+            os.utime(path)
+        except FileNotFoundError:
+            pass
+        CACHE_HITS.labels(self.name).inc()
+        return file
+
+    @contextlib.contextmanager
+    def writer(self, key: str, version: str):
+        """
+        Context manager for a file to write a new entry to. The entry is only added
+        if the block completes without an exception. Older versions of the key are
+        replaced.
+        """
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as file:
+                yield file
+            path = self.path(key, version)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+
+        for stale in glob.glob(f"{self._prefix(key)}-*{SUFFIX}"):
+            if stale != path:
+                self._remove(stale)
+        self.evict()
+
+    def put(self, key: str, version: str, chunks: Iterable[bytes]) -> str:
+        with self.writer(key, version) as file:
+            for chunk in chunks:
+                file.write(chunk)
+        return self.path(key, version)
+
+    def tee(self, key: str, version: str, chunks: Iterable[bytes]) -> Iterator[bytes]:
+        """
+        Pass chunks through while writing them to the cache. The entry is discarded
+        if the chunks are not consumed to the end.
+        """
+        with self.writer(key, version) as file:
+            for chunk in chunks:
+                file.write(chunk)
+                yield chunk
+
+    def evict(self) -> None:
+        """
+        Remove least recently used entries until the cache is within its size cap
+        """
+        with self._lock:
+            entries = []
+            for path in glob.glob(os.path.join(self.directory, f"*{SUFFIX}")):
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+
+            total = sum(size for _, size, _ in entries)
+            for _, size, path in sorted(entries):
+                if total <= self.max_bytes:
+                    break
+                log.debug(f"Evicting {path} from {self.name} cache")
+                self._remove(path)
+                CACHE_EVICTIONS.labels(self.name).inc()
+                total -= size
+
+            CACHE_BYTES.labels(self.name).set(total)
+
+    def _remove(self, path: str) -> None:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+def read(
+    file: BinaryIO, start: int = 0, end: int = None, chunk_size: int = 1024 * 1024
+) -> Iterator[bytes]:
+    """
+    Read the inclusive byte range `start`-`end` of a file in chunks, closing it after
+    """
+    with file:
+        file.seek(start)
+        remaining = None if end is None else end - start + 1
+        while remaining is None or remaining > 0:
+            chunk = file.read(
+                chunk_size if remaining is None else min(chunk_size, remaining)
+            )
+            if not chunk:
+                break
+            if remaining is not None:
+                remaining -= len(chunk)
+            yield chunk
@@ -2,13 +2,19 @@ import io
 import logging
 import json
 import mimetypes
-from typing import List
+import threading
+from concurrent import futures
+from typing import Iterator, List
 
+import google_auth_httplib2
+import httplib2
 from google.oauth2 import service_account
 from googleapiclient.discovery import build
-from googleapiclient.http import MediaIoBaseUpload
+from googleapiclient.errors import HttpError
+from googleapiclient.http import MediaIoBaseDownload, MediaIoBaseUpload
 
-from gdrive import settings, error
+from gdrive import disk_cache, drive_mirror, settings, error
+from gdrive.database import crud
 
 log = logging.getLogger(__name__)
 
@@ -18,13 +24,48 @@ creds = service_account.Credentials.from_service_account_info(
 
 service = build("drive", "v3", credentials=creds)
 
+resource_cache = (
+    disk_cache.DiskCache(
+        settings.RESOURCE_CACHE_DIR, settings.RESOURCE_CACHE_MAX_BYTES, "resource"
+    )
+    if settings.RESOURCE_CACHE_DIR
+    else None
+)
+
+# httplib2 connections are not thread safe, and requests are made from worker
+# threads as well as the event loop, so every request uses the client of its thread
+_local = threading.local()
+
+
+def thread_http() -> google_auth_httplib2.AuthorizedHttp:
+    """
+    Authorized http client for the current thread
+    """
+    if not hasattr(_local, "http"):
+        _local.http = google_auth_httplib2.AuthorizedHttp(creds, http=httplib2.Http())
+    return _local.http
+
+
+mirror = (
+    drive_mirror.DriveMirror(
+        service,
+        settings.ROOT_DIRECTORY,
+        poll_interval=settings.DRIVE_MIRROR_POLL_INTERVAL,
+        max_staleness=settings.DRIVE_MIRROR_MAX_STALENESS,
+        snapshot_path=settings.DRIVE_MIRROR_SNAPSHOT,
+        http=thread_http,
+    )
+    if settings.DRIVE_MIRROR
+    else None
+)
+
 
 def init():
     drive = drives_list()
     result = (
         service.files()
         .get(fileId=settings.ROOT_DIRECTORY, supportsAllDrives=True)
-        .execute()
+        .execute(http=thread_http())
     )
     driveId = result["id"]
     log.info(f"Connected to Root Directory {driveId}")
@@ -43,7 +84,7 @@ def list(count: int = 10, shared: bool = True) -> None:
             supportsAllDrives=shared,
             includeItemsFromAllDrives=shared,
         )
-        .execute()
+        .execute(http=thread_http())
     )
     items = results.get("files", [])
 
@@ -73,7 +114,7 @@ def create_empty_spreadsheet(filename: str, parent_id: str) -> str:
     file = (
         service.files()
         .create(body=file_metadata, fields="id", supportsAllDrives=True)
-        .execute()
+        .execute(http=thread_http())
     )
 
     return file.get("id")
@@ -84,24 +125,32 @@ def drives_list():
     List available shared drives
     """
 
-    result = service.drives().list().execute()
+    result = service.drives().list().execute(http=thread_http())
     return result
 
 
-def upload_basic(filename: str, parent_id: str, bytes: io.BytesIO) -> str:
+def upload_basic(
+    filename: str,
+    parent_id: str,
+    bytes: io.BytesIO,
+    mimetype: str = None,
+    resumable: bool = False,
+) -> str:
     """
-    Upload new file to given  parent folder
+    Upload new file to given  parent folder. Large files should be uploaded
+    resumable, which sends the file in chunks rather than reading it into memory.
     Returns : Id of the file uploaded
     """
 
     file_metadata = {"name": filename, "parents": [parent_id]}
 
-    mimetype, _ = mimetypes.guess_type(filename)
+    if mimetype is None:
+        mimetype, _ = mimetypes.guess_type(filename)
     if mimetype is None:
         # Guess failed, use octet-stream.
         mimetype = "application/octet-stream"
 
-    media = MediaIoBaseUpload(bytes, mimetype=mimetype)
+    media = MediaIoBaseUpload(bytes, mimetype=mimetype, resumable=resumable)
 
     file = (
         service.files()
@@ -111,7 +160,7 @@ def upload_basic(filename: str, parent_id: str, bytes: io.BytesIO) -> str:
             fields="id",
             supportsAllDrives=True,
         )
-        .execute()
+        .execute(http=thread_http())
     )
 
     log.debug(f'File ID: {file.get("id")}')
@@ -119,11 +168,43 @@ def upload_basic(filename: str, parent_id: str, bytes: io.BytesIO) -> str:
     return file.get("id")
 
 
+def update_file(
+    id: str,
+    filename: str,
+    bytes: io.BytesIO,
+    mimetype: str,
+    resumable: bool = False,
+) -> str:
+    """
+    Replace the name and content of an uploaded file, keeping its ID
+    Returns : Id of the file updated
+    """
+    media = MediaIoBaseUpload(bytes, mimetype=mimetype, resumable=resumable)
+
+    file = (
+        service.files()
+        .update(
+            fileId=id,
+            body={"name": filename},
+            media_body=media,
+            fields="id",
+            supportsAllDrives=True,
+        )
+        .execute(http=thread_http())
+    )
+
+    return file.get("id")
+
+
 def create_folder(name: str, parent_id: str) -> str:
     """
-    Create a folder and prints the folder ID
+    Create a folder and prints the folder ID. Folders are recorded in the database
+    when created or found, and later looked up there first.
     Returns : Folder Id
     """
+    folder_id = crud.get_drive_folder(name, parent_id)
+    if folder_id is not None:
+        return folder_id
 
     file_metadata = {
         "name": name,
@@ -131,93 +212,233 @@ def create_folder(name: str, parent_id: str) -> str:
         "mimeType": "application/vnd.google-apps.folder",
     }
 
-    existing = (
-        service.files()
-        .list(
-            q=f"name='{name}' and '{parent_id}' in parents",
-            fields="files(id, name)",
-            supportsAllDrives=True,
-            includeItemsFromAllDrives=True,
+    # The mirror may be behind the drive, only a folder it finds is trusted
+    existing = mirror.find(name, parent_id) if mirror else None
+    if not existing:
+        existing = (
+            service.files()
+            .list(
+                q=name_query(name, parent_id),
+                fields="files(id, name)",
+                supportsAllDrives=True,
+                includeItemsFromAllDrives=True,
+            )
+            .execute(http=thread_http())
+            .get("files", [])
         )
-        .execute()
-        .get("files", [])
-    )
 
     if not existing:
         file = (
             service.files()
             .create(body=file_metadata, fields="id", supportsAllDrives=True)
-            .execute()
+            .execute(http=thread_http())
         )
+        if mirror:
+            mirror.add({**file_metadata, "id": file.get("id")})
         log.debug(f'Folder has created with ID: "{file.get("id")}".')
     else:
         file = existing[0]
         log.debug("Folder already exists")
 
+    crud.record_drive_folder(name, parent_id, file.get("id"))
     return file.get("id")
 
 
-def get_files(filename: str) -> List:
+def forget_folder(folder_id: str) -> None:
+    """
+    Drop a folder that no longer exists in Drive from the database and the mirror,
+    so the next `create_folder` looks it up again
     """
-    Get list of files by filename
+    crud.delete_drive_folder(folder_id)
+    if mirror:
+        mirror.remove(folder_id)
+
+
+def upload_to_folder(
+    name: str,
+    parent_id: str,
+    filename: str,
+    bytes: io.BytesIO,
+    mimetype: str = None,
+    resumable: bool = False,
+) -> str:
     """
+    Upload a file to the folder with the name, created when missing. A recorded
+    folder that was deleted in Drive directly is forgotten and created again.
+    Returns : Id of the file uploaded
+    """
+    folder_id = create_folder(name, parent_id)
+    start = bytes.tell()
+    try:
+        return upload_basic(filename, folder_id, bytes, mimetype, resumable)
+    except HttpError as e:
+        if e.status_code != 404:
+            raise
+        log.warning(f"Folder {name} ({folder_id}) no longer exists, creating it again")
+
+    forget_folder(folder_id)
+    bytes.seek(start)
+    return upload_basic(
+        filename, create_folder(name, parent_id), bytes, mimetype, resumable
+    )
 
-    results = (
-        service.files()
-        .list(
-            q=f"name = '{filename}'",
-            supportsAllDrives=True,
-            includeItemsFromAllDrives=True,
-        )
-        .execute()
+
+def get_files(filename: str, fields: str = "id, name, mimeType") -> Iterator[dict]:
+    """
+    Get files by filename in every drive, paging through the results lazily.
+    The Drive mirror only holds the root drive, see `get_files_by_drive_id`.
+
+    Args:
+        filename (str): File name
+        fields (str): Comma separated file fields to return, i.e. "id,name,parents"
+    Yields:
+        dict: files with the name
+    """
+    yield from iter_files(name_query(filename), fields)
+
+
+def get_files_by_drive_id(
+    filename: str, drive_id: str, fields: str = "id, name, mimeType"
+) -> Iterator[dict]:
+    """
+    Get files by filename within a shared drive, paging through the results lazily
+    """
+    if mirror and drive_id == mirror.drive_id and drive_mirror.covers(fields):
+        files = mirror.find(filename)
+        if files is not None:
+            yield from drive_mirror.select(files, fields)
+            return
+
+    yield from iter_files(
+        name_query(filename), fields, corpora="drive", driveId=drive_id
     )
 
-    return results["files"]
+
+def query_value(value: str) -> str:
+    """
+    Quote a string for use in a Drive files query
+    """
+    escaped = value.replace("\\", "\\\\").replace("'", "\\'")
+    return f"'{escaped}'"
 
 
-def get_files_by_drive_id(filename: str, drive_id: str):
+def name_query(name: str, parent_id: str = None) -> str:
     """
-    Get list of files by filename
+    Drive files query for files with the name, optionally only within a folder
     """
+    query = f"name = {query_value(name)}"
+    if parent_id is not None:
+        query += f" and {query_value(parent_id)} in parents"
+    return query
 
-    results = (
-        service.files()
-        .list(
-            q=f"name = '{filename}'",
-            corpora="drive",
-            driveId=drive_id,
-            includeTeamDriveItems=True,
-            supportsTeamDrives=True,
+
+def get_files_in_folder(id: str, fields: str = "*") -> List:
+    """
+    Get list of files within a folder by folder ID
+    """
+    return get_files_in_folders([id], fields=fields)
+
+
+def get_files_in_folders(
+    ids: List[str],
+    fields: str = "*",
+    batch_size: int = settings.DRIVE_LIST_BATCH_SIZE,
+) -> List:
+    """
+    Get list of files within several folders by folder ID. Up to `batch_size`
+    parents are combined into each query, and queries are listed concurrently.
+    The Drive mirror answers instead when it is ready and keeps the requested fields.
+
+    Args:
+        ids (List[str]): Folder IDs
+        fields (str): Comma separated file fields to return, i.e. "id,name,parents"
+        batch_size (int): Most parents in a single query
+    Returns:
+        List: files of all the folders
+    """
+    if mirror and drive_mirror.covers(fields):
+        files = mirror.children(ids)
+        if files is not None:
+            return drive_mirror.select(files, fields)
+
+    queries = parents_queries(ids, batch_size)
+    if len(queries) <= 1:
+        return [file for query in queries for file in list_files(query, fields)]
+
+    with futures.ThreadPoolExecutor(
+        max_workers=min(len(queries), settings.DRIVE_LIST_WORKERS)
+    ) as executor:
+        results = executor.map(
+            lambda query: list_files(query, fields, http=thread_http()), queries
         )
-        .execute()
-    )
+        return [file for files in results for file in files]
+
 
-    return results["files"]
+def parents_queries(ids: List[str], batch_size: int) -> List[str]:
+    """
+    Split the folder IDs into queries for the files they contain, each with at most
+    `batch_size` parents and within the query length limit.
+    """
+    queries = []
+    clauses = []
+    length = 0
+    for id in ids:
+        clause = f"{query_value(id)} in parents"
+        if clauses and (
+            len(clauses) >= batch_size
+            or length + len(clause) + 4 > settings.DRIVE_QUERY_MAX_LENGTH
+        ):
+            queries.append(f"({' or '.join(clauses)}) and trashed=false")
+            clauses = []
+            length = 0
+        clauses.append(clause)
+        length += len(clause) + 4
+    if clauses:
+        queries.append(f"({' or '.join(clauses)}) and trashed=false")
+    return queries
+
+
+def list_files(query: str, fields: str = "*", http=None) -> List:
+    """
+    Get every page of files matching the query
+    """
+    return [*iter_files(query, fields, http=http)]
 
 
-def get_files_in_folder(id: str) -> List:
+def iter_files(
+    query: str, fields: str = "*", http=None, page_size: int = 1000, **params
+) -> Iterator[dict]:
     """
-    Get list of files within a folder by folder ID
+    Files matching the query, requesting each page once the previous one is consumed
+
+    Args:
+        query (str): Drive files query, see `name_query`
+        fields (str): Comma separated file fields to return, i.e. "id,name,parents"
+        http: Http client to make the requests with, the client of the current
+            thread by default
+        page_size (int): Files requested per page
+        params: Additional files.list parameters, i.e. corpora and driveId
     """
-    files = []
+    http = http or thread_http()
     page_token = None
     while True:
         results = (
             service.files()
             .list(
-                q=f"'{id}' in parents and trashed=false",
+                q=query,
                 supportsAllDrives=True,
                 includeItemsFromAllDrives=True,
-                fields="nextPageToken, files(*)",
+                pageSize=page_size,
+                fields=f"nextPageToken, files({fields})",
                 pageToken=page_token,
+                **params,
             )
-            .execute()
+            .execute(http=http)
         )
-        files.extend(results.get("files", []))
+        yield from results.get("files", [])
         page_token = results.get("nextPageToken")
         if not page_token:
             break
-    return files
 
 
 def delete_file(id: str) -> None:
@@ -225,8 +446,116 @@ def delete_file(id: str) -> None:
     Delete file by id
     """
 
-    service.files().delete(fileId=id, supportsAllDrives=True).execute()
+    service.files().delete(fileId=id, supportsAllDrives=True).execute(
+        http=thread_http()
+    )
+    forget_folder(id)
+    crud.delete_export_ledger(id)
 
 
 def export(id: str) -> any:
-    return service.files().get_media(fileId=id).execute()
+    if resource_cache is None:
+        return service.files().get_media(fileId=id).execute(http=thread_http())
+    return b"".join(stream_cached(id, get_metadata(id)))
+
+
+def get_metadata(
+    id: str, fields: str = "id, name, mimeType, size, md5Checksum, version"
+) -> dict:
+    """
+    Get metadata of a file by id
+    """
+    return (
+        service.files()
+        .get(fileId=id, fields=fields, supportsAllDrives=True)
+        .execute(http=thread_http())
+    )
+
+
+class RangeDownload(MediaIoBaseDownload):
+    """
+    MediaIoBaseDownload of the inclusive byte range `start`-`end` of a file.
+
+    Each chunk is requested with the http client of the calling thread, so the
+    download may be driven from different threads, as a StreamingResponse does.
+    """
+
+    def __init__(self, fd, request, start: int, end: int, chunksize: int):
+        super().__init__(fd, request, chunksize=chunksize)
+        self._progress = start
+        self._end = end
+
+    def next_chunk(self, num_retries=0):
+        self._request.http = thread_http()
+        if self._end is not None:
+            self._chunksize = min(self._chunksize, self._end - self._progress + 1)
+        status, done = super().next_chunk(num_retries=num_retries)
+        return status, done or (self._end is not None and self._progress > self._end)
+
+
+def stream(
+    id: str,
+    start: int = 0,
+    end: int = None,
+    chunk_size: int = settings.DRIVE_DOWNLOAD_CHUNK_SIZE,
+):
+    """
+    Download a file in chunks, without loading the whole file into memory.
+
+    Args:
+        id (str): File ID
+        start (int): First byte to download
+        end (int): Last byte to download (inclusive), or None for the rest of the file
+        chunk_size (int): Bytes requested per chunk
+    Yields:
+        bytes: file content, one chunk at a time
+    """
+    buffer = io.BytesIO()
+    request = service.files().get_media(fileId=id, supportsAllDrives=True)
+    downloader = RangeDownload(buffer, request, start, end, chunk_size)
+
+    done = False
+    while not done:
+        _, done = downloader.next_chunk(num_retries=3)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+
+
+def stream_cached(
+    id: str,
+    metadata: dict,
+    start: int = 0,
+    end: int = None,
+    chunk_size: int = settings.DRIVE_DOWNLOAD_CHUNK_SIZE,
+):
+    """
+    Download a file in chunks like `stream`, serving it from the local resource cache
+    when the cached copy matches the checksum in the file metadata. Whole file
+    downloads are added to the cache.
+
+    Args:
+        id (str): File ID
+        metadata (dict): File metadata, as returned by `get_metadata`
+        start (int): First byte to download
+        end (int): Last byte to download (inclusive), or None for the rest of the file
+        chunk_size (int): Bytes requested per chunk
+    Yields:
+        bytes: file content, one chunk at a time
+    """
+    version = metadata.get("md5Checksum") or metadata.get("version")
+    if resource_cache is None or version is None:
+        yield from stream(id, start, end, chunk_size)
+        return
+
+    file = resource_cache.open(id, version)
+    if file is not None:
+        yield from disk_cache.read(file, start, end, chunk_size)
+        return
+
+    size = metadata.get("size")
+    if start == 0 and (end is None or size is None or end >= int(size) - 1):
+        yield from resource_cache.tee(id, version, stream(id, chunk_size=chunk_size))
+    else:
+        # Partial downloads are not cached
+        yield from stream(id, start, end, chunk_size)
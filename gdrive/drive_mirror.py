@@ -0,0 +1,328 @@
+"""
+Local mirror of the file metadata of a shared drive.
+
+The mirror crawls the drive once, then follows the Drive changes feed so that name
+and parent lookups can be answered from memory rather than with Drive queries. The
+changes page token and the index are saved to a snapshot file so a restart resumes
+from where it left off instead of crawling again.
+"""
+
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from typing import Any, Callable, List
+
+import prometheus_client
+from googleapiclient.http import HttpError
+
+log = logging.getLogger(__name__)
+
+# File fields kept in the mirror
+FIELDS = ("id", "name", "mimeType", "parents", "size", "md5Checksum", "modifiedTime")
+
+MIRROR_FILES = prometheus_client.Gauge(
+    "gdrive_drive_mirror_files", "Files held in the Drive metadata mirror"
+)
+MIRROR_SYNCS = prometheus_client.Counter(
+    "gdrive_drive_mirror_syncs_total",
+    "Drive metadata mirror crawls and change polls by outcome",
+    ["kind", "outcome"],
+)
+
+
+class DriveMirror:
+    """
+    Args:
+        service: Drive v3 service
+        drive_id (str): ID of the shared drive to mirror
+        poll_interval (float): Seconds between polls of the changes feed
+        max_staleness (float): Seconds without a successful poll after which the
+            mirror stops answering lookups
+        snapshot_path (str): File the index is saved to, or None to keep it in memory
+        http (Callable): Returns the http client requests are made with
+    """
+
+    def __init__(
+        self,
+        service,
+        drive_id: str,
+        poll_interval: float,
+        max_staleness: float,
+        snapshot_path: str = None,
+        http: Callable[[], Any] = None,
+    ) -> None:
+        self.service = service
+        self.drive_id = drive_id
+        self.poll_interval = poll_interval
+        self.max_staleness = max_staleness
+        self.snapshot_path = snapshot_path
+        self.http = http
+        self.page_token = None
+        self.synced_at = None
+        self._saved = False
+        self._files = {}
+        self._names = {}
+        self._children = {}
+        self._lock = threading.RLock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    @property
+    def ready(self) -> bool:
+        return (
+            self.synced_at is not None
+            and time.monotonic() - self.synced_at <= self.max_staleness
+        )
+
+    def start(self) -> None:
+        self._stop.clear()
+        self._thread = threading.Thread(
+            target=self._run, name="drive-mirror", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self, timeout: float = None) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def _run(self) -> None:
+        if self.snapshot_path:
+            self.load()
+        while not self._stop.is_set():
+            self.sync()
+            self._stop.wait(self.poll_interval)
+
+    def sync(self) -> None:
+        """
+        Apply pending changes, crawling the drive first if there is no page token
+        """
+        kind = "poll" if self.page_token else "crawl"
+        try:
+            if self.page_token is None:
+                self.crawl()
+            else:
+                self.poll()
+        except HttpError as e:
+            MIRROR_SYNCS.labels(kind, "error").inc()
+            log.error(f"Unable to sync Drive mirror: {e}")
+            if kind == "poll" and e.status_code in (404, 410):
+                # The page token expired, the next sync starts over
+                self.page_token = None
+            return
+        except Exception as e:
+            MIRROR_SYNCS.labels(kind, "error").inc()
+            log.error(f"Unable to sync Drive mirror: {e}")
+            return
+
+        MIRROR_SYNCS.labels(kind, "success").inc()
+        self.synced_at = time.monotonic()
+
+    def crawl(self) -> None:
+        # Changes made while crawling are replayed from the token taken beforehand
+        page_token = (
+            self.service.changes()
+            .getStartPageToken(driveId=self.drive_id, supportsAllDrives=True)
+            .execute(http=self._http())["startPageToken"]
+        )
+
+        files = []
+        list_token = None
+        while True:
+            results = (
+                self.service.files()
+                .list(
+                    q="trashed=false",
+                    corpora="drive",
+                    driveId=self.drive_id,
+                    includeItemsFromAllDrives=True,
+                    supportsAllDrives=True,
+                    pageSize=1000,
+                    fields=f"nextPageToken, files({', '.join(FIELDS)})",
+                    pageToken=list_token,
+                )
+                .execute(http=self._http())
+            )
+            files.extend(results.get("files", []))
+            list_token = results.get("nextPageToken")
+            if not list_token:
+                break
+
+        with self._lock:
+            self._files = {}
+            self._names = {}
+            self._children = {}
+            for file in files:
+                self._index(file)
+            self.page_token = page_token
+            MIRROR_FILES.set(len(self._files))
+        log.info(f"Crawled {len(files)} files of drive {self.drive_id}")
+        self.poll()
+
+    def poll(self) -> None:
+        page_token = self.page_token
+        changed = False
+        while True:
+            results = (
+                self.service.changes()
+                .list(
+                    pageToken=page_token,
+                    driveId=self.drive_id,
+                    includeItemsFromAllDrives=True,
+                    supportsAllDrives=True,
+                    includeRemoved=True,
+                    pageSize=1000,
+                    fields="nextPageToken, newStartPageToken, changes(changeType, "
+                    f"fileId, removed, file({', '.join(FIELDS)}, trashed))",
+                )
+                .execute(http=self._http())
+            )
+            with self._lock:
+                for change in results.get("changes", []):
+                    # Changes of the shared drive itself have no file
+                    if change.get("changeType", "file") != "file":
+                        continue
+                    file = change.get("file")
+                    if change.get("removed") or not file or file.get("trashed"):
+                        if change.get("fileId"):
+                            self.remove(change["fileId"])
+                    else:
+                        self.add(file)
+                    changed = True
+
+                page_token = results.get("nextPageToken")
+                if page_token is None:
+                    self.page_token = results["newStartPageToken"]
+                    break
+
+        if changed or not self._saved:
+            self.save()
+
+    def _http(self):
+        return self.http() if self.http else None
+
+    # --------------------------------- Index --------------------------------------
+
+    def _index(self, file: dict) -> None:
+        file = {field: file[field] for field in FIELDS if field in file}
+        self._files[file["id"]] = file
+        self._names.setdefault(file["name"], set()).add(file["id"])
+        for parent in file.get("parents", []):
+            self._children.setdefault(parent, set()).add(file["id"])
+
+    def add(self, file: dict) -> None:
+        """
+        Add or update a file, i.e. one just created through the API
+        """
+        with self._lock:
+            self.remove(file["id"])
+            self._index(file)
+            MIRROR_FILES.set(len(self._files))
+
+    def remove(self, id: str) -> None:
+        with self._lock:
+            file = self._files.pop(id, None)
+            if file is None:
+                return
+            self._names[file["name"]].discard(id)
+            if not self._names[file["name"]]:
+                del self._names[file["name"]]
+            for parent in file.get("parents", []):
+                self._children[parent].discard(id)
+                if not self._children[parent]:
+                    del self._children[parent]
+            MIRROR_FILES.set(len(self._files))
+
+    def get(self, id: str) -> dict | None:
+        with self._lock:
+            return self._files.get(id)
+
+    def find(self, name: str, parent_id: str = None) -> List | None:
+        """
+        Files with the given name, optionally only those within a folder.
+        Returns None if the mirror is not ready.
+        """
+        if not self.ready:
+            return None
+        with self._lock:
+            files = [self._files[id] for id in self._names.get(name, ())]
+        if parent_id is not None:
+            files = [file for file in files if parent_id in file.get("parents", [])]
+        return files
+
+    def children(self, ids: List[str]) -> List | None:
+        """
+        Files within the given folders. Returns None if the mirror is not ready.
+        """
+        if not self.ready:
+            return None
+        with self._lock:
+            return [
+                self._files[child]
+                for id in ids
+                for child in sorted(self._children.get(id, ()))
+            ]
+
+    # -------------------------------- Snapshot ------------------------------------
+
+    def save(self) -> None:
+        if not self.snapshot_path:
+            return
+        with self._lock:
+            snapshot = {
+                "driveId": self.drive_id,
+                "pageToken": self.page_token,
+                "files": [*self._files.values()],
+            }
+
+        directory = os.path.dirname(os.path.abspath(self.snapshot_path))
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w") as file:
+                json.dump(snapshot, file)
+            os.replace(tmp_path, self.snapshot_path)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+        self._saved = True
+
+    def load(self) -> None:
+        try:
+            with open(self.snapshot_path) as file:
+                snapshot = json.load(file)
+        except FileNotFoundError:
+            return
+        except ValueError as e:
+            log.warning(f"Ignoring invalid Drive mirror snapshot: {e}")
+            return
+
+        if snapshot.get("driveId") != self.drive_id:
+            return
+        with self._lock:
+            for file in snapshot["files"]:
+                self._index(file)
+            self.page_token = snapshot["pageToken"]
+            MIRROR_FILES.set(len(self._files))
+        self._saved = True
+        log.info(f"Loaded {len(self._files)} files from Drive mirror snapshot")
+
+
+def covers(fields: str) -> bool:
+    """
+    Whether the comma separated file fields are all kept in the mirror
+    """
+    return fields != "*" and all(
+        field.strip() in FIELDS for field in fields.split(",") if field.strip()
+    )
+
+
+def select(files: List, fields: str) -> List:
+    """
+    Only the comma separated fields of each file, as a Drive partial response
+    """
+    names = [field.strip() for field in fields.split(",") if field.strip()]
+    return [{name: file[name] for name in names if name in file} for file in files]
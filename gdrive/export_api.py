@@ -2,16 +2,24 @@
 gdrive rest api
 """
 
-import io
-import json
+import asyncio
 import logging
-import sys
+import uuid
 
 import fastapi
 from pydantic import BaseModel, Field
-from fastapi import BackgroundTasks, responses
-
-from gdrive import export_client, drive_client, sheets_client, settings, error
+from fastapi import responses
+from googleapiclient.errors import HttpError
+
+from gdrive import (
+    archive,
+    export_client,
+    export_queue,
+    drive_client,
+    sheets_client,
+    settings,
+    error,
+)
 from gdrive.database import database, crud, models
 
 log = logging.getLogger(__name__)
@@ -20,15 +28,59 @@ router = fastapi.APIRouter()
 
 
 @router.post("/export")
-async def upload_file(interactionId):
+async def upload_file(
+    interactionId,
+    force: bool = False,
+    format: export_client.ExportFormatEnum | None = None,
+):
+    """
+    Export the flow analytics of an interaction to gdrive. The export is skipped if the
+    export ledger shows the same content was already uploaded, unless `force` is set.
+    Changed content replaces the file of the previous export.
+    The file format defaults to the `EXPORT_FORMAT` setting.
+    """
     log.info(f"Export interaction {interactionId}")
+    format = export_client.ExportFormatEnum(format or settings.EXPORT_FORMAT)
     export_data = export_client.export(interactionId)
-    export_bytes = io.BytesIO(
-        export_client.codename(json.dumps(export_data, indent=2)).encode()
-    )
-    parent = drive_client.create_folder(interactionId, settings.ROOT_DIRECTORY)
-    drive_client.upload_basic("analytics.json", parent, export_bytes)
-    log.info(f"Uploading {sys.getsizeof(export_bytes)} bytes to drive folder {parent}")
+
+    content_hash = export_client.content_hash(export_data, format)
+    ledger = crud.get_export_ledger(interactionId)
+    if not force and ledger is not None and ledger.content_hash == content_hash:
+        log.info(
+            f"Interaction {interactionId} unchanged since export to {ledger.drive_file_id}, skipping"
+        )
+        return
+
+    export_bytes = export_client.serialize(export_data, format)
+    size = export_bytes.tell()
+    export_bytes.seek(0)
+    filename, mimetype = export_client.EXPORT_FILES[format]
+    resumable = size > export_client.SPOOL_MAX_SIZE
+    with export_bytes:
+        file_id = None
+        if ledger is not None and ledger.drive_file_id is not None:
+            log.info(f"Updating {size} bytes of drive file {ledger.drive_file_id}")
+            try:
+                file_id = drive_client.update_file(
+                    ledger.drive_file_id, filename, export_bytes, mimetype, resumable
+                )
+            except HttpError as e:
+                if e.status_code != 404:
+                    raise
+                # Deleted in Drive directly, upload a new file instead
+                export_bytes.seek(0)
+
+        if file_id is None:
+            log.info(f"Uploading {size} bytes to drive folder {interactionId}")
+            file_id = drive_client.upload_to_folder(
+                interactionId,
+                settings.ROOT_DIRECTORY,
+                filename,
+                export_bytes,
+                mimetype=mimetype,
+                resumable=resumable,
+            )
+    crud.record_export(interactionId, content_hash, file_id)
 
 
 class ParticipantModel(BaseModel):
@@ -47,28 +99,83 @@ class SurveyParticipantModel(BaseModel):
     surveyId: str
     responseId: str
     participant: ParticipantModel | None = None
+    # Export again even if the response or its interactions were already exported
+    force: bool = False
 
 
 @router.post("/survey-export")
-async def survey_upload_response(
-    request: SurveyParticipantModel, background_tasks: BackgroundTasks
-):
+async def survey_upload_response(request: SurveyParticipantModel):
     """
     Single endpoint that kicks off qualtrics response fetching and exporting. Requests response data
     from the Qualtrix API and uploads contact and demographic data to the google drive. Does not upload
     responses without a complete status.
+
+    Requests are added to the persistent export queue and processed by the worker pool. Posting
+    a response that is already queued or running does not queue it again, and a response that
+    was already exported is only queued again when `force` is set.
     """
 
-    background_tasks.add_task(survey_upload_response_task, request)
+    crud.enqueue_export_job(
+        request.responseId,
+        request.surveyId,
+        request.model_dump_json(),
+        force=request.force,
+    )
 
     return responses.JSONResponse(
         status_code=202, content=f"Response {request.responseId} is being processed."
     )
 
 
+@router.get("/survey-export/{responseId}")
+async def survey_export_status(responseId: str):
+    """
+    Report the state and timings of the export job for a survey response
+    """
+    job = crud.get_export_job(responseId)
+    if job is None:
+        return responses.JSONResponse(
+            status_code=404, content=f"No export found for response {responseId}"
+        )
+
+    return responses.JSONResponse(status_code=200, content=job.as_status())
+
+
+def survey_export_job(job: models.ExportJobModel):
+    """
+    Export queue handler. Runs on a worker thread, so the export gets its own event loop.
+    """
+    request = SurveyParticipantModel.model_validate_json(job.payload)
+    asyncio.run(survey_upload_response_task(request))
+
+
+def survey_export_batch(jobs: list) -> dict:
+    """
+    Export queue handler for the jobs of a bulk request
+    """
+    requests = {
+        job.response_id: SurveyParticipantModel.model_validate_json(job.payload)
+        for job in jobs
+    }
+    return asyncio.run(survey_upload_responses_task(requests))
+
+
+worker_pool = export_queue.WorkerPool(
+    survey_export_job,
+    concurrency=settings.EXPORT_WORKERS,
+    poll_interval=settings.EXPORT_POLL_INTERVAL,
+    visibility_timeout=settings.EXPORT_VISIBILITY_TIMEOUT,
+    max_attempts=settings.EXPORT_MAX_ATTEMPTS,
+    backoff=settings.EXPORT_RETRY_BACKOFF,
+    batch_handler=survey_export_batch,
+    batch_size=settings.EXPORT_BATCH_SIZE,
+)
+
+
 async def survey_upload_response_task(request):
     """
-    Background task that handles qualtrics response fetching and exporting
+    Handles qualtrics response fetching and exporting. Errors are raised so the export
+    queue can retry the job.
     """
     log.info(f"Gathering response {request.responseId}")
     try:
@@ -88,7 +195,8 @@ async def survey_upload_response_task(request):
         # throws exception in get_qualtrics_response
         survey_resp = response["response"]
 
-        if request.participant:
+        # A retried job may already have written the participant before failing
+        if request.participant and not crud.participant_exists(request.responseId):
             participant = request.participant
             upload_result = sheets_client.upload_participant(
                 participant.first,
@@ -113,23 +221,7 @@ async def survey_upload_response_task(request):
                     f"Uploaded response: {request.responseId} to completions spreadsheet {result_sheet_id}"
                 )
 
-            crud.create_participant(
-                models.ParticipantModel(
-                    survey_id=request.surveyId,
-                    response_id=request.responseId,
-                    rules_consent_id=survey_resp["rules_consent_id"],
-                    time=participant.time,
-                    date=participant.date,
-                    ethnicity=survey_resp["ethnicity"],
-                    race=", ".join(
-                        survey_resp["race"]
-                    ),  # Can have more than one value in a list
-                    gender=survey_resp["gender"],
-                    age=survey_resp["age"],
-                    income=survey_resp["income"],
-                    skin_tone=survey_resp["skin_tone"],
-                )
-            )
+            crud.create_participant(participant_model(request, survey_resp))
             log.info(f"Wrote {request.responseId} to database")
 
         # call function that queries ES for all analytics entries (flow interactionId) with responseId
@@ -140,12 +232,174 @@ async def survey_upload_response_task(request):
 
         # export list of interactionIds to gdrive
         for id in interactionIds:
-            await upload_file(id)
+            await upload_file(id, force=request.force)
             log.info(
                 f"Exported response: {request.responseId} interaction: {id} to gdrive"
             )
     except error.ExportError as e:
         log.error(f"Response: {request.responseId} encountered an error: {e.args}")
+        raise
+
+
+def participant_model(request, survey_resp) -> models.ParticipantModel:
+    return models.ParticipantModel(
+        survey_id=request.surveyId,
+        response_id=request.responseId,
+        rules_consent_id=survey_resp["rules_consent_id"],
+        time=request.participant.time,
+        date=request.participant.date,
+        ethnicity=survey_resp["ethnicity"],
+        race=", ".join(survey_resp["race"]),  # Can have more than one value in a list
+        gender=survey_resp["gender"],
+        age=survey_resp["age"],
+        income=survey_resp["income"],
+        skin_tone=survey_resp["skin_tone"],
+    )
+
+
+@router.post("/survey-export/bulk")
+async def survey_upload_responses(requests: list[SurveyParticipantModel]):
+    """
+    Bulk version of `/survey-export`, for backfilling many responses at once. The responses
+    are queued as one batch, which is processed with batched elastic search queries and a
+    single spreadsheet append and database insert for all participants.
+
+    Returns a batch id, with the status of each response.
+    """
+    batch_id = str(uuid.uuid4())
+    jobs = crud.enqueue_export_jobs(
+        [
+            (
+                request.responseId,
+                request.surveyId,
+                request.model_dump_json(),
+                request.force,
+            )
+            for request in requests
+        ],
+        batch_id=batch_id,
+    )
+
+    return responses.JSONResponse(
+        status_code=202,
+        content={"batchId": batch_id, "items": [job.as_status() for job in jobs]},
+    )
+
+
+@router.get("/survey-export/bulk/{batchId}")
+async def survey_export_batch_status(batchId: str):
+    """
+    Report the state and timings of each export job of a bulk request
+    """
+    jobs = crud.get_export_batch(batchId)
+    if not jobs:
+        return responses.JSONResponse(
+            status_code=404, content=f"No export found for batch {batchId}"
+        )
+
+    return responses.JSONResponse(
+        status_code=200,
+        content={"batchId": batchId, "items": [job.as_status() for job in jobs]},
+    )
+
+
+async def survey_upload_responses_task(requests: dict) -> dict:
+    """
+    Batched `survey_upload_response_task`.
+
+    Args:
+        requests (dict): SurveyParticipantModel by responseId
+
+    Returns:
+        dict: exception by responseId, for each response that failed to export
+    """
+    failures = {}
+
+    # Qualtrics responses can only be requested one at a time
+    survey_responses = {}
+    for responseId, request in requests.items():
+        try:
+            survey_responses[responseId] = export_client.get_qualtrics_response(
+                request.surveyId, responseId
+            )
+        except error.ExportError as e:
+            log.error(f"Response: {responseId} encountered an error: {e.args}")
+            failures[responseId] = e
+
+    # A retried job may already have written the participant before failing
+    existing = crud.participant_response_ids(
+        [
+            responseId
+            for responseId in survey_responses
+            if requests[responseId].participant
+        ]
+    )
+    rows = []
+    participants = []
+    for responseId, response in survey_responses.items():
+        request = requests[responseId]
+        if not request.participant or responseId in existing:
+            continue
+
+        survey_resp = response["response"]
+        participant = request.participant
+        rows.append(
+            sheets_client.participant_row(
+                participant.first,
+                participant.last,
+                participant.email,
+                responseId,
+                participant.time,
+                participant.date,
+                survey_resp["ethnicity"],
+                ", ".join(survey_resp["race"]),
+                survey_resp["gender"],
+                survey_resp["age"],
+                survey_resp["income"],
+                survey_resp["skin_tone"],
+            )
+        )
+        participants.append(participant_model(request, survey_resp))
+
+    if rows:
+        try:
+            sheets_client.upload_participants(rows)
+            log.info(f"Uploaded {len(rows)} responses to completions spreadsheet")
+            crud.create_participants(participants)
+            log.info(f"Wrote {len(participants)} responses to database")
+        except Exception as e:
+            log.error(f"Unable to upload participants: {e}")
+            for participant in participants:
+                failures[participant.response_id] = e
+                survey_responses.pop(participant.response_id)
+
+    try:
+        interactionIds = export_client.export_responses(survey_responses)
+    except Exception as e:
+        log.error(f"Unable to resolve interaction ids: {e}")
+        interactionIds = {}
+        for responseId in survey_responses:
+            failures[responseId] = e
+
+    for responseId in survey_responses:
+        if responseId in failures:
+            continue
+        if responseId not in interactionIds:
+            failures[responseId] = error.ExportError(
+                f"No flow interactionId match for responseId: {responseId}"
+            )
+            continue
+
+        for id in interactionIds[responseId]:
+            try:
+                await upload_file(id, force=requests[responseId].force)
+            except Exception as e:
+                log.error(f"Unable to export interaction {id}: {e}")
+                failures[responseId] = e
+                break
+
+    log.info(f"Exported {len(requests) - len(failures)} of {len(requests)} responses")
+    return failures
 
 
 class FindModel(BaseModel):
@@ -173,6 +427,8 @@ async def find(find: FindModel):
 # ------------------------------- Archive API --------------------------------------
 class InteractionModel(BaseModel):
     interactionId: str
+    # Comma separated Drive file fields to return, i.e. "id,name,mimeType"
+    fields: str = "*"
 
 
 @router.post("/export/interaction-files")
@@ -181,19 +437,88 @@ async def get_files_by_id(request: InteractionModel):
     Returns a list of Google Drive object IDs that contain the
     vendor responses for this particular interaction
     """
+    vendor_file_ids = interaction_files(request.interactionId, request.fields) or []
+
+    return responses.JSONResponse(
+        status_code=202,
+        content={"interaction": request.interactionId, "data": vendor_file_ids},
+    )
+
+
+def interaction_folder_ids(interaction_id: str) -> list:
+    folder_id = crud.get_drive_folder(interaction_id, settings.ROOT_DIRECTORY)
+    if folder_id is not None:
+        return [folder_id]
+
     interaction_folders = drive_client.get_files_by_drive_id(
-        filename=request.interactionId, drive_id=settings.ROOT_DIRECTORY
+        filename=interaction_id, drive_id=settings.ROOT_DIRECTORY, fields="id"
     )
+    return [dir["id"] for dir in interaction_folders]
 
-    vendor_file_ids = []
-    for dir in interaction_folders:
-        files = drive_client.get_files_in_folder(id=dir["id"])
-        for file in files:
-            vendor_file_ids.append(file)
 
-    return responses.JSONResponse(
+def interaction_files(interaction_id: str, fields: str) -> list | None:
+    """
+    Files in the folders of an interaction, None when it has no folder. A recorded
+    folder that was deleted in Drive directly is forgotten and looked up again.
+    """
+    folder_ids = interaction_folder_ids(interaction_id)
+    if not folder_ids:
+        return None
+
+    try:
+        return drive_client.get_files_in_folders(folder_ids, fields=fields)
+    except HttpError as e:
+        if e.status_code != 404:
+            raise
+        log.warning(f"Folders of interaction {interaction_id} no longer exist")
+
+    for folder_id in folder_ids:
+        drive_client.forget_folder(folder_id)
+    folder_ids = interaction_folder_ids(interaction_id)
+    if not folder_ids:
+        return None
+    return drive_client.get_files_in_folders(folder_ids, fields=fields)
+
+
+class ArchiveModel(BaseModel):
+    interactionId: str
+
+
+@router.post("/export/interaction-archive")
+async def get_interaction_archive(request: ArchiveModel):
+    """
+    Streams a zip archive of the vendor files of an interaction. Files are downloaded
+    concurrently and written to the archive as they arrive.
+    """
+    files = interaction_files(
+        request.interactionId, "id, name, mimeType, size, md5Checksum"
+    )
+    if files is None:
+        return responses.JSONResponse(
+            status_code=404,
+            content=f"No folder found for interaction {request.interactionId}",
+        )
+
+    # Google Workspace documents and folders have no binary content
+    files = [file for file in files if "size" in file]
+    names = archive.unique_names([file["name"] for file in files])
+    entries = [
+        (name, archive.compress_type(file.get("mimeType")), file)
+        for name, file in zip(names, files)
+    ]
+
+    return responses.StreamingResponse(
+        archive.stream_zip(
+            entries,
+            lambda file: drive_client.stream_cached(file["id"], file),
+            window=settings.ARCHIVE_PREFETCH_FILES,
+            buffer_chunks=settings.ARCHIVE_PREFETCH_CHUNKS,
+        ),
         status_code=202,
-        content={"interaction": request.interactionId, "data": vendor_file_ids},
+        media_type="application/zip",
+        headers={
+            "Content-Disposition": f'attachment; filename="{request.interactionId}.zip"'
+        },
     )
 
 
@@ -201,15 +526,97 @@ class ResourceModel(BaseModel):
     resourceId: str
 
 
+class DirectoryModel(BaseModel):
+    resourceId: str
+    # Comma separated Drive file fields to return, i.e. "id,name,mimeType"
+    fields: str = "*"
+
+
 @router.post("/export/directories")
-async def get_directories(request: ResourceModel):
+async def get_directories(request: DirectoryModel):
     return responses.JSONResponse(
-        status_code=202, content=drive_client.get_files_in_folder(id=request.resourceId)
+        status_code=202,
+        content=drive_client.get_files_in_folder(
+            id=request.resourceId, fields=request.fields
+        ),
     )
 
 
 @router.post("/export/resource")
-async def export_resource(request: ResourceModel):
-    return responses.Response(
-        status_code=202, content=drive_client.export(request.resourceId)
+async def export_resource(
+    request: ResourceModel, range: str | None = fastapi.Header(default=None)
+):
+    """
+    Streams the content of a Drive file in chunks. A single byte range may be requested
+    with the `Range` header, which is answered with `206 Partial Content`. Files are
+    served from the local resource cache while unchanged in Drive.
+    """
+    metadata = drive_client.get_metadata(request.resourceId)
+    media_type = metadata.get("mimeType", "application/octet-stream")
+    headers = {"Accept-Ranges": "bytes"}
+
+    if "size" not in metadata:
+        # Google Workspace documents have no binary content or size
+        return responses.StreamingResponse(
+            drive_client.stream_cached(request.resourceId, metadata),
+            status_code=202,
+            media_type=media_type,
+            headers=headers,
+        )
+
+    size = int(metadata["size"])
+    try:
+        byte_range = parse_range(range, size)
+    except ValueError:
+        return responses.Response(
+            status_code=416, headers={"Content-Range": f"bytes */{size}"}
+        )
+
+    if byte_range is None:
+        start, end, status_code = 0, size - 1, 202
+    else:
+        (start, end), status_code = byte_range, 206
+        headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+    headers["Content-Length"] = str(end - start + 1)
+
+    if size == 0:
+        return responses.Response(
+            status_code=status_code, media_type=media_type, headers=headers
+        )
+
+    return responses.StreamingResponse(
+        drive_client.stream_cached(request.resourceId, metadata, start, end),
+        status_code=status_code,
+        media_type=media_type,
+        headers=headers,
     )
+
+
+def parse_range(range: str | None, size: int) -> tuple | None:
+    """
+    Parse a `Range` header into the inclusive (start, end) byte offsets it selects.
+
+    Returns None when the whole file should be sent: no header, a unit other than bytes
+    or multiple ranges, which servers may ignore. Raises ValueError if the range cannot
+    be satisfied.
+    """
+    if not range:
+        return None
+
+    unit, _, spec = range.partition("=")
+    if unit.strip().lower() != "bytes" or "," in spec:
+        return None
+
+    first, _, last = spec.strip().partition("-")
+    if not first:
+        # suffix range, the last n bytes
+        length = int(last)
+        if length == 0 or size == 0:
+            raise ValueError(f"Unsatisfiable range {range}")
+        return max(size - length, 0), size - 1
+
+    start = int(first)
+    end = int(last) if last else size - 1
+    if start >= size or end < start:
+        raise ValueError(f"Unsatisfiable range {range}")
+    return start, min(end, size - 1)
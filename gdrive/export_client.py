@@ -1,6 +1,10 @@
+import gzip
+import hashlib
 import logging
 import json
 import re
+import tempfile
+from enum import Enum
 import requests
 
 from opensearchpy import OpenSearch
@@ -9,6 +13,29 @@ from gdrive import settings, error
 
 log = logging.getLogger(__name__)
 
+# Exports larger than this are spooled to disk rather than held in memory
+SPOOL_MAX_SIZE = 4 * 1024 * 1024
+
+
+class ExportFormatEnum(str, Enum):
+    """
+    Output formats of the analytics export file
+    """
+
+    JSON = "json"  # pretty printed JSON array
+    COMPACT = "compact"  # JSON array without whitespace
+    GZIP = "gzip"  # gzip compressed compact JSON array
+    NDJSON = "ndjson"  # newline delimited JSON, one event per line
+
+
+# Drive filename and mimetype of each export format
+EXPORT_FILES = {
+    ExportFormatEnum.JSON: ("analytics.json", "application/json"),
+    ExportFormatEnum.COMPACT: ("analytics.json", "application/json"),
+    ExportFormatEnum.GZIP: ("analytics.json.gz", "application/gzip"),
+    ExportFormatEnum.NDJSON: ("analytics.ndjson", "application/x-ndjson"),
+}
+
 
 def export(interactionId):
     es = OpenSearch(
@@ -89,6 +116,54 @@ def codename(data: str):
     return data
 
 
+def content_hash(data, format: ExportFormatEnum = ExportFormatEnum.JSON) -> str:
+    """
+    Hash of exported data, used by the export ledger to detect unchanged exports.
+    Code names and the format are included as they change the uploaded content.
+    """
+    content = json.dumps(
+        [data, settings.CODE_NAMES, format], sort_keys=True, separators=(",", ":")
+    )
+    return hashlib.sha256(content.encode()).hexdigest()
+
+
+def serialize(data: list, format: ExportFormatEnum) -> tempfile.SpooledTemporaryFile:
+    """
+    Write exported events, with code names applied, in the given format. Events are
+    encoded and compressed one at a time into a spooled file, so large exports do
+    not need a second in memory copy.
+
+    Returns:
+        SpooledTemporaryFile: serialized export, positioned at the end of the data
+    """
+    spool = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE)
+
+    if format == ExportFormatEnum.JSON:
+        spool.write(codename(json.dumps(data, indent=2)).encode())
+        return spool
+
+    if format == ExportFormatEnum.GZIP:
+        out = gzip.GzipFile(fileobj=spool, mode="wb")
+    else:
+        out = spool
+
+    if format == ExportFormatEnum.NDJSON:
+        for event in data:
+            out.write(codename(json.dumps(event, separators=(",", ":"))).encode())
+            out.write(b"\n")
+    else:
+        out.write(b"[")
+        for idx, event in enumerate(data):
+            if idx:
+                out.write(b",")
+            out.write(codename(json.dumps(event, separators=(",", ":"))).encode())
+        out.write(b"]")
+
+    if out is not spool:
+        out.close()
+    return spool
+
+
 def export_response(responseId, survey_response):
     es = OpenSearch(
         hosts=[{"host": settings.ES_HOST, "port": settings.ES_PORT}], timeout=300
@@ -157,6 +232,124 @@ def export_response(responseId, survey_response):
     return list(map(lambda id: id["match"]["interactionId"], interactionIds_match))
 
 
+def export_responses(survey_responses: dict, chunk_size: int = 100) -> dict:
+    """
+    Batched `export_response` for many survey responses. Interaction ids are resolved
+    and survey responses written back with one search and one update by query for
+    each chunk of response ids.
+
+    Args:
+        survey_responses (dict): survey response by responseId
+        chunk_size (int): response ids per elastic search request
+
+    Returns:
+        dict: list of interaction ids by responseId. Responses without a matching
+            flow interaction are left out.
+    """
+    es = OpenSearch(
+        hosts=[{"host": settings.ES_HOST, "port": settings.ES_PORT}], timeout=300
+    )
+
+    response_ids = [*survey_responses.keys()]
+    interaction_ids = {}
+    for idx in range(0, len(response_ids), chunk_size):
+        chunk = response_ids[idx : idx + chunk_size]
+
+        query_interactionId = {
+            "size": 10000,
+            "query": {
+                "bool": {
+                    "must": [
+                        {
+                            "match_phrase": {
+                                "properties.outcomeType.value": "survey_data"
+                            }
+                        },
+                        {
+                            "bool": {
+                                "should": [
+                                    {
+                                        "match": {
+                                            "properties.outcomeDescription.value": f"{responseId}"
+                                        }
+                                    }
+                                    for responseId in chunk
+                                ]
+                            }
+                        },
+                    ]
+                }
+            },
+            "_source": [
+                "interactionId",
+                "capabilityName",
+                "properties.outcomeDescription.value",
+            ],
+        }
+
+        results_interactionId = es.search(
+            body=json.dumps(query_interactionId), index="_all"
+        )
+
+        # map each interaction back to the response id it was logged for
+        responses_by_interaction = {}
+        for hit in results_interactionId["hits"]["hits"]:
+            if hit["_source"].get("capabilityName") != "logOutcome":
+                continue
+            value = recursive_decent(
+                hit["_source"], ["properties", "outcomeDescription", "value"]
+            )
+            for responseId in chunk:
+                if responseId in str(value):
+                    interactionId = hit["_source"]["interactionId"]
+                    responses_by_interaction[interactionId] = responseId
+                    interaction_ids.setdefault(responseId, []).append(interactionId)
+
+        if not responses_by_interaction:
+            continue
+
+        query_response_data = {
+            "script": {
+                # Analyzed match queries also find ids sharing a token, skip those
+                "source": (
+                    "if (params.responses.containsKey(ctx._source.interactionId)) {"
+                    " ctx._source.properties.outcomeDescription.value ="
+                    " params.responses[ctx._source.interactionId]"
+                    " } else { ctx.op = 'noop' }"
+                ),
+                "params": {
+                    "responses": {
+                        interactionId: json.dumps(survey_responses[responseId])
+                        for interactionId, responseId in responses_by_interaction.items()
+                    }
+                },
+            },
+            "query": {
+                "bool": {
+                    "must": [
+                        {
+                            "match_phrase": {
+                                "properties.outcomeType.value": "survey_response"
+                            }
+                        },
+                        {
+                            "bool": {
+                                "should": [
+                                    {"match": {"interactionId": f"{interactionId}"}}
+                                    for interactionId in responses_by_interaction
+                                ]
+                            }
+                        },
+                    ]
+                }
+            },
+        }
+
+        es.update_by_query(index="_all", body=query_response_data, refresh=True)
+
+    return interaction_ids
+
+
 def get_qualtrics_response(surveyId: str, responseId: str):
     url = f"http://{settings.QUALTRICS_APP_URL}:{settings.QUALTRICS_APP_PORT}/response"
 
@@ -0,0 +1,187 @@
+"""
+Persistent work queue for survey exports.
+
+Jobs are stored in the `export_job` table so they survive restarts and are shared
+between app instances. A pool of worker threads claims jobs from the table and
+hands them to the export handler, retrying failures with an exponential backoff.
+"""
+
+import logging
+import threading
+import time
+from typing import Callable
+
+import prometheus_client
+
+from gdrive.database import crud, models
+
+log = logging.getLogger(__name__)
+
+
+def _queue_depth() -> float:
+    try:
+        return crud.count_export_jobs(models.ExportJobState.QUEUED)
+    except Exception as e:
+        log.warning(f"Unable to read export queue depth: {e}")
+        return float("nan")
+
+
+QUEUE_DEPTH = prometheus_client.Gauge(
+    "gdrive_export_queue_depth", "Survey export jobs waiting to be processed"
+)
+QUEUE_DEPTH.set_function(_queue_depth)
+
+JOB_LATENCY = prometheus_client.Histogram(
+    "gdrive_export_job_latency_seconds",
+    "Time from a survey export being queued until it finished",
+    buckets=(1, 5, 15, 30, 60, 120, 300, 600, 1800, 3600, float("inf")),
+)
+
+JOB_DURATION = prometheus_client.Histogram(
+    "gdrive_export_job_duration_seconds",
+    "Time spent processing a single survey export attempt",
+    buckets=(0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, float("inf")),
+)
+
+JOB_OUTCOMES = prometheus_client.Counter(
+    "gdrive_export_job_outcomes_total",
+    "Survey export attempts by outcome",
+    ["outcome"],
+)
+
+
+class WorkerPool:
+    """
+    Fixed size pool of threads processing export jobs.
+
+    Args:
+        handler (Callable): Called with each claimed `ExportJobModel`. Raising
+            marks the attempt as failed.
+        batch_handler (Callable): Called with all claimed jobs of a bulk request,
+            returns a dict of response id to the exception of each failed job.
+        batch_size (int): Most jobs of a bulk request processed together
+        concurrency (int): Number of worker threads
+        poll_interval (float): Seconds to wait before polling an empty queue again
+        visibility_timeout (int): Seconds a claimed job is hidden from other
+            workers. Jobs still running after this are assumed lost and re-run.
+        max_attempts (int): Attempts before a job is marked failed
+        backoff (int): Seconds before the first retry, doubled for each retry
+    """
+
+    def __init__(
+        self,
+        handler: Callable[[models.ExportJobModel], None],
+        concurrency: int,
+        poll_interval: float,
+        visibility_timeout: int,
+        max_attempts: int,
+        backoff: int,
+        batch_handler: Callable[[list], dict] = None,
+        batch_size: int = 1,
+    ) -> None:
+        self.handler = handler
+        self.batch_handler = batch_handler
+        self.batch_size = batch_size
+        self.concurrency = concurrency
+        self.poll_interval = poll_interval
+        self.visibility_timeout = visibility_timeout
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self._stop = threading.Event()
+        self._threads = []
+
+    def start(self) -> None:
+        self._stop.clear()
+        for idx in range(self.concurrency):
+            thread = threading.Thread(
+                target=self._run, name=f"export-worker-{idx}", daemon=True
+            )
+            thread.start()
+            self._threads.append(thread)
+        log.info(f"Started {self.concurrency} export workers")
+
+    def stop(self, timeout: float = None) -> None:
+        """
+        Stop the workers after their current job. Jobs cut short by a timeout are
+        picked up again once their visibility timeout expires.
+        """
+        self._stop.set()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            try:
+                job = crud.claim_export_job(
+                    self.visibility_timeout, max_attempts=self.max_attempts
+                )
+            except Exception as e:
+                log.error(f"Unable to claim export job: {e}")
+                job = None
+
+            if job is None:
+                self._stop.wait(self.poll_interval)
+                continue
+
+            try:
+                if job.batch_id and self.batch_handler:
+                    jobs = [job] + crud.claim_export_jobs(
+                        self.visibility_timeout,
+                        batch_id=job.batch_id,
+                        limit=self.batch_size - 1,
+                        max_attempts=self.max_attempts,
+                    )
+                    self.process_batch(jobs)
+                else:
+                    self.process(job)
+            except Exception as e:
+                log.error(
+                    f"Unable to record result of export job {job.response_id}: {e}"
+                )
+
+    def process(self, job: models.ExportJobModel) -> None:
+        log.info(f"Processing export job {job.response_id} (attempt {job.attempts})")
+        start = time.monotonic()
+        try:
+            self.handler(job)
+        except Exception as e:
+            log.exception(e)
+            self._record(job, e)
+        else:
+            self._record(job, None)
+        finally:
+            JOB_DURATION.observe(time.monotonic() - start)
+
+    def process_batch(self, jobs: list) -> None:
+        log.info(f"Processing {len(jobs)} export jobs of batch {jobs[0].batch_id}")
+        start = time.monotonic()
+        try:
+            failures = self.batch_handler(jobs)
+        except Exception as e:
+            log.exception(e)
+            failures = {job.response_id: e for job in jobs}
+        finally:
+            JOB_DURATION.observe(time.monotonic() - start)
+
+        for job in jobs:
+            self._record(job, failures.get(job.response_id))
+
+    def _record(self, job: models.ExportJobModel, err: Exception | None) -> None:
+        if err is None:
+            job = crud.complete_export_job(job.id)
+            JOB_OUTCOMES.labels("succeeded").inc()
+            JOB_LATENCY.observe((job.finished_at - job.created_at).total_seconds())
+            return
+
+        job = crud.fail_export_job(job.id, str(err), self.max_attempts, self.backoff)
+        if job.state == models.ExportJobState.FAILED:
+            JOB_OUTCOMES.labels("failed").inc()
+            log.error(
+                f"Export job {job.response_id} failed after {job.attempts} attempts"
+            )
+        else:
+            JOB_OUTCOMES.labels("retry").inc()
+            log.warning(
+                f"Export job {job.response_id} will be retried at {job.available_at}"
+            )
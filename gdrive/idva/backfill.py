@@ -0,0 +1,324 @@
+"""
+Backfill of daily analytics reports.
+
+A date range is split into one report per day, created by a pool of worker threads
+shared by every backfill. When the runner is given a download, the data of the
+days is downloaded in groups ahead of their reports. Days are retried with an exponential backoff, waiting on
+a timer rather than in a worker, and days that still failed can be retried again
+later. Google API requests of every day go through the shared rate limiters of
+`analytics_client` and `sheets_client`.
+
+Backfills are kept in memory: their progress is lost when the app restarts.
+"""
+
+import logging
+import threading
+import uuid
+from concurrent import futures
+from datetime import datetime, timedelta
+from enum import Enum
+from typing import Callable, Dict, List
+
+import prometheus_client
+
+log = logging.getLogger(__name__)
+
+DAY_OUTCOMES = prometheus_client.Counter(
+    "gdrive_analytics_backfill_days_total",
+    "Daily report attempts of analytics backfills by outcome",
+    ["outcome"],
+)
+
+
+class DayState(str, Enum):
+    QUEUED = "queued"
+    RUNNING = "running"
+    SUCCEEDED = "succeeded"
+    FAILED = "failed"
+
+
+class BackfillDay:
+    """
+    The report of a single day of a backfill
+    """
+
+    def __init__(self, date: datetime) -> None:
+        self.date = date
+        self.state = DayState.QUEUED
+        self.attempts = 0
+        self.error = None
+        self.sheets_id = None
+        self.started_at = None
+        self.finished_at = None
+
+    def as_status(self) -> dict:
+        return {
+            "date": self.date.strftime("%Y-%m-%d"),
+            "state": self.state.value,
+            "attempts": self.attempts,
+            "error": self.error,
+            "sheetsId": self.sheets_id,
+            "startedAt": self.started_at.isoformat() if self.started_at else None,
+            "finishedAt": self.finished_at.isoformat() if self.finished_at else None,
+        }
+
+
+class Backfill:
+    """
+    The daily reports of a date range
+    """
+
+    def __init__(self, start: datetime, end: datetime, dry_run: bool = False) -> None:
+        self.id = uuid.uuid4().hex
+        self.dry_run = dry_run
+        self.days = [
+            BackfillDay(start + timedelta(days=offset))
+            for offset in range((end - start).days + 1)
+        ]
+        self.created_at = datetime.now()
+
+    def counts(self) -> Dict[str, int]:
+        counts = {state.value: 0 for state in DayState}
+        for day in self.days:
+            counts[day.state.value] += 1
+        return counts
+
+    @property
+    def done(self) -> bool:
+        return all(
+            day.state in (DayState.SUCCEEDED, DayState.FAILED) for day in self.days
+        )
+
+    def as_status(self) -> dict:
+        return {
+            "backfillId": self.id,
+            "dryRun": self.dry_run,
+            "total": len(self.days),
+            **self.counts(),
+            "done": self.done,
+            "createdAt": self.created_at.isoformat(),
+            "days": [day.as_status() for day in self.days],
+        }
+
+
+class BackfillRunner:
+    """
+    Args:
+        report (Callable): Creates the report of a day, called with the day, whether
+            it is a dry run and the data of the day from `download`, None when it was
+            not downloaded. Returns the Google Sheets ID of the report.
+        workers (int): Days reported at once, across every backfill
+        max_attempts (int): Attempts of a day before it is failed
+        retry_backoff (float): Seconds before the second attempt of a day, doubled
+            for each further attempt
+        prepare (Callable): Called once before the days of a backfill are queued,
+            i.e. to create the folder every report is written to
+        max_days (int): Most days of a single backfill
+        keep (int): Finished backfills kept for their progress, the oldest are
+            removed as new backfills start
+        download (Callable): Downloads the data of a list of days at once, returning
+            the data of each day in order. When it fails, every day of the group is
+            reported without its data.
+        batch (int): Days downloaded at once
+    """
+
+    def __init__(
+        self,
+        report: Callable[[datetime, bool, object], str],
+        workers: int,
+        max_attempts: int = 3,
+        retry_backoff: float = 30,
+        prepare: Callable[[bool], None] = None,
+        max_days: int = 366,
+        keep: int = 50,
+        download: Callable[[List[datetime]], list] = None,
+        batch: int = 1,
+    ) -> None:
+        self.report = report
+        self.workers = max(workers, 1)
+        self.max_attempts = max(max_attempts, 1)
+        self.retry_backoff = retry_backoff
+        self.prepare = prepare
+        self.max_days = max_days
+        self.keep = keep
+        self.download = download
+        self.batch = max(batch, 1)
+        self.backfills = {}
+        self._lock = threading.Lock()
+        self._executor = None
+        self._timers = set()
+
+    def start(self, start: datetime, end: datetime, dry_run: bool = False) -> Backfill:
+        """
+        Queue the report of each day from start to end, inclusive
+
+        Raises:
+            ValueError: the range is empty or longer than `max_days`
+        """
+        if end < start:
+            raise ValueError("End date %s is before start date %s" % (end, start))
+        if (end - start).days + 1 > self.max_days:
+            raise ValueError("Backfills cover at most %s days" % (self.max_days))
+
+        backfill = Backfill(start, end, dry_run)
+        if self.prepare is not None:
+            self.prepare(dry_run)
+        with self._lock:
+            self._prune()
+            self.backfills[backfill.id] = backfill
+        self._submit(backfill, backfill.days)
+        log.info(f"Backfill {backfill.id} queued {len(backfill.days)} days")
+        return backfill
+
+    def retry(self, backfill_id: str) -> Backfill | None:
+        """
+        Queue the failed days of a backfill again
+
+        Returns:
+            Backfill: the backfill, None if it does not exist
+        """
+        backfill = self.get(backfill_id)
+        if backfill is None:
+            return None
+
+        with self._lock:
+            failed = [day for day in backfill.days if day.state == DayState.FAILED]
+            for day in failed:
+                day.state = DayState.QUEUED
+        self._submit(backfill, failed)
+        log.info(f"Backfill {backfill.id} retrying {len(failed)} days")
+        return backfill
+
+    def get(self, backfill_id: str) -> Backfill | None:
+        with self._lock:
+            return self.backfills.get(backfill_id)
+
+    def status(self, backfill_id: str) -> dict | None:
+        """
+        Progress of a backfill, read while no day is changing, see `Backfill.as_status`
+        """
+        with self._lock:
+            backfill = self.backfills.get(backfill_id)
+            return backfill.as_status() if backfill is not None else None
+
+    def stop(self) -> None:
+        """
+        Stop the workers, cancelling days that have not started and pending retries
+        """
+        with self._lock:
+            executor, self._executor = self._executor, None
+            timers, self._timers = self._timers, set()
+        for timer in timers:
+            timer.cancel()
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def _prune(self) -> None:
+        # Backfills are kept in the order they started
+        done = [id for id, backfill in self.backfills.items() if backfill.done]
+        for id in done[: max(len(done) - self.keep + 1, 0)]:
+            del self.backfills[id]
+
+    def _submit(
+        self,
+        backfill: Backfill,
+        days: List[BackfillDay],
+        attempt: int = 0,
+        data: list = None,
+    ) -> None:
+        """
+        Queue the report of each day, downloading the data of new attempts first
+        when the runner has a download
+        """
+        with self._lock:
+            if self._executor is None:
+                self._executor = futures.ThreadPoolExecutor(
+                    max_workers=self.workers, thread_name_prefix="analytics-backfill"
+                )
+            if data is None and attempt == 0 and self.download is not None:
+                for idx in range(0, len(days), self.batch):
+                    self._executor.submit(
+                        self._download, backfill, days[idx : idx + self.batch]
+                    )
+                return
+            for idx, day in enumerate(days):
+                self._executor.submit(
+                    self._run_day,
+                    backfill,
+                    day,
+                    attempt,
+                    data[idx] if data is not None else None,
+                )
+
+    def _download(self, backfill: Backfill, days: List[BackfillDay]) -> None:
+        """
+        Download the data of a group of days, then queue their reports
+        """
+        try:
+            data = self.download([day.date for day in days])
+        except Exception as e:
+            log.warning(
+                f"Backfill {backfill.id} failed to download {len(days)} days "
+                f"from {days[0].date.date()}, reporting them one by one: {e}"
+            )
+            data = [None] * len(days)
+        self._submit(backfill, days, data=data)
+
+    def _retry_later(
+        self, backfill: Backfill, day: BackfillDay, attempt: int, data: object
+    ) -> None:
+        """
+        Submit the next attempt of a day once its backoff passed, without holding a
+        worker while waiting
+        """
+        delay = self.retry_backoff * 2 ** (attempt - 1)
+        if delay <= 0:
+            self._submit(backfill, [day], attempt, [data])
+            return
+
+        def resubmit() -> None:
+            with self._lock:
+                self._timers.discard(timer)
+            self._submit(backfill, [day], attempt, [data])
+
+        timer = threading.Timer(delay, resubmit)
+        timer.daemon = True
+        with self._lock:
+            self._timers.add(timer)
+        timer.start()
+
+    def _run_day(
+        self, backfill: Backfill, day: BackfillDay, attempt: int, data: object
+    ) -> None:
+        """
+        Make one attempt at the report of a day
+        """
+        with self._lock:
+            day.state = DayState.RUNNING
+            day.attempts += 1
+            day.started_at = day.started_at or datetime.now()
+
+        try:
+            sheets_id = self.report(day.date, backfill.dry_run, data)
+        except Exception as e:
+            DAY_OUTCOMES.labels("error").inc()
+            log.warning(
+                f"Backfill {backfill.id} failed {day.date.date()} "
+                f"(attempt {day.attempts}): {e}"
+            )
+            with self._lock:
+                day.error = str(e)
+                if attempt + 1 >= self.max_attempts:
+                    day.state = DayState.FAILED
+                    day.finished_at = datetime.now()
+                    return
+                day.state = DayState.QUEUED
+            self._retry_later(backfill, day, attempt + 1, data)
+            return
+
+        DAY_OUTCOMES.labels("success").inc()
+        with self._lock:
+            day.sheets_id = sheets_id
+            day.error = None
+            day.state = DayState.SUCCEEDED
+            day.finished_at = datetime.now()
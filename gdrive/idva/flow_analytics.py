@@ -1,462 +1,433 @@
 import datetime
 from enum import Enum
+from typing import Dict, List
 import pandas as pd
 import logging
 
 from gdrive import settings, sheets_client, drive_client, analytics_client
 from gdrive.idva.pivot_director import IDVAPivotDirector
+from gdrive.sheets import pivot_engine
+from gdrive.sheets.batch import cell_name
+from gdrive.sheets.plan import ReportCompiler, ReportPlan
 from gdrive.sheets.builders import FormulaBuilder
 from gdrive.sheets.types import FormulaEnum, Range, StringLiteral
 
 log = logging.getLogger(__name__)
 idva = IDVAPivotDirector()
 
+# Columns of the analytics data, see `analytics_client.DIMENSIONS`
+EVENT_COLUMN = 0
+MEDIUM_COLUMN = 2
+SOURCE_COLUMN = 3
+
 
 class SheetsEnum(str, Enum):
     REKREWT = "Rekrewt Pivot Tables"
     GSA = "GSA Use Pivot Table"
 
 
-def create_report(start_date: datetime, end_date: datetime):
-    response = analytics_client.download(
-        settings.ANALYTICS_PROPERTY_ID, start_date, end_date
+def create_report(
+    start_date: datetime,
+    end_date: datetime,
+    dry_run: bool = False,
+    analytics_df: pd.DataFrame = None,
+):
+    """
+    Download the analytics data of the date range and create its report spreadsheet
+
+    Args:
+        start_date (datetime): First day of the report
+        end_date (datetime): Last day of the report
+        dry_run (bool): Only log the API transactions creating the spreadsheet
+        analytics_df (pd.DataFrame): Data of the date range already downloaded,
+            see `analytics_client.download_frames`
+    """
+    if analytics_df is None:
+        analytics_df = analytics_client.download_frame(
+            settings.ANALYTICS_PROPERTY_ID, start_date, end_date
+        )
+
+    analytics_df = preprocess_report(analytics_client.sheet_frame(analytics_df))
+
+    plan = plan_report(
+        analytics_df, start_date, end_date, settings.ANALYTICS_TEMPLATE_ID
     )
+    return run_plan(plan, dry_run)
+
+
+def create_template(dry_run: bool = False):
+    """
+    Create a report template: a report with the pages, pivot tables, labels and
+    formulas of every report, but only the header of the data. Reports are copied
+    from the template when its ID is set in `ANALYTICS_TEMPLATE_ID`.
+
+    Returns:
+        str: Google Sheets ID of the template, None in a dry run
+    """
+    header = pd.DataFrame([analytics_client.DIMENSIONS + analytics_client.METRICS])
+    plan = ReportPlan("Analytics Report Template")
+    plan.set_data(header)
+    plan_pages(plan)
+    plan_pivot_tables(header, plan, live=True)
+    return run_plan(plan, dry_run)
 
-    analytics_df = analytics_client.create_df_from_analytics_response(response)
-    analytics_df = preprocess_report(analytics_df)
 
-    sheets_id = export(analytics_df, start_date, end_date)
-    names_to_id = create_pages(sheets_id)
-    create_pivot_tables(analytics_df, names_to_id, sheets_id)
+def run_plan(plan: ReportPlan, dry_run: bool = False):
+    """
+    Create the spreadsheet of a plan in the Google Analytics folder
+    """
+    if not dry_run:
+        plan.folder_id = analytics_folder()
+        log.info("Uploading to folder %s (%s)" % ("Google Analytics", plan.folder_id))
+
+    compiler = ReportCompiler(
+        drive_client.service,
+        sheets_client.sheets_service,
+        chunk_rows=settings.SHEETS_WRITE_CHUNK_ROWS,
+        workers=settings.SHEETS_WRITE_WORKERS,
+        http=sheets_client.thread_http,
+        limiter=sheets_client.limiter,
+    )
+    sheets_id = compiler.run(plan, dry_run=dry_run)
+    if sheets_id is not None:
+        log.info("Successfully created %s (%s)" % (plan.title, sheets_id))
+    return sheets_id
 
 
-def export(
-    df: pd.DataFrame, date_of_report: datetime, end_date: datetime = None
-) -> str:
+def analytics_folder() -> str:
+    """
+    ID of the Google Analytics folder reports are created in, created when missing.
+    The folder is recorded once created, see `drive_client.create_folder`.
     """
-    Transform the downloaded response from the google analytics API into a
-    Google Sheets Object.
+    return drive_client.create_folder(
+        "Google Analytics", parent_id=settings.ANALYTICS_ROOT
+    )
+
 
-    This function first touches a Google Sheets object with the drive API, then
-    writes the analytics data to that object. As of right now there is no way to do
-    this in one API transaction.
+def plan_report(
+    df: pd.DataFrame,
+    date_of_report: datetime,
+    end_date: datetime = None,
+    template_id: str = None,
+) -> ReportPlan:
+    """
+    Declare the report spreadsheet of the analytics data: the data itself, then
+    pages of pivot tables with their labels and totals.
 
     Args:
         df (pandas.DataFrame): Tabular data to export to Google Sheets object
         date_of_report (datetime): Date the report was run
+        template_id (str): Template to copy the report from, which already holds
+            the pages and pivot tables, see `create_template`. Templates always
+            hold live pivot tables, whatever `settings.ANALYTICS_LIVE_PIVOTS` is.
     Returns:
-        str: Google Sheets ID of the new Sheets object
+        ReportPlan: plan to create the report with, see `ReportCompiler`
     """
-    filename_str = generate_filename(date_of_report, end_date)
-    analytics_folder_id = drive_client.create_folder(
-        "Google Analytics", parent_id=settings.ANALYTICS_ROOT
+    plan = ReportPlan(
+        generate_filename(date_of_report, end_date), template_id=template_id
     )
+    if template_id is not None:
+        if not settings.ANALYTICS_LIVE_PIVOTS:
+            log.warning(
+                "ANALYTICS_LIVE_PIVOTS=False is ignored: reports copied from "
+                "template %s use its live pivot tables" % (template_id)
+            )
+        # The template holds the header row
+        plan.set_data(df.iloc[1:], start_row=1)
+        return plan
 
-    # We have to do this in multiple steps with more than one client because the Sheets API
-    # doesnt support opening a file in a given directory.
-    sheets_id = drive_client.create_empty_spreadsheet(filename_str, analytics_folder_id)
-    log.info("Uploading to folder %s (%s)" % ("Google Analytics", analytics_folder_id))
-    result = sheets_client.export_df_to_gdrive_speadsheet(df, sheets_id)
-    log.info(
-        "Successfully created %s (%s)" % (filename_str, result.get("spreadsheetId"))
-    )
-    return sheets_id
+    plan.set_data(df)
+    plan_pages(plan)
+    plan_pivot_tables(df, plan)
+    return plan
 
 
 def preprocess_report(df: pd.DataFrame) -> pd.DataFrame:
-    tracked_events = ["first_visit", "session_start"]
-    tracked_sources = [
-        "m.facebook.com",
-        "fb.com",
-        "([a-zA-Z].+)craigslist.org",
-        "reddit.com",
-        "redd.it",
-        "t.co",
-        "x.com",
-        "twitter",
-        "linked.com",
-        "lnkd.in",
-        "pllpl",
-        "ffg",
-    ]
-    tracked_mediums = ["fb", "cl", "rd", "tx", "ln", "pllpl", "ffg"]
-
-    for event in tracked_events:
-        tracked_df = df[df[0] == event]
-        for source in tracked_sources:
-            if tracked_df[tracked_df[3].str.match(source)].empty:
-                add_source_placeholder_row(df, event, source)
-
-        for medium in tracked_mediums:
-            if tracked_df[tracked_df[2].str.match(medium)].empty:
-                add_medium_placeholder_row(df, event, medium)
-
-    return df
-
-
-def add_source_placeholder_row(df: pd.DataFrame, event: str, source: str) -> None:
-    logging.info(f"Adding placeholder {event} for {source}")
-    df.loc[len(df.index)] = [event, "---", "---", source, "---", "---", 0, 0, 0, 0, 0]
-
-
-def add_medium_placeholder_row(df: pd.DataFrame, event: str, medium: str) -> None:
-    logging.info(f"Adding placeholder {event} for {medium}")
-    df.loc[len(df.index)] = [event, "---", medium, "---", "---", "---", 0, 0, 0, 0, 0]
-
-
-def create_pages(sheets_id: str) -> dict:
     """
-    Add new pages and pivot tables.
-
-    This function is fairly naive and inefficient. If we ever want to make Google Sheets
-    more often than once a day, we should refactor this to limit the number of API transactions.
+    Add a placeholder row for each tracked source and medium without any rows of a
+    tracked event, so every pivot table has a row for it. Tracked events, sources
+    and mediums are configured in `settings`.
 
     Args:
-        df (pandas.DataFrame): Tabular data in the spreadsheet
-        sheets_id (str): Google Sheets object ID
+        df (pandas.DataFrame): Analytics data, with the column names as first row
     Returns:
-        names_to_id (dict): A Dictionary mapping string sheet names to IDs
+        pandas.DataFrame: the data followed by the placeholder rows
     """
-    new_sheet_name_to_id = sheets_client.add_new_pages(
-        [SheetsEnum.REKREWT.value, SheetsEnum.GSA.value], sheets_id, column_count=30
+    events = settings.ANALYTICS_TRACKED_EVENTS
+    sources = missing_patterns(
+        df, SOURCE_COLUMN, events, settings.ANALYTICS_TRACKED_SOURCES
+    )
+    mediums = missing_patterns(
+        df, MEDIUM_COLUMN, events, settings.ANALYTICS_TRACKED_MEDIUMS
     )
-    log.info("Added %s pages to %s" % (len(new_sheet_name_to_id.keys()), sheets_id))
-    return new_sheet_name_to_id
+
+    rows = []
+    for event in events:
+        for source in sources[event]:
+            log.info(f"Adding placeholder {event} for {source}")
+            rows.append([event, "---", "---", source, "---", "---", 0, 0, 0, 0, 0])
+        for medium in mediums[event]:
+            log.info(f"Adding placeholder {event} for {medium}")
+            rows.append([event, "---", medium, "---", "---", "---", 0, 0, 0, 0, 0])
+
+    if not rows:
+        return df
+    return pd.concat([df, pd.DataFrame(rows, columns=df.columns)], ignore_index=True)
+
+
+def missing_patterns(
+    df: pd.DataFrame, column: int, events: List[str], patterns: List[str]
+) -> Dict[str, List[str]]:
+    """
+    Patterns that match the start of no value of the column, in the rows of each
+    event. Every pattern is matched in a single pass over the distinct values.
+
+    Returns:
+        dict: the missing patterns of each event, in the order of the patterns
+    """
+    if not patterns:
+        return {event: [] for event in events}
+
+    pairs = df[df[EVENT_COLUMN].isin(events)][[EVENT_COLUMN, column]].drop_duplicates()
+    groups = ["_tracked%s" % (idx) for idx in range(len(patterns))]
+    # An optional lookahead for each pattern, so every pattern is tried on a value
+    regex = "^" + "".join(
+        "(?:(?=(?P<%s>%s)))?" % (group, pattern)
+        for group, pattern in zip(groups, patterns)
+    )
+    present = (
+        pairs[column]
+        .str.extract(regex)[groups]
+        .notna()
+        .groupby(pairs[EVENT_COLUMN].values)
+        .any()
+        .reindex(events, fill_value=False)
+    )
+    return {
+        event: [
+            pattern
+            for pattern, found in zip(patterns, present.loc[event].tolist())
+            if not found
+        ]
+        for event in events
+    }
+
+
+def plan_pages(plan: ReportPlan) -> None:
+    """
+    Add new pages.
+
+    Args:
+        plan (ReportPlan): Report to add the pages to
+    """
+    plan.add_page(SheetsEnum.REKREWT.value, column_count=30)
+    plan.add_page(SheetsEnum.GSA.value, column_count=30)
 
 
-def create_pivot_tables(df: pd.DataFrame, names_to_id: dict, sheets_id: str):
+def plan_pivot_tables(df: pd.DataFrame, plan: ReportPlan, live: bool = None) -> None:
+    """
+    Add the pivot tables and their labels and totals. Unless live, pivot tables are
+    computed locally and written as values, see `settings.ANALYTICS_LIVE_PIVOTS`.
+    """
     # Make a dictionary mapping the name of the column to its index, useful for the pivot tables.
     col_dict = {}
     for idx, val in enumerate(df.iloc[0]):
         col_dict[val] = idx
 
-    facebook_pivot(sheets_id, names_to_id, col_dict)
-    craigslist_pivot(sheets_id, names_to_id, col_dict)
-    reddit_pivot(sheets_id, names_to_id, col_dict)
-    twitter_x_pivot(sheets_id, names_to_id, col_dict)
-    linkedin_pivot(sheets_id, names_to_id, col_dict)
-    linked_pivot(sheets_id, names_to_id, col_dict)
-    pllpl_pivot(sheets_id, names_to_id, col_dict)
-    ffg_pivot(sheets_id, names_to_id, col_dict)
-
-    sheets_client.add_pivot_tables(
-        sheets_id, names_to_id[SheetsEnum.GSA.value], idva.clicks(col_dict)
-    )
+    if live is None:
+        live = settings.ANALYTICS_LIVE_PIVOTS
+    data = None if live else pivot_engine.source(df)
+
+    facebook_pivot(plan, col_dict, data)
+    craigslist_pivot(plan, col_dict, data)
+    reddit_pivot(plan, col_dict, data)
+    twitter_x_pivot(plan, col_dict, data)
+    linkedin_pivot(plan, col_dict, data)
+    linked_pivot(plan, col_dict, data)
+    pllpl_pivot(plan, col_dict, data)
+    ffg_pivot(plan, col_dict, data)
+
+    write_pivot(plan, SheetsEnum.GSA.value, idva.clicks(col_dict), data=data)
 
     # Add formulas for some totals here
     session_sum = FormulaBuilder(FormulaEnum.SUM, params=[Range("C2", "G2")])
     first_visit_sum = FormulaBuilder(FormulaEnum.SUM, params=[Range("C3", "G3")])
 
-    sheets_client.update_cell_value(
-        sheets_id, SheetsEnum.REKREWT.value, "A2", "Sessions"
+    plan.write(
+        SheetsEnum.REKREWT.value, "A2", "Sessions"
     )  # Sessions for each source label
-    sheets_client.update_cell_value(
-        sheets_id, SheetsEnum.REKREWT.value, "A3", "First Visits"
+    plan.write(
+        SheetsEnum.REKREWT.value, "A3", "First Visits"
     )  # First visits for each source label
-    sheets_client.update_cell_value(
-        sheets_id, SheetsEnum.REKREWT.value, "B1", "Total"
-    )  # Total of each event label
-
-    sheets_client.update_cell_value(
-        sheets_id, SheetsEnum.REKREWT.value, "B2", session_sum.render()
-    )  # total value
-    sheets_client.update_cell_value(
-        sheets_id, SheetsEnum.REKREWT.value, "B3", first_visit_sum.render()
-    )  # total value
-
-
-def facebook_pivot(sheets_id, names_to_id, col_dict):
-    sheets_client.update_cell_value(
-        sheets_id, SheetsEnum.REKREWT.value, "A5", "FACEBOOK"
-    )  # Pivot table Label
-    sheets_client.update_cell_value(
-        sheets_id, SheetsEnum.REKREWT.value, "C1", "FACEBOOK"
-    )  # Totals label
-
-    sheets_client.add_pivot_tables(
-        sheets_id,
-        names_to_id[SheetsEnum.REKREWT.value],
-        idva.facebook(col_dict),
-        row_idx=5,
-        col_idx=0,
-    )
+    plan.write(SheetsEnum.REKREWT.value, "B1", "Total")  # Total of each event label
 
-    facebook_sessions = FormulaBuilder(
-        FormulaEnum.GET_PIVOT_DATA,
-        params=[
-            StringLiteral("SUM of eventCount"),
-            "A6",
-            StringLiteral("eventName"),
-            StringLiteral("session_start"),
-        ],
-    )
+    plan.write(SheetsEnum.REKREWT.value, "B2", session_sum.render())  # total value
+    plan.write(SheetsEnum.REKREWT.value, "B3", first_visit_sum.render())  # total value
 
-    facebook_visit = FormulaBuilder(
-        FormulaEnum.GET_PIVOT_DATA,
-        params=[
-            StringLiteral("SUM of eventCount"),
-            "A6",
-            StringLiteral("eventName"),
-            StringLiteral("first_visit"),
-        ],
-    )
 
-    sheets_client.update_cell_value(
-        sheets_id, SheetsEnum.REKREWT.value, "C2", facebook_sessions.render()
-    )
-    sheets_client.update_cell_value(
-        sheets_id, SheetsEnum.REKREWT.value, "C3", facebook_visit.render()
+def facebook_pivot(plan: ReportPlan, col_dict: dict, data: pd.DataFrame = None):
+    plan.write(SheetsEnum.REKREWT.value, "A5", "FACEBOOK")  # Pivot table Label
+    plan.write(SheetsEnum.REKREWT.value, "C1", "FACEBOOK")  # Totals label
+
+    write_pivot(
+        plan,
+        SheetsEnum.REKREWT.value,
+        idva.facebook(col_dict),
+        row_idx=5,
+        col_idx=0,
+        data=data,
+        totals={"C2": "session_start", "C3": "first_visit"},
     )
 
 
-def craigslist_pivot(sheets_id, names_to_id, col_dict):
-    sheets_client.update_cell_value(
-        sheets_id, SheetsEnum.REKREWT.value, "G5", "CRAIGSLIST"
-    )  # Pivot table Label
-    sheets_client.update_cell_value(
-        sheets_id, SheetsEnum.REKREWT.value, "D1", "CRAIGSLIST"
-    )  # Totals label
+def craigslist_pivot(plan: ReportPlan, col_dict: dict, data: pd.DataFrame = None):
+    plan.write(SheetsEnum.REKREWT.value, "G5", "CRAIGSLIST")  # Pivot table Label
+    plan.write(SheetsEnum.REKREWT.value, "D1", "CRAIGSLIST")  # Totals label
 
-    sheets_client.add_pivot_tables(
-        sheets_id,
-        names_to_id[SheetsEnum.REKREWT.value],
+    write_pivot(
+        plan,
+        SheetsEnum.REKREWT.value,
         idva.craigslist(col_dict),
         row_idx=5,
         col_idx=6,
-    )
-
-    craigslist_sessions = FormulaBuilder(
-        FormulaEnum.GET_PIVOT_DATA,
-        params=[
-            StringLiteral("SUM of eventCount"),
-            "G6",
-            StringLiteral("eventName"),
-            StringLiteral("session_start"),
-        ],
-    )
-
-    craigslist_visit = FormulaBuilder(
-        FormulaEnum.GET_PIVOT_DATA,
-        params=[
-            StringLiteral("SUM of eventCount"),
-            "G6",
-            StringLiteral("eventName"),
-            StringLiteral("first_visit"),
-        ],
-    )
-
-    sheets_client.update_cell_value(
-        sheets_id, SheetsEnum.REKREWT.value, "D2", craigslist_sessions.render()
-    )
-    sheets_client.update_cell_value(
-        sheets_id, SheetsEnum.REKREWT.value, "D3", craigslist_visit.render()
+        data=data,
+        totals={"D2": "session_start", "D3": "first_visit"},
     )
 
 
-def reddit_pivot(sheets_id, names_to_id, col_dict):
-    sheets_client.update_cell_value(
-        sheets_id, SheetsEnum.REKREWT.value, "L5", "REDDIT"
-    )  # Pivot table Label
-    sheets_client.update_cell_value(
-        sheets_id, SheetsEnum.REKREWT.value, "E1", "REDDIT"
-    )  # Totals label
+def reddit_pivot(plan: ReportPlan, col_dict: dict, data: pd.DataFrame = None):
+    plan.write(SheetsEnum.REKREWT.value, "L5", "REDDIT")  # Pivot table Label
+    plan.write(SheetsEnum.REKREWT.value, "E1", "REDDIT")  # Totals label
 
-    sheets_client.add_pivot_tables(
-        sheets_id,
-        names_to_id[SheetsEnum.REKREWT.value],
+    write_pivot(
+        plan,
+        SheetsEnum.REKREWT.value,
         idva.reddit(col_dict),
         row_idx=5,
         col_idx=11,
-    )
-
-    reddit_sessions = FormulaBuilder(
-        FormulaEnum.GET_PIVOT_DATA,
-        params=[
-            StringLiteral("SUM of eventCount"),
-            "L6",
-            StringLiteral("eventName"),
-            StringLiteral("session_start"),
-        ],
-    )
-
-    reddit_visit = FormulaBuilder(
-        FormulaEnum.GET_PIVOT_DATA,
-        params=[
-            StringLiteral("SUM of eventCount"),
-            "L6",
-            StringLiteral("eventName"),
-            StringLiteral("first_visit"),
-        ],
-    )
-
-    sheets_client.update_cell_value(
-        sheets_id, SheetsEnum.REKREWT.value, "E2", reddit_sessions.render()
-    )
-    sheets_client.update_cell_value(
-        sheets_id, SheetsEnum.REKREWT.value, "E3", reddit_visit.render()
+        data=data,
+        totals={"E2": "session_start", "E3": "first_visit"},
     )
 
 
-def twitter_x_pivot(sheets_id, names_to_id, col_dict):
-    sheets_client.update_cell_value(
-        sheets_id, SheetsEnum.REKREWT.value, "Q5", "TWITTER/X"
-    )  # Pivot table Label
-    sheets_client.update_cell_value(
-        sheets_id, SheetsEnum.REKREWT.value, "F1", "TWITTER/X"
-    )  # Totals label
+def twitter_x_pivot(plan: ReportPlan, col_dict: dict, data: pd.DataFrame = None):
+    plan.write(SheetsEnum.REKREWT.value, "Q5", "TWITTER/X")  # Pivot table Label
+    plan.write(SheetsEnum.REKREWT.value, "F1", "TWITTER/X")  # Totals label
 
-    sheets_client.add_pivot_tables(
-        sheets_id,
-        names_to_id[SheetsEnum.REKREWT.value],
+    write_pivot(
+        plan,
+        SheetsEnum.REKREWT.value,
         idva.twitter_x(col_dict),
         row_idx=5,
         col_idx=16,
+        data=data,
+        totals={"F2": "session_start", "F3": "first_visit"},
     )
 
-    twitter_x_sessions = FormulaBuilder(
-        FormulaEnum.GET_PIVOT_DATA,
-        params=[
-            StringLiteral("SUM of eventCount"),
-            "Q6",
-            StringLiteral("eventName"),
-            StringLiteral("session_start"),
-        ],
-    )
 
-    twitter_x_visit = FormulaBuilder(
-        FormulaEnum.GET_PIVOT_DATA,
-        params=[
-            StringLiteral("SUM of eventCount"),
-            "Q6",
-            StringLiteral("eventName"),
-            StringLiteral("first_visit"),
-        ],
-    )
+def linkedin_pivot(plan: ReportPlan, col_dict: dict, data: pd.DataFrame = None):
+    plan.write(SheetsEnum.REKREWT.value, "V5", "LINKEDIN")  # Pivot table Label
+    plan.write(SheetsEnum.REKREWT.value, "G1", "LINKEDIN")  # Totals label
 
-    sheets_client.update_cell_value(
-        sheets_id, SheetsEnum.REKREWT.value, "F2", twitter_x_sessions.render()
-    )
-    sheets_client.update_cell_value(
-        sheets_id, SheetsEnum.REKREWT.value, "F3", twitter_x_visit.render()
-    )
-
-
-def linkedin_pivot(sheets_id, names_to_id, col_dict):
-    sheets_client.update_cell_value(
-        sheets_id, SheetsEnum.REKREWT.value, "V5", "LINKEDIN"
-    )  # Pivot table Label
-    sheets_client.update_cell_value(
-        sheets_id, SheetsEnum.REKREWT.value, "G1", "LINKEDIN"
-    )  # Totals label
-
-    sheets_client.add_pivot_tables(
-        sheets_id,
-        names_to_id[SheetsEnum.REKREWT.value],
+    write_pivot(
+        plan,
+        SheetsEnum.REKREWT.value,
         idva.linkedin(col_dict),
         row_idx=5,
         col_idx=21,
-    )
-
-    linkedin_sessions = FormulaBuilder(
-        FormulaEnum.GET_PIVOT_DATA,
-        params=[
-            StringLiteral("SUM of eventCount"),
-            "V6",
-            StringLiteral("eventName"),
-            StringLiteral("session_start"),
-        ],
-    )
-
-    linkedin_visit = FormulaBuilder(
-        FormulaEnum.GET_PIVOT_DATA,
-        params=[
-            StringLiteral("SUM of eventCount"),
-            "V6",
-            StringLiteral("eventName"),
-            StringLiteral("first_visit"),
-        ],
-    )
-
-    sheets_client.update_cell_value(
-        sheets_id, SheetsEnum.REKREWT.value, "G2", linkedin_sessions.render()
-    )
-    sheets_client.update_cell_value(
-        sheets_id, SheetsEnum.REKREWT.value, "G3", linkedin_visit.render()
+        data=data,
+        totals={"G2": "session_start", "G3": "first_visit"},
     )
 
 
-def linked_pivot(sheets_id, names_to_id, col_dict):
-    sheets_client.update_cell_value(
-        sheets_id, SheetsEnum.REKREWT.value, "AA5", "LINKED.COM"
-    )  # Pivot table Label
-    sheets_client.update_cell_value(
-        sheets_id, SheetsEnum.REKREWT.value, "H1", "LINKED.COM"
-    )  # Totals label
+def linked_pivot(plan: ReportPlan, col_dict: dict, data: pd.DataFrame = None):
+    plan.write(SheetsEnum.REKREWT.value, "AA5", "LINKED.COM")  # Pivot table Label
+    plan.write(SheetsEnum.REKREWT.value, "H1", "LINKED.COM")  # Totals label
 
-    sheets_client.add_pivot_tables(
-        sheets_id,
-        names_to_id[SheetsEnum.REKREWT.value],
+    write_pivot(
+        plan,
+        SheetsEnum.REKREWT.value,
         idva.linked(col_dict),
         row_idx=5,
         col_idx=26,
+        data=data,
+        totals={"H2": "session_start", "H3": "first_visit"},
     )
 
-    linkedin_sessions = FormulaBuilder(
-        FormulaEnum.GET_PIVOT_DATA,
-        params=[
-            StringLiteral("SUM of eventCount"),
-            "AA6",
-            StringLiteral("eventName"),
-            StringLiteral("session_start"),
-        ],
-    )
 
-    linkedin_visit = FormulaBuilder(
-        FormulaEnum.GET_PIVOT_DATA,
-        params=[
-            StringLiteral("SUM of eventCount"),
-            "AA6",
-            StringLiteral("eventName"),
-            StringLiteral("first_visit"),
-        ],
-    )
+def pllpl_pivot(plan: ReportPlan, col_dict: dict, data: pd.DataFrame = None):
+    plan.write(SheetsEnum.REKREWT.value, "A23", "PLLPL")  # Pivot table Label
 
-    sheets_client.update_cell_value(
-        sheets_id, SheetsEnum.REKREWT.value, "H2", linkedin_sessions.render()
-    )
-    sheets_client.update_cell_value(
-        sheets_id, SheetsEnum.REKREWT.value, "H3", linkedin_visit.render()
-    )
-
-
-def pllpl_pivot(sheets_id, names_to_id, col_dict):
-    sheets_client.update_cell_value(
-        sheets_id, SheetsEnum.REKREWT.value, "A23", "PLLPL"
-    )  # Pivot table Label
-
-    sheets_client.add_pivot_tables(
-        sheets_id,
-        names_to_id[SheetsEnum.REKREWT.value],
+    write_pivot(
+        plan,
+        SheetsEnum.REKREWT.value,
         idva.pllpl(col_dict),
         row_idx=23,
         col_idx=0,
+        data=data,
     )
 
 
-def ffg_pivot(sheets_id, names_to_id, col_dict):
-    sheets_client.update_cell_value(
-        sheets_id, SheetsEnum.REKREWT.value, "A35", "FFG"
-    )  # Pivot table Label
+def ffg_pivot(plan: ReportPlan, col_dict: dict, data: pd.DataFrame = None):
+    plan.write(SheetsEnum.REKREWT.value, "A35", "FFG")  # Pivot table Label
 
-    sheets_client.add_pivot_tables(
-        sheets_id,
-        names_to_id[SheetsEnum.REKREWT.value],
+    write_pivot(
+        plan,
+        SheetsEnum.REKREWT.value,
         idva.ffg(col_dict),
         row_idx=35,
         col_idx=0,
+        data=data,
     )
 
 
+def write_pivot(
+    plan: ReportPlan,
+    page: str,
+    pt_def: dict,
+    row_idx: int = 0,
+    col_idx: int = 0,
+    data: pd.DataFrame = None,
+    totals: dict = None,
+):
+    """
+    Add a pivot table to a page of the report, along with the event totals read
+    from it. Without data the pivot table and totals are computed by Google Sheets,
+    otherwise they are computed from the data and written as values.
+
+    Args:
+        plan (ReportPlan): Report to add the pivot table to
+        page (str): Title of the page
+        pt_def (dict): Pivot table definition, i.e. from `IDVAPivotDirector`
+        row_idx (int): Index of the row to write the start of the table
+        col_idx (int): Index of the column to write the start of the table
+        data (pandas.DataFrame): Source data of the pivot table, see
+            `pivot_engine.source`
+        totals (dict): Cell of each total to the eventName it is the sum of
+    """
+    if data is None:
+        plan.add_pivot(page, pt_def, row_idx=row_idx, col_idx=col_idx)
+        for cell, event in (totals or {}).items():
+            total = FormulaBuilder(
+                FormulaEnum.GET_PIVOT_DATA,
+                params=[
+                    StringLiteral("SUM of eventCount"),
+                    cell_name(row_idx, col_idx),
+                    StringLiteral("eventName"),
+                    StringLiteral(event),
+                ],
+            )
+            plan.write(page, cell, total.render())
+        return
+
+    pivot = pivot_engine.LocalPivot(data, pt_def)
+    for row, values in enumerate(pivot.table()):
+        for col, value in enumerate(values):
+            plan.write(page, cell_name(row_idx + row, col_idx + col), value)
+    for cell, event in (totals or {}).items():
+        plan.write(page, cell, pivot.get("SUM of eventCount", eventName=event))
+
+
 def generate_filename(date: datetime, end_date: datetime = None):
     """
     Return filename for the new spreadsheet to be saved as
@@ -1,3 +1,6 @@
+import functools
+import threading
+
 from gdrive.sheets.builders import FormulaBuilder, PivotTableBuilder
 from gdrive.sheets.types import (
     SortOrderEnum,
@@ -9,7 +12,41 @@ from gdrive.sheets.types import (
 )
 
 
+def memoized(build):
+    """
+    Cache the pivot table definitions built by a director method. Definitions only
+    depend on the column mapping, and are read only so they can be shared. The
+    cache is shared by the threads creating reports, see `IDVAPivotDirector`.
+    """
+
+    @functools.wraps(build)
+    def wrapper(self, col_dict: dict) -> dict:
+        key = (build.__name__, frozenset(col_dict.items()))
+        with self._lock:
+            spec = self._specs.get(key)
+            if spec is None:
+                spec = build(self, col_dict)
+                if len(self._specs) >= self.cache_size:
+                    # Column mappings rarely change, drop the oldest
+                    self._specs.pop(next(iter(self._specs)), None)
+                self._specs[key] = spec
+            return spec
+
+    return wrapper
+
+
 class IDVAPivotDirector:
+    """
+    Args:
+        cache_size (int): Most pivot table definitions kept
+    """
+
+    def __init__(self, cache_size: int = 128) -> None:
+        self.cache_size = cache_size
+        self._specs = {}
+        self._lock = threading.Lock()
+
+    @memoized
     def clicks(self, col_dict: dict) -> dict:
         builder = PivotTableBuilder(0, col_dict)
         builder.add_row("eventName", sortOrder=SortOrderEnum.ASCENDING)
@@ -17,6 +54,7 @@ class IDVAPivotDirector:
         builder.add_value("eventCount", SummarizeFunctionEnum.SUM)
         return builder.render()
 
+    @memoized
     def facebook(self, col_dict: dict) -> dict:
         builder = PivotTableBuilder(0, col_dict)
         builder.add_row("eventName", SortOrderEnum.ASCENDING, show_totals=False)
@@ -71,6 +109,7 @@ class IDVAPivotDirector:
 
         return builder.render()
 
+    @memoized
     def craigslist(self, col_dict: dict) -> dict:
         builder = PivotTableBuilder(0, col_dict)
         builder.add_row("eventName", SortOrderEnum.ASCENDING, show_totals=False)
@@ -119,6 +158,7 @@ class IDVAPivotDirector:
 
         return builder.render()
 
+    @memoized
     def reddit(self, col_dict: dict) -> dict:
         builder = PivotTableBuilder(0, col_dict)
         builder.add_row("eventName", SortOrderEnum.ASCENDING, show_totals=False)
@@ -171,6 +211,7 @@ class IDVAPivotDirector:
 
         return builder.render()
 
+    @memoized
     def twitter_x(self, col_dict: dict) -> dict:
         builder = PivotTableBuilder(0, col_dict)
         builder.add_row("eventName", SortOrderEnum.ASCENDING, show_totals=False)
@@ -222,6 +263,7 @@ class IDVAPivotDirector:
 
         return builder.render()
 
+    @memoized
     def linkedin(self, col_dict: dict) -> dict:
         builder = PivotTableBuilder(0, col_dict)
         builder.add_row("eventName", SortOrderEnum.ASCENDING, show_totals=False)
@@ -273,6 +315,7 @@ class IDVAPivotDirector:
 
         return builder.render()
 
+    @memoized
     def linked(self, col_dict: dict) -> dict:
         builder = PivotTableBuilder(0, col_dict)
         builder.add_row("eventName", SortOrderEnum.ASCENDING, show_totals=False)
@@ -321,6 +364,7 @@ class IDVAPivotDirector:
 
         return builder.render()
 
+    @memoized
     def pllpl(self, col_dict: dict) -> dict:
         builder = PivotTableBuilder(0, col_dict)
         builder.add_row("eventName", SortOrderEnum.ASCENDING, show_totals=False)
@@ -359,6 +403,7 @@ class IDVAPivotDirector:
 
         return builder.render()
 
+    @memoized
     def ffg(self, col_dict: dict) -> dict:
         builder = PivotTableBuilder(0, col_dict)
         builder.add_row("eventName", SortOrderEnum.ASCENDING, show_totals=False)
@@ -2,13 +2,32 @@
 GDrive Microservice FastAPI Web App.
 """
 
+import contextlib
+
 import fastapi
 import starlette_prometheus
 
 
-from . import api, export_api, analytics_api, settings
+from . import api, export_api, analytics_api, drive_client, sheets_client, settings
+
+
+@contextlib.asynccontextmanager
+async def lifespan(_: fastapi.FastAPI):
+    if drive_client.mirror:
+        drive_client.mirror.start()
+    sheets_client.participant_buffer.start()
+    export_api.worker_pool.start()
+    yield
+    analytics_api.backfills.stop()
+    export_api.worker_pool.stop(timeout=settings.EXPORT_POLL_INTERVAL + 5)
+    sheets_client.participant_buffer.stop(
+        timeout=settings.PARTICIPANT_BUFFER_LATENCY + 5
+    )
+    if drive_client.mirror:
+        drive_client.mirror.stop(timeout=5)
+
 
-app = fastapi.FastAPI()
+app = fastapi.FastAPI(lifespan=lifespan)
 
 app.add_middleware(starlette_prometheus.PrometheusMiddleware)
 app.add_route("/metrics/", starlette_prometheus.metrics)
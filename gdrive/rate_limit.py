@@ -0,0 +1,60 @@
+"""
+Rate limits of Google API requests shared between threads.
+
+Each limiter is a token bucket: up to `burst` requests are sent right away, after
+which requests are spaced to `rate` per second across every thread using it.
+"""
+
+import threading
+import time
+
+import prometheus_client
+
+WAIT_SECONDS = prometheus_client.Histogram(
+    "gdrive_rate_limit_wait_seconds",
+    "Time a request waited for the rate limit",
+    ["limiter"],
+    buckets=(0.01, 0.1, 0.5, 1, 2.5, 5, 10, 30, 60, float("inf")),
+)
+
+
+class RateLimiter:
+    """
+    Args:
+        rate (float): Requests per second, no limit when 0 or less
+        burst (int): Requests sent without waiting after the limiter was idle
+        name (str): Label of the limiter's metrics
+    """
+
+    def __init__(self, rate: float, burst: int = 1, name: str = "default") -> None:
+        self.rate = rate
+        self.burst = max(burst, 1)
+        self.name = name
+        self._tokens = float(self.burst)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self) -> float:
+        """
+        Wait until a request may be sent
+
+        Returns:
+            float: seconds waited
+        """
+        if self.rate <= 0:
+            return 0.0
+
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(
+                self.burst, self._tokens + (now - self._updated) * self.rate
+            )
+            self._updated = now
+            # Take the token now, later requests wait behind this one
+            self._tokens -= 1
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0.0
+
+        if wait > 0:
+            time.sleep(wait)
+        WAIT_SECONDS.labels(self.name).observe(wait)
+        return wait
@@ -38,9 +38,116 @@ QUALTRICS_APP_URL = os.getenv("QUALTRICS_APP_URL")
 QUALTRICS_APP_PORT = os.getenv("QUALTRICS_APP_PORT")
 
 RAW_COMPLETIONS_SHEET_NAME = os.getenv("GDRIVE_RAW_COMPLETIONS_SHEET_NAME", "Sheet1")
+# Dataframes are written to spreadsheets in blocks of this many rows, with this many
+# blocks written at once
+SHEETS_WRITE_CHUNK_ROWS = int(os.getenv("GDRIVE_SHEETS_WRITE_CHUNK_ROWS", "5000"))
+SHEETS_WRITE_WORKERS = int(os.getenv("GDRIVE_SHEETS_WRITE_WORKERS", "4"))
+# Sheets API transactions of analytics reports per second, after a burst of this
+# many. The Sheets API allows 60 write requests per minute per user.
+SHEETS_REQUESTS_PER_SECOND = float(os.getenv("GDRIVE_SHEETS_REQUESTS_PER_SECOND", "1"))
+SHEETS_REQUESTS_BURST = int(os.getenv("GDRIVE_SHEETS_REQUESTS_BURST", "5"))
+# Analytics reports use live Google Sheets pivot tables, or pivot tables computed
+# locally and written as values. Reports copied from a template always use live
+# pivot tables.
+ANALYTICS_LIVE_PIVOTS = os.getenv("GDRIVE_ANALYTICS_LIVE_PIVOTS", "True") == "True"
+# Reports are copied from this template spreadsheet when set, see
+# `flow_analytics.create_template`
+ANALYTICS_TEMPLATE_ID = os.getenv("GDRIVE_ANALYTICS_TEMPLATE_ID")
+# Analytics reports are downloaded in pages of this many rows, with this many pages
+# downloaded at once. The GA4 API returns at most 250000 rows per page.
+ANALYTICS_PAGE_SIZE = int(os.getenv("GDRIVE_ANALYTICS_PAGE_SIZE", "10000"))
+ANALYTICS_DOWNLOAD_WORKERS = int(os.getenv("GDRIVE_ANALYTICS_DOWNLOAD_WORKERS", "4"))
+# Google Analytics Data API requests per second, after a burst of this many
+ANALYTICS_REQUESTS_PER_SECOND = float(
+    os.getenv("GDRIVE_ANALYTICS_REQUESTS_PER_SECOND", "10")
+)
+ANALYTICS_REQUESTS_BURST = int(os.getenv("GDRIVE_ANALYTICS_REQUESTS_BURST", "10"))
+# Local cache of downloaded analytics reports, disabled when no directory is
+# configured. Reports ending within this many days of today are never cached, as
+# Google Analytics may still be processing their data.
+ANALYTICS_CACHE_DIR = os.getenv("GDRIVE_ANALYTICS_CACHE_DIR")
+ANALYTICS_CACHE_MAX_BYTES = int(
+    os.getenv("GDRIVE_ANALYTICS_CACHE_MAX_BYTES", str(256 * 1024 * 1024))
+)
+ANALYTICS_CACHE_SETTLE_DAYS = int(os.getenv("GDRIVE_ANALYTICS_CACHE_SETTLE_DAYS", "2"))
+# Transport of the Google Analytics API clients: "rest" or "grpc"
+ANALYTICS_TRANSPORT = os.getenv("GDRIVE_ANALYTICS_TRANSPORT", "rest")
+# Analytics reports get placeholder rows for the sources and mediums, as regular
+# expressions matching the start of the value, without rows of the events.
+# Comma separated.
+ANALYTICS_TRACKED_EVENTS = os.getenv(
+    "GDRIVE_ANALYTICS_TRACKED_EVENTS", "first_visit,session_start"
+).split(",")
+ANALYTICS_TRACKED_SOURCES = os.getenv(
+    "GDRIVE_ANALYTICS_TRACKED_SOURCES",
+    "m.facebook.com,fb.com,([a-zA-Z].+)craigslist.org,reddit.com,redd.it,t.co,x.com,"
+    "twitter,linked.com,lnkd.in,pllpl,ffg",
+).split(",")
+ANALYTICS_TRACKED_MEDIUMS = os.getenv(
+    "GDRIVE_ANALYTICS_TRACKED_MEDIUMS", "fb,cl,rd,tx,ln,pllpl,ffg"
+).split(",")
+# Backfills create this many daily reports at once, each day attempted up to this
+# many times with an exponential backoff starting at this many seconds
+ANALYTICS_BACKFILL_WORKERS = int(os.getenv("GDRIVE_ANALYTICS_BACKFILL_WORKERS", "4"))
+ANALYTICS_BACKFILL_MAX_ATTEMPTS = int(
+    os.getenv("GDRIVE_ANALYTICS_BACKFILL_MAX_ATTEMPTS", "3")
+)
+ANALYTICS_BACKFILL_RETRY_BACKOFF = float(
+    os.getenv("GDRIVE_ANALYTICS_BACKFILL_RETRY_BACKOFF", "30")
+)
+# Most days of a single backfill, and finished backfills kept for their progress
+ANALYTICS_BACKFILL_MAX_DAYS = int(
+    os.getenv("GDRIVE_ANALYTICS_BACKFILL_MAX_DAYS", "366")
+)
+ANALYTICS_BACKFILL_KEEP = int(os.getenv("GDRIVE_ANALYTICS_BACKFILL_KEEP", "50"))
+# Participant rows are appended together once this many are buffered, or the oldest
+# has waited this many seconds
+PARTICIPANT_BUFFER_ROWS = int(os.getenv("GDRIVE_PARTICIPANT_BUFFER_ROWS", "50"))
+PARTICIPANT_BUFFER_LATENCY = float(
+    os.getenv("GDRIVE_PARTICIPANT_BUFFER_LATENCY", "1.0")
+)
+
+# Drive file listing
+DRIVE_LIST_BATCH_SIZE = int(os.getenv("GDRIVE_DRIVE_LIST_BATCH_SIZE", "50"))
+DRIVE_LIST_WORKERS = int(os.getenv("GDRIVE_DRIVE_LIST_WORKERS", "4"))
+DRIVE_QUERY_MAX_LENGTH = int(os.getenv("GDRIVE_DRIVE_QUERY_MAX_LENGTH", "4000"))
+DRIVE_DOWNLOAD_CHUNK_SIZE = int(
+    os.getenv("GDRIVE_DRIVE_DOWNLOAD_CHUNK_SIZE", str(4 * 1024 * 1024))
+)
+# Interaction archives download this many files at once, buffering at most this
+# many download chunks per file
+ARCHIVE_PREFETCH_FILES = int(os.getenv("GDRIVE_ARCHIVE_PREFETCH_FILES", "4"))
+ARCHIVE_PREFETCH_CHUNKS = int(os.getenv("GDRIVE_ARCHIVE_PREFETCH_CHUNKS", "2"))
+
+# Local mirror of the root drive's file metadata, following the Drive changes feed
+DRIVE_MIRROR = os.getenv("GDRIVE_DRIVE_MIRROR", "False") == "True"
+DRIVE_MIRROR_POLL_INTERVAL = float(os.getenv("GDRIVE_DRIVE_MIRROR_POLL_INTERVAL", "30"))
+DRIVE_MIRROR_MAX_STALENESS = float(
+    os.getenv("GDRIVE_DRIVE_MIRROR_MAX_STALENESS", "300")
+)
+DRIVE_MIRROR_SNAPSHOT = os.getenv("GDRIVE_DRIVE_MIRROR_SNAPSHOT")
+
+# Local cache of downloaded Drive files, disabled when no directory is configured
+RESOURCE_CACHE_DIR = os.getenv("GDRIVE_RESOURCE_CACHE_DIR")
+RESOURCE_CACHE_MAX_BYTES = int(
+    os.getenv("GDRIVE_RESOURCE_CACHE_MAX_BYTES", str(1024 * 1024 * 1024))
+)
+
+# Default format of exported analytics files: json, compact, gzip or ndjson
+EXPORT_FORMAT = os.getenv("GDRIVE_EXPORT_FORMAT", "json")
 
 DB_URI = os.getenv("IDVA_DB_CONN_STR")
 SCHEMA = "idva"
+# Used in place of postgres when no connection string is configured
+SQLITE_PATH = os.getenv("GDRIVE_SQLITE_PATH", ":memory:")
+
+# Survey export work queue
+EXPORT_WORKERS = int(os.getenv("GDRIVE_EXPORT_WORKERS", "2"))
+EXPORT_POLL_INTERVAL = float(os.getenv("GDRIVE_EXPORT_POLL_INTERVAL", "1.0"))
+EXPORT_VISIBILITY_TIMEOUT = int(os.getenv("GDRIVE_EXPORT_VISIBILITY_TIMEOUT", "600"))
+EXPORT_MAX_ATTEMPTS = int(os.getenv("GDRIVE_EXPORT_MAX_ATTEMPTS", "5"))
+EXPORT_RETRY_BACKOFF = int(os.getenv("GDRIVE_EXPORT_RETRY_BACKOFF", "30"))
+EXPORT_BATCH_SIZE = int(os.getenv("GDRIVE_EXPORT_BATCH_SIZE", "500"))
 
 try:
     vcap_services = os.getenv("VCAP_SERVICES")
@@ -0,0 +1,191 @@
+import re
+from concurrent import futures
+from typing import Callable, Dict, Iterable, Iterator, List, Tuple
+
+"""
+Requests and ranges of Google Sheets API operations, shared by `sheets_client` and
+the transactions of a compiled report, see `gdrive.sheets.plan`.
+"""
+
+CELL_PATTERN = re.compile(r"^([A-Z]+)([1-9][0-9]*)$")
+
+
+def parse_cell(cell: str) -> Tuple[int, int]:
+    """
+    Zero based (row, column) of a cell in A1 notation, i.e. "C2" is (1, 2)
+    """
+    match = CELL_PATTERN.match(cell.upper())
+    if match is None:
+        raise ValueError("%s is not a single cell in A1 notation" % (cell))
+
+    col = 0
+    for letter in match.group(1):
+        col = col * 26 + ord(letter) - ord("A") + 1
+    return int(match.group(2)) - 1, col - 1
+
+
+def cell_name(row: int, col: int) -> str:
+    """
+    A1 notation of the zero based row and column, the inverse of `parse_cell`
+    """
+    letters = ""
+    col += 1
+    while col:
+        col, rem = divmod(col - 1, 26)
+        letters = chr(ord("A") + rem) + letters
+    return "%s%s" % (letters, row + 1)
+
+
+def page_range(page_name: str, range_str: str) -> str:
+    """
+    Range on a page, quoting the page name as it may contain spaces
+    """
+    return "'%s'!%s" % (page_name.replace("'", "''"), range_str)
+
+
+def row_ranges(range_str: str, count: int) -> List[str]:
+    """
+    Split a range written by `values.append`, i.e. "Sheet1!A5:L7", into the range of
+    each of its rows. The range may not cover every row when trailing rows were empty.
+    """
+    page, _, cells = range_str.rpartition("!")
+    start, _, end = cells.partition(":")
+    top, left = parse_cell(start)
+    right = parse_cell(end)[1] if end else left
+
+    ranges = []
+    for row in range(top, top + count):
+        first, last = cell_name(row, left), cell_name(row, right)
+        ranges.append(
+            "%s!%s" % (page, first if first == last else "%s:%s" % (first, last))
+        )
+    return ranges
+
+
+def rectangles(cells: Dict[Tuple[int, int], object]) -> List[Tuple[int, int, int, int]]:
+    """
+    Cover the cells with rectangles of adjacent cells, each as the inclusive
+    (top, left, bottom, right) rows and columns. Cells that were not given are never
+    covered, so writing the rectangles leaves every other cell untouched.
+    """
+    remaining = set(cells)
+    result = []
+    for top, left in sorted(cells):
+        if (top, left) not in remaining:
+            continue
+
+        right = left
+        while (top, right + 1) in remaining:
+            right += 1
+
+        bottom = top
+        while all((bottom + 1, col) in remaining for col in range(left, right + 1)):
+            bottom += 1
+
+        for row in range(top, bottom + 1):
+            for col in range(left, right + 1):
+                remaining.discard((row, col))
+        result.append((top, left, bottom, right))
+
+    return result
+
+
+def add_sheet_request(
+    title: str, row_count: int = 1000, column_count: int = 26, sheet_id: int = None
+) -> dict:
+    properties = {
+        "title": title,
+        "gridProperties": {
+            "rowCount": row_count,
+            "columnCount": column_count,
+        },
+    }
+    if sheet_id is not None:
+        properties["sheetId"] = sheet_id
+    return {"addSheet": {"properties": properties}}
+
+
+def pivot_table_request(
+    sheet_id: int, pt_def: object, row_idx: int = 0, col_idx: int = 0
+) -> dict:
+    return {
+        "updateCells": {
+            "rows": {"values": pt_def},
+            "start": {
+                "sheetId": sheet_id,
+                "rowIndex": row_idx,
+                "columnIndex": col_idx,
+            },
+            "fields": "pivotTable",
+        }
+    }
+
+
+def grid_properties_request(sheet_id: int, row_count: int, column_count: int) -> dict:
+    """
+    Resize the grid of a page, cutting off any cells outside of the new size
+    """
+    return {
+        "updateSheetProperties": {
+            "properties": {
+                "sheetId": sheet_id,
+                "gridProperties": {
+                    "rowCount": max(row_count, 1),
+                    "columnCount": max(column_count, 1),
+                },
+            },
+            "fields": "gridProperties(rowCount,columnCount)",
+        }
+    }
+
+
+def row_blocks(df, chunk_rows: int) -> Iterator[Tuple[int, List[list]]]:
+    """
+    Split a pandas DataFrame into blocks of at most `chunk_rows` rows, each with the
+    index of its first row. Blocks are converted to lists of python values as they
+    are taken, so the whole frame is never copied at once.
+    """
+    for start in range(0, len(df), chunk_rows):
+        yield start, df.iloc[start : start + chunk_rows].values.tolist()
+
+
+def block_range(page_name: str, start: int, rows: List[list]) -> str:
+    """
+    Range on the page covering a block of rows starting at the zero based row index
+    """
+    width = max((len(row) for row in rows), default=1)
+    return page_range(
+        page_name,
+        "%s:%s" % (cell_name(start, 0), cell_name(start + len(rows) - 1, width - 1)),
+    )
+
+
+def bounded_map(fn: Callable, items: Iterable, workers: int) -> list:
+    """
+    Call fn with each item from worker threads, with at most `workers` calls running
+    and items taken from the iterable only as calls finish. The first error raised
+    by a call is raised once the running calls are done.
+
+    Returns:
+        list: result of each call, in the order of the items
+    """
+    if workers <= 1:
+        return [fn(item) for item in items]
+
+    submitted = []
+    with futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        pending = set()
+        for item in items:
+            if len(pending) >= workers:
+                done, pending = futures.wait(
+                    pending, return_when=futures.FIRST_COMPLETED
+                )
+                for future in done:
+                    if future.exception() is not None:
+                        futures.wait(pending)
+                        raise future.exception()
+            future = executor.submit(fn, item)
+            pending.add(future)
+            submitted.append(future)
+
+    return [future.result() for future in submitted]
@@ -7,6 +7,7 @@ from gdrive.sheets.types import (
     ValueLayoutEnum,
     FilterTypeEnum,
     AbstractScaffold,
+    freeze,
 )
 
 
@@ -143,7 +144,10 @@ class PivotTableBuilder(AbstractBuilder):
         self.__set_pivot_value("valueLayout", value_layout.value)
 
     def render(self) -> dict:
-        return self.__pivot_scaffold
+        """
+        Read only copy of the pivot table definition, safe to share between reports
+        """
+        return freeze(self.__pivot_scaffold)
 
     def reset(self) -> None:
         self.__init__(self.source_sheet_id)
@@ -0,0 +1,235 @@
+import re
+from typing import List
+
+import pandas as pd
+
+from gdrive.sheets.types import FilterTypeEnum, SortOrderEnum
+
+"""
+Local evaluation of pivot table definitions, as rendered by the `PivotTableBuilder`.
+Pivot tables are computed with pandas from the same data the spreadsheet would be
+given, so reports can be written as plain values instead of live pivot tables.
+
+Filters follow the semantics of Google Sheets: custom formulas are evaluated per row
+with column names referring to the row's values, TEXT_CONTAINS is a case insensitive
+substring match and REGEXMATCH is a case sensitive partial match.
+"""
+
+TOKEN_PATTERN = re.compile(
+    r'\s*(?:(?P<string>"(?:[^"]|"")*")|(?P<name>[A-Za-z_][\w.]*)|(?P<punc>[(),]))'
+)
+
+
+def source(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Source data of a pivot table from a sheet's values, taking the first row as the
+    header. Columns with only numeric values are converted to numbers, as they
+    would be when entered into the spreadsheet.
+    """
+    data = df.iloc[1:].reset_index(drop=True)
+    data.columns = [str(name) for name in df.iloc[0]]
+    for name in data.columns:
+        numbers = pd.to_numeric(data[name], errors="coerce")
+        if numbers.notna().all():
+            data[name] = numbers
+    return data
+
+
+def tokenize(formula: str) -> List[tuple]:
+    tokens = []
+    pos = 0
+    formula = formula.strip()
+    while pos < len(formula):
+        match = TOKEN_PATTERN.match(formula, pos)
+        if match is None or match.end() == pos:
+            raise ValueError("Unable to parse formula at %s: %s" % (pos, formula))
+        tokens.append((match.lastgroup, match.group(match.lastgroup)))
+        pos = match.end()
+    return tokens
+
+
+class FormulaEvaluator:
+    """
+    Evaluates a custom filter formula over every row of the data at once, i.e.
+    =OR(regexmatch(firstUserSource,"facebook"),regexmatch(firstUserMedium,"fb"))
+
+    Args:
+        data (pandas.DataFrame): Source data, see `source`
+    """
+
+    FUNCTIONS = {
+        "OR": lambda *args: _reduce(args, lambda a, b: a | b),
+        "AND": lambda *args: _reduce(args, lambda a, b: a & b),
+        "NOT": lambda arg: ~arg,
+        "REGEXMATCH": lambda text, pattern: _text(text).str.contains(
+            pattern, regex=True
+        ),
+    }
+
+    def __init__(self, data: pd.DataFrame) -> None:
+        self.data = data
+
+    def mask(self, formula: str) -> pd.Series:
+        """
+        Rows for which the formula is true
+        """
+        self.tokens = tokenize(formula.lstrip("="))
+        self.pos = 0
+        result = self._expression()
+        if self.pos != len(self.tokens):
+            raise ValueError("Unexpected tokens at the end of %s" % (formula))
+        if not isinstance(result, pd.Series):
+            result = pd.Series(bool(result), index=self.data.index)
+        return result.fillna(False).astype(bool)
+
+    def _take(self, kind: str = None) -> tuple:
+        if self.pos >= len(self.tokens):
+            raise ValueError("Unexpected end of formula")
+        token_kind, value = self.tokens[self.pos]
+        if kind is not None and value != kind:
+            raise ValueError("Expected %s but found %s" % (kind, value))
+        self.pos += 1
+        return token_kind, value
+
+    def _peek(self) -> str:
+        return self.tokens[self.pos][1] if self.pos < len(self.tokens) else None
+
+    def _expression(self):
+        kind, value = self._take()
+        if kind == "string":
+            return value[1:-1].replace('""', '"')
+        if kind != "name":
+            raise ValueError("Unexpected %s" % (value))
+
+        if self._peek() != "(":
+            if value not in self.data.columns:
+                raise ValueError("Column name %s does not exist" % (value))
+            return self.data[value]
+
+        function = self.FUNCTIONS.get(value.upper())
+        if function is None:
+            raise ValueError("Unsupported function %s" % (value))
+        self._take("(")
+        args = []
+        while self._peek() != ")":
+            args.append(self._expression())
+            if self._peek() == ",":
+                self._take(",")
+        self._take(")")
+        return function(*args)
+
+
+def _text(value) -> pd.Series:
+    return value.astype(str) if isinstance(value, pd.Series) else value
+
+
+def _reduce(args, op):
+    result = args[0]
+    for arg in args[1:]:
+        result = op(result, arg)
+    return result
+
+
+def condition_mask(data: pd.DataFrame, column: str, condition: dict) -> pd.Series:
+    """
+    Rows of the data shown by a filter condition on the column
+    """
+    kind = condition["type"]
+    values = [value.get("userEnteredValue") for value in condition.get("values", [])]
+    if kind == FilterTypeEnum.CUSTOM.value:
+        return FormulaEvaluator(data).mask(values[0])
+    if kind == FilterTypeEnum.TEXT_CONTAINS.value:
+        return _text(data[column]).str.contains(values[0], case=False, regex=False)
+    if kind == FilterTypeEnum.TEXT_EQUALS.value:
+        return _text(data[column]).str.lower() == str(values[0]).lower()
+    raise ValueError("Unsupported filter condition %s" % (kind))
+
+
+class LocalPivot:
+    """
+    A pivot table definition evaluated on local data
+
+    Args:
+        data (pandas.DataFrame): Source data, see `source`
+        pt_def (dict): Pivot table definition, i.e. from `IDVAPivotDirector`
+    """
+
+    def __init__(self, data: pd.DataFrame, pt_def: dict) -> None:
+        self.data = data
+        self.pivot = pt_def["pivotTable"]
+
+    def column(self, offset: int) -> str:
+        return self.data.columns[offset]
+
+    @property
+    def row_columns(self) -> List[str]:
+        return [self.column(row["sourceColumnOffset"]) for row in self.pivot["rows"]]
+
+    @property
+    def value_names(self) -> List[str]:
+        return [
+            "%s of %s"
+            % (value["summarizeFunction"], self.column(value["sourceColumnOffset"]))
+            for value in self.pivot.get("values", [])
+        ]
+
+    def filtered(self) -> pd.DataFrame:
+        """
+        Rows of the source data shown by every filter of the pivot table
+        """
+        mask = pd.Series(True, index=self.data.index)
+        for spec in self.pivot.get("filterSpecs", []):
+            mask &= condition_mask(
+                self.data,
+                self.column(spec["columnOffsetIndex"]),
+                spec["filterCriteria"]["condition"],
+            )
+        return self.data[mask]
+
+    def values(self, data: pd.DataFrame) -> pd.DataFrame:
+        """
+        Summarized value columns, named as in the pivot table
+        """
+        values = pd.DataFrame(index=data.index)
+        for name, value in zip(self.value_names, self.pivot.get("values", [])):
+            values[name] = pd.to_numeric(
+                data[self.column(value["sourceColumnOffset"])], errors="coerce"
+            ).fillna(0)
+        return values
+
+    def table(self) -> List[list]:
+        """
+        The pivot table as rows of values: a header, a row for each combination of
+        the row groups in their sort order, and the grand total
+        """
+        data = self.filtered()
+        values = self.values(data)
+        groups = self.row_columns
+        keys = data[groups]
+        summary = (
+            pd.concat([keys, values], axis=1)
+            .groupby(groups, sort=False)
+            .sum()
+            .reset_index()
+            .sort_values(
+                groups,
+                ascending=[
+                    row.get("sortOrder") != SortOrderEnum.DESCENDING.value
+                    for row in self.pivot["rows"]
+                ],
+                kind="stable",
+            )
+        )
+
+        total = ["Grand Total"] + [""] * (len(groups) - 1) + values.sum().tolist()
+        return [groups + self.value_names] + summary.values.tolist() + [total]
+
+    def get(self, value_name: str, **criteria) -> float:
+        """
+        Value of the pivot table for the criteria, like GETPIVOTDATA, i.e.
+        get("SUM of eventCount", eventName="session_start")
+        """
+        data = self.filtered()
+        for column, item in criteria.items():
+            data = data[data[column] == item]
+        return self.values(data)[value_name].sum().item()
@@ -0,0 +1,413 @@
+import json
+import logging
+from typing import Callable, Dict, Iterator, List
+
+from gdrive.rate_limit import RateLimiter
+from gdrive.sheets import batch
+
+"""
+A report plan declares the content of a report spreadsheet: its data, pages, pivot
+tables and cell values (labels and formulas). The ReportCompiler turns a plan into
+the fewest Drive and Sheets API transactions that create the spreadsheet:
+
+    1. Drive files.create: the empty spreadsheet, in its folder
+    2. Sheets batchUpdate: the size of the data page, every new page, pivot table
+       and cell value
+    3. Sheets values.update: the data, in blocks of rows written concurrently
+
+A plan may instead be created from a template spreadsheet, which already holds the
+pages, pivot tables, cell values and the header of the data. The template is copied
+with Drive files.copy, and only the data is written below its header: appended in
+one transaction when it fits a single block, which grows the data page as needed.
+
+The reply of each request of the batchUpdate is recorded on the plan, under the
+entry of the plan the request was compiled from, see `ReportPlan.replies`.
+
+The Drive and Sheets services are passed in, so plans may be compiled against
+recording fakes, or in dry run mode which only reports what would be sent.
+"""
+
+log = logging.getLogger(__name__)
+
+DATA_PAGE = "Sheet1"
+SPREADSHEET_MIMETYPE = "application/vnd.google-apps.spreadsheet"
+
+
+class ReportPlan:
+    """
+    Args:
+        title (str): File name of the report spreadsheet
+        folder_id (str): Drive folder to create the report in
+        template_id (str): Spreadsheet copied to create the report. Pages, pivot
+            tables and cell values of the plan are then left to the template.
+
+    Once the report is created, `replies` holds the batchUpdate reply of each entry
+    of the plan, keyed by:
+
+        ("resize", "Sheet1"): the size of the data page
+        ("page", title): a new page, its reply holds the page's sheet ID
+        ("pivot", index): a pivot table, by its index in `pivots`
+        ("cells", page, (row, col)): a rectangle of cell values, by its top left cell
+    """
+
+    def __init__(
+        self, title: str, folder_id: str = None, template_id: str = None
+    ) -> None:
+        self.title = title
+        self.folder_id = folder_id
+        self.template_id = template_id
+        self.data = None
+        self.data_start = 0
+        self.pages = []
+        self.pivots = []
+        self.cells = {}
+        self.replies = {}
+
+    def set_data(self, df, start_row: int = 0) -> None:
+        """
+        pandas DataFrame written to the first page of the report, Sheet1, from the
+        zero based row. Rows above it are left as they are, i.e. the header of a
+        template.
+        """
+        self.data = df
+        self.data_start = start_row
+
+    def add_page(self, title: str, row_count: int = 1000, column_count: int = 26):
+        self.pages.append((title, row_count, column_count))
+
+    def add_pivot(
+        self, page: str, pt_def: object, row_idx: int = 0, col_idx: int = 0
+    ) -> None:
+        """
+        Add a pivot table definition, i.e. from `IDVAPivotDirector`, to a page
+        """
+        self.pivots.append((page, pt_def, row_idx, col_idx))
+
+    def write(self, page: str, cell: str, value) -> None:
+        """
+        Write a label or formula to a single cell, i.e. "A2", of a page. Values are
+        entered as a user would type them, so strings starting with "=" are formulas.
+        """
+        self.cells.setdefault(page, {})[batch.parse_cell(cell)] = value
+
+
+class Transaction:
+    """
+    A single API call of a compiled plan. The requests of a batchUpdate each have
+    the plan entry they were compiled from in `entries`, see `ReportPlan.replies`.
+    """
+
+    def __init__(
+        self,
+        api: str,
+        method: str,
+        params: dict,
+        requests: int = 1,
+        entries: list = None,
+    ):
+        self.api = api
+        self.method = method
+        self.params = params
+        self.requests = requests
+        self.entries = entries or []
+
+    @property
+    def size(self) -> int:
+        """
+        Size of the JSON payload in bytes
+        """
+        return len(json.dumps(self.params.get("body", {})))
+
+    def __str__(self) -> str:
+        return "%s %s: %s requests, %s bytes" % (
+            self.api,
+            self.method,
+            self.requests,
+            self.size,
+        )
+
+
+def cell_data(value) -> dict:
+    """
+    CellData entering the value as a user would type it
+    """
+    if isinstance(value, bool):
+        return {"userEnteredValue": {"boolValue": value}}
+    if isinstance(value, (int, float)):
+        return {"userEnteredValue": {"numberValue": value}}
+    value = str(value)
+    if value.startswith("="):
+        return {"userEnteredValue": {"formulaValue": value}}
+    return {"userEnteredValue": {"stringValue": value}}
+
+
+class ReportCompiler:
+    """
+    Args:
+        drive_service: Google Drive API service
+        sheets_service: Google Sheets API service
+        chunk_rows (int): Most rows of data written by a single request
+        workers (int): Most data blocks written at once
+        http (Callable): Returns the http client of the calling thread, as reports
+            and their data blocks are written from worker threads
+        limiter (RateLimiter): Rate limit of the Sheets transactions, shared with
+            other reports created at the same time
+    """
+
+    def __init__(
+        self,
+        drive_service,
+        sheets_service,
+        chunk_rows: int = 5000,
+        workers: int = 1,
+        http: Callable = None,
+        limiter: RateLimiter = None,
+    ) -> None:
+        self.drive_service = drive_service
+        self.sheets_service = sheets_service
+        self.chunk_rows = chunk_rows
+        self.workers = workers
+        self.http = http
+        self.limiter = limiter
+
+    def page_ids(self, plan: ReportPlan) -> Dict[str, int]:
+        """
+        Sheet ID of each page. New pages are numbered after Sheet1, which is always 0.
+        """
+        ids = {DATA_PAGE: 0}
+        for title, _, _ in plan.pages:
+            ids[title] = len(ids)
+        return ids
+
+    def compile(self, plan: ReportPlan, sheets_id: str) -> Iterator[Transaction]:
+        """
+        Sheets transactions writing the plan to the spreadsheet: the batchUpdate,
+        which must be sent first, then a write of each block of data. Blocks are
+        taken from the data as the transactions are iterated.
+        """
+        if plan.template_id is not None:
+            yield from self.compile_data(plan, sheets_id)
+            return
+
+        page_ids = self.page_ids(plan)
+        requests = []
+        entries = []
+        if plan.data is not None:
+            requests.append(
+                batch.grid_properties_request(
+                    page_ids[DATA_PAGE],
+                    plan.data_start + len(plan.data),
+                    len(plan.data.columns),
+                )
+            )
+            entries.append(("resize", DATA_PAGE))
+        for title, row_count, column_count in plan.pages:
+            requests.append(
+                batch.add_sheet_request(title, row_count, column_count, page_ids[title])
+            )
+            entries.append(("page", title))
+        for idx, (page, pt_def, row_idx, col_idx) in enumerate(plan.pivots):
+            requests.append(
+                batch.pivot_table_request(page_ids[page], pt_def, row_idx, col_idx)
+            )
+            entries.append(("pivot", idx))
+        for page, cells in plan.cells.items():
+            for top, left, bottom, right in batch.rectangles(cells):
+                entries.append(("cells", page, (top, left)))
+                requests.append(
+                    {
+                        "updateCells": {
+                            "rows": [
+                                {
+                                    "values": [
+                                        cell_data(cells[(row, col)])
+                                        for col in range(left, right + 1)
+                                    ]
+                                }
+                                for row in range(top, bottom + 1)
+                            ],
+                            "start": {
+                                "sheetId": page_ids[page],
+                                "rowIndex": top,
+                                "columnIndex": left,
+                            },
+                            "fields": "userEnteredValue",
+                        }
+                    }
+                )
+
+        if requests:
+            yield Transaction(
+                "sheets",
+                "batchUpdate",
+                {
+                    "spreadsheetId": sheets_id,
+                    "body": {"requests": requests},
+                },
+                requests=len(requests),
+                entries=entries,
+            )
+
+        yield from self.blocks(plan, sheets_id)
+
+    def compile_data(self, plan: ReportPlan, sheets_id: str) -> Iterator[Transaction]:
+        """
+        Sheets transactions writing only the data of the plan, to a copy of its
+        template
+        """
+        if plan.data is None:
+            return
+        if len(plan.data) <= self.chunk_rows:
+            # Appended after the rows the template holds
+            yield Transaction(
+                "sheets",
+                "values.append",
+                {
+                    "spreadsheetId": sheets_id,
+                    "range": batch.page_range(DATA_PAGE, "A1"),
+                    "valueInputOption": "USER_ENTERED",
+                    "body": {"values": plan.data.values.tolist()},
+                },
+            )
+            return
+
+        yield Transaction(
+            "sheets",
+            "batchUpdate",
+            {
+                "spreadsheetId": sheets_id,
+                "body": {
+                    "requests": [
+                        batch.grid_properties_request(
+                            0,
+                            plan.data_start + len(plan.data),
+                            len(plan.data.columns),
+                        )
+                    ]
+                },
+            },
+            entries=[("resize", DATA_PAGE)],
+        )
+        yield from self.blocks(plan, sheets_id)
+
+    def blocks(self, plan: ReportPlan, sheets_id: str) -> Iterator[Transaction]:
+        """
+        Writes of each block of data, taken from the data as they are iterated
+        """
+        if plan.data is None:
+            return
+        for start, rows in batch.row_blocks(plan.data, self.chunk_rows):
+            yield Transaction(
+                "sheets",
+                "values.update",
+                {
+                    "spreadsheetId": sheets_id,
+                    "range": batch.block_range(
+                        DATA_PAGE, plan.data_start + start, rows
+                    ),
+                    "valueInputOption": "USER_ENTERED",
+                    "body": {"values": rows},
+                },
+            )
+
+    def run(self, plan: ReportPlan, dry_run: bool = False) -> str | None:
+        """
+        Create the report spreadsheet of the plan
+
+        Args:
+            plan (ReportPlan): Report to create
+            dry_run (bool): Only log the transactions that would be sent
+        Returns:
+            str: Google Sheets ID of the new Sheets object, None in a dry run. The
+                reply of each entry of the plan is set in `plan.replies`.
+        """
+        create = Transaction(
+            "drive",
+            "files.create",
+            {
+                "body": {
+                    "name": plan.title,
+                    "parents": [plan.folder_id],
+                    "mimeType": SPREADSHEET_MIMETYPE,
+                },
+                "fields": "id",
+                "supportsAllDrives": True,
+            },
+        )
+        if plan.template_id is not None:
+            create = Transaction(
+                "drive",
+                "files.copy",
+                {
+                    "fileId": plan.template_id,
+                    "body": {"name": plan.title, "parents": [plan.folder_id]},
+                    "fields": "id",
+                    "supportsAllDrives": True,
+                },
+            )
+
+        if dry_run:
+            count = requests = size = 0
+            for transaction in [create, *self.compile(plan, "<dry run>")]:
+                log.info("Dry run %s", transaction)
+                count += 1
+                requests += transaction.requests
+                size += transaction.size
+            log.info(
+                "Dry run of %s: %s transactions, %s requests, %s bytes"
+                % (plan.title, count, requests, size)
+            )
+            return None
+
+        files = self.drive_service.files()
+        if create.method == "files.copy":
+            request = files.copy(**create.params)
+        else:
+            request = files.create(**create.params)
+        sheets_id = request.execute(http=self.client()).get("id")
+        try:
+            transactions = self.compile(plan, sheets_id)
+            for transaction in transactions:
+                response = self.execute(transaction)
+                if transaction.method == "batchUpdate":
+                    plan.replies = self.replies(transaction, response)
+                if transaction.method != "values.update":
+                    # The data page is now sized to fit any blocks written next
+                    break
+            batch.bounded_map(self.execute, transactions, self.workers)
+        except Exception:
+            # A retry creates the report again, do not leave a partial one behind
+            log.warning("Deleting partial report %s (%s)" % (plan.title, sheets_id))
+            try:
+                files.delete(fileId=sheets_id, supportsAllDrives=True).execute(
+                    http=self.client()
+                )
+            except Exception as e:
+                log.error("Unable to delete partial report %s: %s" % (sheets_id, e))
+            raise
+        return sheets_id
+
+    def execute(self, transaction: Transaction) -> dict:
+        spreadsheets = self.sheets_service.spreadsheets()
+        if transaction.method == "values.update":
+            request = spreadsheets.values().update(**transaction.params)
+        elif transaction.method == "values.append":
+            request = spreadsheets.values().append(**transaction.params)
+        else:
+            request = spreadsheets.batchUpdate(**transaction.params)
+        if self.limiter is not None:
+            self.limiter.acquire()
+        return request.execute(http=self.client())
+
+    def replies(self, transaction: Transaction, response: dict) -> Dict[tuple, dict]:
+        """
+        Reply of each request of a batchUpdate, keyed by its plan entry. The Sheets
+        API replies to every request in order, with an empty reply for most.
+        """
+        return dict(zip(transaction.entries, response.get("replies", [])))
+
+    def client(self):
+        """
+        Http client of the calling thread, None to use the client of the service
+        """
+        return self.http() if self.http else None
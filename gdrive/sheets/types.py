@@ -142,3 +142,35 @@ class UserEnteredValue(AbstractScaffold):
 
     def get_scaffold(self) -> dict:
         return self.__scaffold
+
+
+class FrozenDict(dict):
+    """
+    Read only dict of a rendered scaffold. Being a dict, it is encoded to JSON like
+    any other scaffold, but it may be shared between reports without being changed.
+    """
+
+    def __readonly(self, *args, **kwargs):
+        raise TypeError("Rendered scaffolds are read only")
+
+    __setitem__ = __delitem__ = __readonly
+    clear = pop = popitem = setdefault = update = __readonly
+    __ior__ = __readonly
+
+    def __hash__(self) -> int:
+        return hash(frozenset(self.items()))
+
+    def __reduce__(self):
+        return (FrozenDict, (dict(self),))
+
+
+def freeze(value):
+    """
+    Read only copy of a scaffold: dicts become FrozenDicts and lists become tuples,
+    which are still encoded as JSON arrays.
+    """
+    if isinstance(value, dict):
+        return FrozenDict((key, freeze(item)) for key, item in value.items())
+    if isinstance(value, (list, tuple)):
+        return tuple(freeze(item) for item in value)
+    return value
@@ -1,12 +1,18 @@
 import logging
+import threading
 import pandas as pd
 from typing import List
 
+import google_auth_httplib2
+import httplib2
 from google.oauth2 import service_account
 from googleapiclient.discovery import build
 from googleapiclient.errors import HttpError
 
 from gdrive import settings, error
+from gdrive.append_buffer import AppendBuffer
+from gdrive.rate_limit import RateLimiter
+from gdrive.sheets import batch as sheets_batch
 
 log = logging.getLogger(__name__)
 
@@ -16,12 +22,28 @@ creds = service_account.Credentials.from_service_account_info(
 
 sheets_service = build("sheets", "v4", credentials=creds)
 
-"""
-At present, every function call in this library represents its own API
-transaction. If a lot of operations were to be made at once, this would hinder speed
-quite a bit. 
+# Shared by every report created at the same time, see `flow_analytics.run_plan`
+limiter = RateLimiter(
+    settings.SHEETS_REQUESTS_PER_SECOND, settings.SHEETS_REQUESTS_BURST, name="sheets"
+)
+
+# httplib2 connections are not thread safe, and requests are made from worker
+# threads as well as the event loop, so every request uses the client of its thread
+_local = threading.local()
+
+
+def thread_http() -> google_auth_httplib2.AuthorizedHttp:
+    """
+    Authorized http client for the current thread
+    """
+    if not hasattr(_local, "http"):
+        _local.http = google_auth_httplib2.AuthorizedHttp(creds, http=httplib2.Http())
+    return _local.http
+
 
-Some batching in the future if the use case for this library gets heavier is necessary. 
+"""
+Unless noted otherwise, every function call in this library represents its own API
+transaction. Reports are written in a few transactions, see `gdrive.sheets.plan`.
 """
 
 
@@ -62,7 +84,7 @@ def update_cell_value(
             valueInputOption=vio,
             body=body,
         )
-        .execute()
+        .execute(http=thread_http())
     )
 
     return result
@@ -90,22 +112,11 @@ def add_pivot_tables(
     Returns:
         Google Sheets API Response: RAW response to the write operation
     """
+
+    # I would need to write a whole library to parameterize this well so
+    # Client Code will just need to pass the JSON definitions in.
     requests = [
-        {
-            "updateCells": {
-                "rows": {
-                    # I would need to write a whole library to parameterize this well so
-                    # Client Code will just need to pass the JSON definitions in.
-                    "values": pt_def
-                },
-                "start": {
-                    "sheetId": target_page_id,
-                    "rowIndex": row_idx,
-                    "columnIndex": col_idx,
-                },
-                "fields": "pivotTable",
-            }
-        }
+        sheets_batch.pivot_table_request(target_page_id, pt_def, row_idx, col_idx)
     ]
 
     body = {"requests": requests}
@@ -113,30 +124,30 @@ def add_pivot_tables(
     response = (
         sheets_service.spreadsheets()
         .batchUpdate(spreadsheetId=sheets_id, body=body)
-        .execute()
+        .execute(http=thread_http())
     )
 
     return response
 
 
 def add_new_pages(
-    page_names: List[str], sheets_id: str, row_count: int = 1000, column_count: int = 26
+    page_names: List[str],
+    sheets_id: str,
+    row_count: int = 1000,
+    column_count: int = 26,
 ):
+    """
+    Add pages to the spreadsheet
+
+    Returns:
+        dict: title of each new page to its sheet ID
+    """
+
     new_sheets_reqs = []
     for label in page_names:
-        req = {
-            "addSheet": {
-                "properties": {
-                    "title": label,
-                    "gridProperties": {
-                        "rowCount": row_count,
-                        "columnCount": column_count,
-                    },
-                }
-            }
-        }
-
-        new_sheets_reqs.append(req)
+        new_sheets_reqs.append(
+            sheets_batch.add_sheet_request(label, row_count, column_count)
+        )
 
     body = {"requests": new_sheets_reqs}
 
@@ -146,7 +157,7 @@ def add_new_pages(
             spreadsheetId=sheets_id,
             body=body,
         )
-        .execute()
+        .execute(http=thread_http())
     )
 
     sheet_title_to_id = {}
@@ -159,7 +170,8 @@ def add_new_pages(
 
 def export_df_to_gdrive_speadsheet(df: pd.DataFrame, sheets_id: str, title="Sheet1"):
     """
-    Exports an entire pandas dataframe to a Google Sheets Object.
+    Exports an entire pandas dataframe to a Google Sheets Object. Large frames are
+    written in blocks by a compiled report instead, see `gdrive.sheets.plan`.
 
     Args:
         df (pandas.DataFrame): Tabular data to be exported to a spreadsheet
@@ -179,7 +191,7 @@ def export_df_to_gdrive_speadsheet(df: pd.DataFrame, sheets_id: str, title="Shee
             valueInputOption="USER_ENTERED",
             body=body,
         )
-        .execute()
+        .execute(http=thread_http())
     )
     if "error" in result:
         raise error.ExportError(result["error"]["message"])
@@ -202,13 +214,16 @@ def upload_participant(
     skin_tone,
 ):
     """
-    Append participant data to the rekrewt raw completions spreadsheet
+    Append participant data to the rekrewt raw completions spreadsheet. Rows of
+    concurrent calls are appended together, see `participant_buffer`.
+
+    Returns:
+        dict: spreadsheetId and updatedRange of the participant's row
     """
-    values = [
-        [
+    return participant_buffer.append(
+        participant_row(
             first,
             last,
-            first + " " + last,
             email,
             responseId,
             time,
@@ -216,11 +231,51 @@ def upload_participant(
             ethnicity,
             race,
             gender,
+            age,
             income,
             skin_tone,
-        ]
+        )
+    ).result()
+
+
+def participant_row(
+    first,
+    last,
+    email,
+    responseId,
+    time,
+    date,
+    ethnicity,
+    race,
+    gender,
+    age,
+    income,
+    skin_tone,
+) -> list:
+    """
+    Row of the rekrewt raw completions spreadsheet for a participant
+    """
+    return [
+        first,
+        last,
+        first + " " + last,
+        email,
+        responseId,
+        time,
+        date,
+        ethnicity,
+        race,
+        gender,
+        income,
+        skin_tone,
     ]
 
+
+def upload_participants(values: List[list]):
+    """
+    Append rows of participant data to the rekrewt raw completions spreadsheet in
+    a single transaction. See `participant_row`.
+    """
     body = {"values": values}
 
     try:
@@ -233,7 +288,7 @@ def upload_participant(
                 valueInputOption="RAW",
                 body=body,
             )
-            .execute()
+            .execute(http=thread_http())
         )
 
         if "error" in result:
@@ -242,3 +297,27 @@ def upload_participant(
         return result
     except HttpError as e:
         raise error.ExportError(e)
+
+
+def append_participant_rows(values: List[list]) -> List[dict]:
+    """
+    Append rows of participant data, returning the outcome of each row
+    """
+    result = upload_participants(values)
+    updates = result.get("updates", {})
+    ranges = [None] * len(values)
+    if "updatedRange" in updates:
+        ranges = sheets_batch.row_ranges(updates["updatedRange"], len(values))
+
+    return [
+        {"spreadsheetId": result.get("spreadsheetId"), "updatedRange": updated}
+        for updated in ranges
+    ]
+
+
+participant_buffer = AppendBuffer(
+    append_participant_rows,
+    settings.PARTICIPANT_BUFFER_ROWS,
+    settings.PARTICIPANT_BUFFER_LATENCY,
+    name="participants",
+)
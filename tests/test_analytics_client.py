@@ -0,0 +1,267 @@
+import importlib
+import json
+import sys
+import threading
+import time
+from datetime import datetime, timedelta
+from unittest.mock import MagicMock
+
+import pytest
+from google.analytics.data_v1beta.types import (
+    BatchRunReportsResponse,
+    DimensionHeader,
+    DimensionValue,
+    MetricHeader,
+    MetricType,
+    MetricValue,
+    Row,
+    RunReportResponse,
+)
+
+import gdrive
+from gdrive import disk_cache
+from gdrive.rate_limit import RateLimiter
+
+# Other tests replace the module with a mock. Import the real one, then put back
+# whatever was imported before, as modules collected later expect their mock.
+previous = sys.modules.pop("gdrive.analytics_client", None)
+analytics_client = importlib.import_module("gdrive.analytics_client")
+if previous is None:
+    del sys.modules["gdrive.analytics_client"]
+    delattr(gdrive, "analytics_client")
+else:
+    sys.modules["gdrive.analytics_client"] = previous
+    gdrive.analytics_client = previous
+
+
+@pytest.fixture(autouse=True)
+def no_rate_limit(monkeypatch) -> None:
+    monkeypatch.setattr(analytics_client, "limiter", RateLimiter(0))
+
+
+FLOAT_METRICS = ["eventCountPerUser"]
+
+
+def metric_type(name: str) -> MetricType:
+    return MetricType.TYPE_FLOAT if name in FLOAT_METRICS else MetricType.TYPE_INTEGER
+
+
+def metric_value(name: str, idx: int) -> str:
+    return str(idx / 2) if name in FLOAT_METRICS else str(idx)
+
+
+class FakeDataClient:
+    """
+    Stand in for `BetaAnalyticsDataClient`, serving the pages of a report of
+    `rows` rows and recording the offset of every request and the size of every
+    batch.
+    """
+
+    def __init__(self, rows: int, delay: float = 0) -> None:
+        self.rows = rows
+        self.delay = delay
+        self.offsets = []
+        self.batches = []
+        self.running = 0
+        self.max_running = 0
+        self.lock = threading.Lock()
+
+    def run_report(self, request) -> RunReportResponse:
+        with self.lock:
+            self.offsets.append(request.offset)
+            self.running += 1
+            self.max_running = max(self.max_running, self.running)
+        time.sleep(self.delay)
+
+        end = min(request.offset + request.limit, self.rows)
+        response = RunReportResponse(
+            dimension_headers=[
+                DimensionHeader(name=name) for name in analytics_client.DIMENSIONS
+            ],
+            metric_headers=[
+                MetricHeader(name=name, type_=metric_type(name))
+                for name in analytics_client.METRICS
+            ],
+            rows=[
+                Row(
+                    dimension_values=[
+                        DimensionValue(value=f"{name}-{idx}")
+                        for name in analytics_client.DIMENSIONS
+                    ],
+                    metric_values=[
+                        MetricValue(value=metric_value(name, idx))
+                        for name in analytics_client.METRICS
+                    ],
+                )
+                for idx in range(request.offset, end)
+            ],
+            row_count=self.rows,
+        )
+        with self.lock:
+            self.running -= 1
+        return response
+
+    def batch_run_reports(self, request) -> BatchRunReportsResponse:
+        assert len(request.requests) <= analytics_client.BATCH_REPORTS
+        self.batches.append(len(request.requests))
+        return BatchRunReportsResponse(
+            reports=[self.run_report(report) for report in request.requests]
+        )
+
+
+def test_download_fetches_every_page() -> None:
+    """the rows of every page are merged into the first, in order"""
+
+    client = FakeDataClient(2500)
+    response = analytics_client.download(
+        "123", datetime(2024, 1, 1), client=client, page_size=1000, workers=4
+    )
+
+    assert sorted(client.offsets) == [0, 1000, 2000]
+    assert len(response.rows) == 2500
+    assert [row.metric_values[0].value for row in response.rows] == [
+        str(idx) for idx in range(2500)
+    ]
+
+    df = analytics_client.create_df_from_analytics_response(response)
+    assert len(df) == 2501
+    assert df.iloc[0].tolist() == analytics_client.DIMENSIONS + analytics_client.METRICS
+
+
+def test_download_single_page() -> None:
+    """a report that fits in one page is a single request"""
+
+    client = FakeDataClient(250)
+    response = analytics_client.download(
+        "123", datetime(2024, 1, 1), client=client, page_size=1000
+    )
+
+    assert client.offsets == [0]
+    assert len(response.rows) == 250
+
+
+def test_download_is_bounded() -> None:
+    """no more than `workers` pages are requested at once"""
+
+    client = FakeDataClient(10000, delay=0.01)
+    response = analytics_client.download(
+        "123", datetime(2024, 1, 1), client=client, page_size=500, workers=3
+    )
+
+    assert len(client.offsets) == 20
+    assert len(response.rows) == 10000
+    assert 1 < client.max_running <= 3
+
+
+def test_batch_download() -> None:
+    """reports are requested five at a time and each is completed in pages"""
+
+    client = FakeDataClient(1200)
+    days = [datetime(2024, 1, day) for day in range(1, 8)]
+    requests = analytics_client.date_range_requests(
+        "123", [(day, day) for day in days], limit=500
+    )
+    reports = analytics_client.batch_download("123", requests, client=client)
+
+    assert client.batches == [5, 2]
+    assert len(client.offsets) == 7 * 3
+    assert [len(report.rows) for report in reports] == [1200] * 7
+    assert requests[0].date_ranges[0].start_date == "2024-01-01"
+    assert requests[-1].date_ranges[0].end_date == "2024-01-07"
+
+
+def test_data_client_is_shared(monkeypatch) -> None:
+    """one client is created per transport and reused by every download"""
+
+    constructor = MagicMock(side_effect=lambda **kwargs: object())
+    monkeypatch.setattr(analytics_client, "BetaAnalyticsDataClient", constructor)
+    monkeypatch.setattr(analytics_client, "_clients", {})
+    monkeypatch.setattr(analytics_client, "credentials", lambda: None)
+
+    client = analytics_client.data_client()
+    assert analytics_client.data_client() is client
+    assert analytics_client.data_client("grpc") is not client
+    assert constructor.call_count == 2
+    assert constructor.call_args.kwargs["transport"] == "grpc"
+
+
+def test_analytics_frame() -> None:
+    """columns are named after the report's headers, metrics are numeric"""
+
+    client = FakeDataClient(3)
+    df = analytics_client.analytics_frame(
+        analytics_client.download("123", datetime(2024, 1, 1), client=client)
+    )
+
+    assert df.columns.tolist() == analytics_client.DIMENSIONS + analytics_client.METRICS
+    assert df["eventName"].tolist() == ["eventName-0", "eventName-1", "eventName-2"]
+    assert df["eventCount"].dtype == "int64"
+    assert df["eventCountPerUser"].dtype == "float64"
+    assert df["eventCountPerUser"].tolist() == [0.0, 0.5, 1.0]
+
+    sheet = analytics_client.sheet_frame(df)
+    assert sheet.columns.tolist() == list(range(len(df.columns)))
+    assert sheet.iloc[0].tolist() == df.columns.tolist()
+    assert sheet.iloc[2].tolist()[-5:] == [1, 1, 1, 0.5, 1]
+    # Rows are sent to the Sheets API as JSON
+    assert json.loads(json.dumps(sheet.values.tolist()))[3][-5:] == [2, 2, 2, 1.0, 2]
+
+
+@pytest.fixture
+def report_cache(tmp_path, monkeypatch) -> disk_cache.DiskCache:
+    cache = disk_cache.DiskCache(str(tmp_path), 1024 * 1024, "test")
+    monkeypatch.setattr(analytics_client, "report_cache", cache)
+    return cache
+
+
+def test_complete_reports_are_cached(report_cache) -> None:
+    """a report of past days is downloaded once, then read from the cache"""
+
+    client = FakeDataClient(1200)
+    day = datetime(2024, 1, 1)
+    first = analytics_client.download_frame("123", day, client=client)
+    second = analytics_client.download_frame("123", day, client=client)
+
+    assert len(client.offsets) == 1
+    assert second.equals(first)
+    assert second["eventCount"].dtype == "int64"
+
+    # Other properties, date ranges and dimensions are cached separately
+    analytics_client.download_frame("456", day, client=client)
+    analytics_client.download_frame("123", day, datetime(2024, 1, 2), client=client)
+    analytics_client.download_frame("123", day, client=client, dimensions=["date"])
+    assert len(client.offsets) == 4
+
+
+def test_incomplete_reports_are_not_cached(report_cache) -> None:
+    """reports ending within the settle days of today are always downloaded"""
+
+    client = FakeDataClient(10)
+    today = datetime.now()
+    for _ in range(2):
+        analytics_client.download_frame(
+            "123", today - timedelta(days=7), today, client=client
+        )
+    assert len(client.offsets) == 2
+
+    assert analytics_client.is_complete(datetime(2024, 1, 1), datetime(2024, 1, 3))
+    assert not analytics_client.is_complete(datetime(2024, 1, 2), datetime(2024, 1, 3))
+
+
+def test_download_frames_batches_uncached_days(report_cache) -> None:
+    """days missing from the cache are downloaded in batches, then cached"""
+
+    client = FakeDataClient(10)
+    days = [datetime(2024, 1, day) for day in range(1, 8)]
+    cached = analytics_client.download_frame("123", days[2], client=client)
+    client.batches.clear()
+
+    frames = analytics_client.download_frames("123", days, client=client)
+    assert client.batches == [5, 1]
+    assert len(frames) == 7
+    assert frames[2].equals(cached)
+    assert frames[0]["eventCount"].dtype == "int64"
+
+    again = analytics_client.download_frames("123", days, client=client)
+    assert client.batches == [5, 1]
+    assert all(frame.equals(first) for frame, first in zip(again, frames))
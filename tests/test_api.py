@@ -2,14 +2,16 @@ import base64
 import io
 import sys
 import zipfile
-from unittest.mock import MagicMock
+from unittest.mock import MagicMock, patch
 
+import httplib2
 from fastapi import testclient
+from googleapiclient.errors import HttpError
 
 # pylint: disable=wrong-import-position
 sys.modules["gdrive.drive_client"] = MagicMock()
 sys.modules["gdrive.sheets_client"] = MagicMock()
-sys.modules["gdrive.analytics_client"] = MagicMock()
+sys.modules["gdrive.analytics_client"] = MagicMock(BATCH_REPORTS=5)
 from gdrive import main
 
 client = testclient.TestClient(main.app)
@@ -98,7 +100,236 @@ def test_delete() -> None:
 
     b64_data = base64.b64encode(data)
 
-    response = client.delete("/upload", params={"filename": "world"})
+    drive = main.api.drive_client
+    with patch.object(drive, "get_files", return_value=iter([{"id": "world-id"}])):
+        response = client.delete("/upload", params={"filename": "world"})
     assert response.status_code == 200
+    drive.delete_file.assert_called_with("world-id")
     content = response.json()
     print(content)
+
+
+def test_survey_export_status() -> None:
+    """test survey export is queued and reports its status"""
+
+    response = client.get("/survey-export/status-response")
+    assert response.status_code == 404
+
+    response = client.post(
+        "/survey-export",
+        json={"surveyId": "survey", "responseId": "status-response"},
+    )
+    assert response.status_code == 202
+
+    response = client.get("/survey-export/status-response")
+    assert response.status_code == 200
+    assert response.json()["state"] == "queued"
+
+
+def test_export_skips_unchanged_interaction() -> None:
+    """test re-exporting an unchanged interaction only uploads once"""
+
+    export_api = main.export_api
+    with patch.object(
+        export_api.export_client, "export", return_value=[{"event": 1}]
+    ), patch.object(export_api.settings, "CODE_NAMES", {}), patch.object(
+        export_api.drive_client, "upload_to_folder", return_value="file-id"
+    ) as uploads, patch.object(
+        export_api.drive_client, "update_file", return_value="file-id"
+    ) as updates:
+        assert client.post("/export", params={"interactionId": "ledger"}).is_success
+        assert client.post("/export", params={"interactionId": "ledger"}).is_success
+        assert uploads.call_count == 1
+
+        response = client.post(
+            "/export", params={"interactionId": "ledger", "force": True}
+        )
+        assert response.is_success
+        assert uploads.call_count == 1
+        assert updates.call_args.args[0] == "file-id"
+
+
+def test_export_replaces_changed_interaction() -> None:
+    """test changed content updates the exported file rather than adding one"""
+
+    export_api = main.export_api
+    not_found = HttpError(httplib2.Response({"status": 404}), b"File not found")
+    with patch.object(export_api.settings, "CODE_NAMES", {}), patch.object(
+        export_api.drive_client, "upload_to_folder", return_value="first-file"
+    ) as uploads, patch.object(
+        export_api.drive_client, "update_file", return_value="first-file"
+    ) as updates:
+        for event in range(2):
+            with patch.object(
+                export_api.export_client, "export", return_value=[{"event": event}]
+            ):
+                client.post("/export", params={"interactionId": "changed"})
+        assert uploads.call_count == 1
+        assert updates.call_count == 1
+        assert updates.call_args.args[:2] == ("first-file", "analytics.json")
+
+        # The file was deleted in Drive directly
+        updates.side_effect = not_found
+        with patch.object(
+            export_api.export_client, "export", return_value=[{"event": 2}]
+        ):
+            client.post("/export", params={"interactionId": "changed"})
+        assert uploads.call_count == 2
+
+
+def test_deleted_exports_are_forgotten() -> None:
+    """test the ledger entries of a deleted Drive file are removed"""
+
+    crud = main.export_api.crud
+    crud.record_export("deleted-export", "hash", "deleted-file")
+    crud.record_export("kept-export", "hash", "kept-file")
+    crud.delete_export_ledger("deleted-file")
+
+    assert crud.get_export_ledger("deleted-export") is None
+    assert crud.get_export_ledger("kept-export").drive_file_id == "kept-file"
+
+
+def test_bulk_survey_export_status() -> None:
+    """test bulk survey export queues every response under one batch"""
+
+    response = client.post(
+        "/survey-export/bulk",
+        json=[
+            {"surveyId": "survey", "responseId": "bulk-1"},
+            {"surveyId": "survey", "responseId": "bulk-2"},
+        ],
+    )
+    assert response.status_code == 202
+    batch_id = response.json()["batchId"]
+
+    response = client.get(f"/survey-export/bulk/{batch_id}")
+    assert response.status_code == 200
+    items = response.json()["items"]
+    assert [item["responseId"] for item in items] == ["bulk-1", "bulk-2"]
+    assert all(item["state"] == "queued" for item in items)
+
+    response = client.get("/survey-export/bulk/unknown")
+    assert response.status_code == 404
+
+
+def test_export_resource_range() -> None:
+    """test resources are streamed, with byte range support"""
+
+    content = b"0123456789"
+    drive = main.export_api.drive_client
+    with patch.object(
+        drive,
+        "get_metadata",
+        return_value={"mimeType": "image/png", "size": str(len(content))},
+    ), patch.object(
+        drive,
+        "stream_cached",
+        side_effect=lambda id, metadata, start=0, end=None: iter(
+            [content[start : end + 1]]
+        ),
+    ):
+        response = client.post("/export/resource", json={"resourceId": "file"})
+        assert response.status_code == 202
+        assert response.content == content
+        assert response.headers["content-type"] == "image/png"
+
+        response = client.post(
+            "/export/resource",
+            json={"resourceId": "file"},
+            headers={"Range": "bytes=2-5"},
+        )
+        assert response.status_code == 206
+        assert response.content == b"2345"
+        assert response.headers["content-range"] == "bytes 2-5/10"
+
+        response = client.post(
+            "/export/resource",
+            json={"resourceId": "file"},
+            headers={"Range": "bytes=-3"},
+        )
+        assert response.content == b"789"
+
+        response = client.post(
+            "/export/resource",
+            json={"resourceId": "file"},
+            headers={"Range": "bytes=20-"},
+        )
+        assert response.status_code == 416
+
+
+def test_interaction_files_use_recorded_folder() -> None:
+    """test recorded interaction folders are not searched for in Drive"""
+
+    crud = main.export_api.crud
+    root = main.export_api.settings.ROOT_DIRECTORY
+    crud.record_drive_folder("recorded-interaction", root, "folder-id")
+    drive = main.export_api.drive_client
+    with patch.object(drive, "get_files_by_drive_id") as search, patch.object(
+        drive, "get_files_in_folders", return_value=[{"id": "file-id"}]
+    ) as listing:
+        response = client.post(
+            "/export/interaction-files",
+            json={"interactionId": "recorded-interaction", "fields": "id"},
+        )
+
+    assert response.status_code == 202
+    assert response.json()["data"] == [{"id": "file-id"}]
+    search.assert_not_called()
+    assert listing.call_args.args[0] == ["folder-id"]
+
+
+def test_deleted_interaction_folder_is_forgotten() -> None:
+    """test a recorded folder deleted in Drive is looked up again"""
+
+    crud = main.export_api.crud
+    root = main.export_api.settings.ROOT_DIRECTORY
+    crud.record_drive_folder("deleted-interaction", root, "deleted-folder")
+    not_found = HttpError(httplib2.Response({"status": 404}), b"File not found")
+    drive = main.export_api.drive_client
+    with patch.object(
+        drive, "forget_folder", side_effect=crud.delete_drive_folder
+    ), patch.object(
+        drive, "get_files_by_drive_id", return_value=[{"id": "found-folder"}]
+    ), patch.object(
+        drive, "get_files_in_folders", side_effect=[not_found, [{"id": "file-id"}]]
+    ) as listing:
+        response = client.post(
+            "/export/interaction-files",
+            json={"interactionId": "deleted-interaction", "fields": "id"},
+        )
+
+    assert response.json()["data"] == [{"id": "file-id"}]
+    assert listing.call_args.args[0] == ["found-folder"]
+    assert crud.get_drive_folder("deleted-interaction", root) is None
+
+
+def test_interaction_archive() -> None:
+    """test interaction files are streamed as a zip archive"""
+
+    crud = main.export_api.crud
+    root = main.export_api.settings.ROOT_DIRECTORY
+    crud.record_drive_folder("archived-interaction", root, "archive-folder")
+    files = [
+        {"id": "1", "name": "id.png", "mimeType": "image/png", "size": "5"},
+        {"id": "2", "name": "id.png", "mimeType": "image/png", "size": "5"},
+        {
+            "id": "3",
+            "name": "notes",
+            "mimeType": "application/vnd.google-apps.document",
+        },
+    ]
+    drive = main.export_api.drive_client
+    with patch.object(drive, "get_files_in_folders", return_value=files), patch.object(
+        drive,
+        "stream_cached",
+        side_effect=lambda id, metadata: iter([f"file{id}".encode()]),
+    ):
+        response = client.post(
+            "/export/interaction-archive",
+            json={"interactionId": "archived-interaction"},
+        )
+
+    assert response.headers["content-type"] == "application/zip"
+    with zipfile.ZipFile(io.BytesIO(response.content)) as archive:
+        assert archive.namelist() == ["id.png", "id (1).png"]
+        assert archive.read("id (1).png") == b"file2"
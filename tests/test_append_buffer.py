@@ -0,0 +1,92 @@
+import threading
+
+import pytest
+
+from gdrive.append_buffer import AppendBuffer
+from gdrive.sheets import batch
+
+
+class Sheet:
+    """
+    Appends rows to a list, recording the rows of each write
+    """
+
+    def __init__(self, fail: bool = False) -> None:
+        self.rows = []
+        self.writes = []
+        self.fail = fail
+        self.lock = threading.Lock()
+
+    def write(self, rows):
+        with self.lock:
+            if self.fail:
+                raise RuntimeError("quota exceeded")
+            self.writes.append(rows)
+            start = len(self.rows)
+            self.rows += rows
+            return list(range(start, len(self.rows)))
+
+
+def test_full_buffer_is_written_at_once() -> None:
+    """concurrent rows are appended in batches of max_rows"""
+
+    sheet = Sheet()
+    buffer = AppendBuffer(sheet.write, max_rows=5, max_latency=60, name="test")
+    buffer.start()
+
+    futures = [buffer.append([idx]) for idx in range(10)]
+    outcomes = [future.result(timeout=5) for future in futures]
+    buffer.stop(timeout=5)
+
+    assert len(sheet.writes) == 2
+    assert [sheet.rows[outcome] for outcome in outcomes] == [[idx] for idx in range(10)]
+
+
+def test_rows_are_written_after_max_latency() -> None:
+    """a partial buffer is written once its oldest row has waited max_latency"""
+
+    sheet = Sheet()
+    buffer = AppendBuffer(sheet.write, max_rows=50, max_latency=0.05, name="test")
+    buffer.start()
+
+    assert buffer.append(["a"]).result(timeout=5) == 0
+    assert sheet.writes == [[["a"]]]
+    buffer.stop(timeout=5)
+
+
+def test_stop_writes_buffered_rows() -> None:
+    """rows buffered when the buffer stops are still written"""
+
+    sheet = Sheet()
+    buffer = AppendBuffer(sheet.write, max_rows=50, max_latency=60, name="test")
+    buffer.start()
+    futures = [buffer.append([idx]) for idx in range(3)]
+    buffer.stop(timeout=5)
+
+    assert [future.result(timeout=0) for future in futures] == [0, 1, 2]
+    assert sheet.writes == [[[0], [1], [2]]]
+    assert len(buffer) == 0
+
+
+def test_failed_write_fails_each_row() -> None:
+    """every caller of a failed append gets the error"""
+
+    buffer = AppendBuffer(Sheet(fail=True).write, 2, 60, name="test")
+    buffer.start()
+    futures = [buffer.append([idx]) for idx in range(2)]
+    buffer.stop(timeout=5)
+
+    for future in futures:
+        with pytest.raises(RuntimeError):
+            future.result(timeout=0)
+
+
+def test_row_ranges() -> None:
+    """the range of an append is split into the range of each row"""
+
+    assert batch.row_ranges("Sheet1!A5:L7", 3) == [
+        "Sheet1!A5:L5",
+        "Sheet1!A6:L6",
+        "Sheet1!A7:L7",
+    ]
+    assert batch.row_ranges("'Raw Data'!B2", 1) == ["'Raw Data'!B2"]
@@ -0,0 +1,73 @@
+import io
+import threading
+import zipfile
+
+import pytest
+
+from gdrive import archive
+
+
+def test_stream_zip() -> None:
+    """entries are written in order, however their downloads complete"""
+
+    contents = {f"file-{idx}": [b"x" * idx, b"y" * idx] for idx in range(10)}
+    entries = [(f"{name}.txt", zipfile.ZIP_DEFLATED, name) for name in sorted(contents)]
+
+    data = b"".join(
+        archive.stream_zip(
+            entries, lambda name: iter(contents[name]), window=3, buffer_chunks=1
+        )
+    )
+
+    with zipfile.ZipFile(io.BytesIO(data)) as result:
+        assert result.testzip() is None
+        assert result.namelist() == [name for name, _, _ in entries]
+        assert result.read("file-3.txt") == b"xxxyyy"
+
+
+def test_stream_zip_bounds_prefetch() -> None:
+    """no more than the prefetch window is downloaded ahead of the archive"""
+
+    fetched = []
+    lock = threading.Lock()
+
+    def fetch(idx):
+        for chunk in range(100):
+            with lock:
+                fetched.append(idx)
+            yield bytes(10)
+
+    entries = [(f"{idx}.bin", zipfile.ZIP_STORED, idx) for idx in range(5)]
+    stream = archive.stream_zip(entries, fetch, window=2, buffer_chunks=2)
+    next(stream)
+
+    # the first file is being written, so only it and the next file were started
+    assert set(fetched) <= {0, 1}
+    stream.close()
+
+
+def test_stream_zip_fails_on_download_error() -> None:
+    """a failed download ends the archive without a central directory"""
+
+    def fetch(name):
+        if name == "bad":
+            raise ValueError("download failed")
+        yield b"content"
+
+    entries = [("good", zipfile.ZIP_STORED, "good"), ("bad", zipfile.ZIP_STORED, "bad")]
+    stream = archive.stream_zip(entries, fetch, window=2, buffer_chunks=1)
+
+    with pytest.raises(ValueError):
+        b"".join(stream)
+
+
+def test_unique_names() -> None:
+    """repeated file names are numbered"""
+
+    assert archive.unique_names(["a.png", "a.png", "b", "b", "c/d"]) == [
+        "a.png",
+        "a (1).png",
+        "b",
+        "b (1)",
+        "c_d",
+    ]
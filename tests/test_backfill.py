@@ -0,0 +1,152 @@
+import threading
+import time
+from datetime import datetime
+
+import pytest
+
+from gdrive.idva.backfill import BackfillRunner, DayState
+
+
+class Reports:
+    """
+    Creates daily reports, failing the given days a number of times each
+    """
+
+    def __init__(self, failures: dict = None, delay: float = 0) -> None:
+        self.failures = dict(failures or {})
+        self.delay = delay
+        self.days = []
+        self.data = {}
+        self.running = 0
+        self.max_running = 0
+        self.lock = threading.Lock()
+
+    def report(self, day: datetime, dry_run: bool, data: object = None) -> str:
+        with self.lock:
+            self.days.append(day)
+            self.data[day.day] = data
+            self.running += 1
+            self.max_running = max(self.max_running, self.running)
+        time.sleep(self.delay)
+        with self.lock:
+            self.running -= 1
+            if self.failures.get(day.day, 0) > 0:
+                self.failures[day.day] -= 1
+                raise RuntimeError("quota exceeded")
+        return "sheets-%s" % (day.day)
+
+
+def wait(backfill, timeout: float = 5) -> None:
+    deadline = time.monotonic() + timeout
+    while not backfill.done:
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+
+def test_days_are_reported_concurrently() -> None:
+    """each day of the range is reported once, by at most `workers` threads"""
+
+    reports = Reports(delay=0.02)
+    runner = BackfillRunner(reports.report, workers=3)
+    backfill = runner.start(datetime(2024, 1, 1), datetime(2024, 1, 10))
+    wait(backfill)
+    runner.stop()
+
+    assert sorted(day.day for day in reports.days) == list(range(1, 11))
+    assert 1 < reports.max_running <= 3
+
+    status = runner.status(backfill.id)
+    assert status["total"] == 10
+    assert status["succeeded"] == 10
+    assert status["days"][0]["date"] == "2024-01-01"
+    assert status["days"][0]["sheetsId"] == "sheets-1"
+
+
+def test_failed_days_are_retried() -> None:
+    """days are attempted up to max_attempts, and failed days can be retried"""
+
+    reports = Reports(failures={2: 1, 3: 5})
+    runner = BackfillRunner(reports.report, workers=2, max_attempts=2, retry_backoff=0)
+    backfill = runner.start(datetime(2024, 1, 1), datetime(2024, 1, 3))
+    wait(backfill)
+
+    states = {day.date.day: day for day in backfill.days}
+    assert states[1].state == DayState.SUCCEEDED and states[1].attempts == 1
+    assert states[2].state == DayState.SUCCEEDED and states[2].attempts == 2
+    assert states[3].state == DayState.FAILED and states[3].attempts == 2
+    assert states[3].error == "quota exceeded"
+
+    reports.failures = {}
+    assert runner.retry(backfill.id) is backfill
+    wait(backfill)
+    runner.stop()
+
+    assert states[3].state == DayState.SUCCEEDED
+    assert states[3].attempts == 3
+    assert states[3].error is None
+    assert [day.day for day in reports.days].count(1) == 1
+    assert runner.retry("missing") is None
+
+
+def test_retries_wait_without_holding_a_worker() -> None:
+    """the backoff of a failed day lets the other days run on its worker"""
+
+    reports = Reports(failures={1: 1})
+    runner = BackfillRunner(reports.report, workers=1, retry_backoff=0.2)
+    backfill = runner.start(datetime(2024, 1, 1), datetime(2024, 1, 3))
+    wait(backfill)
+    runner.stop()
+
+    assert [day.day for day in reports.days] == [1, 2, 3, 1]
+    assert runner.status(backfill.id)["succeeded"] == 3
+
+
+def test_days_are_downloaded_in_groups() -> None:
+    """the data of the days is downloaded in groups of `batch` days"""
+
+    reports = Reports(failures={7: 1})
+    groups = []
+
+    def download(days: list) -> list:
+        groups.append([day.day for day in days])
+        if days[0].day == 11:
+            raise RuntimeError("quota exceeded")
+        return ["data-%s" % (day.day) for day in days]
+
+    runner = BackfillRunner(
+        reports.report, workers=2, retry_backoff=0, download=download, batch=5
+    )
+    backfill = runner.start(datetime(2024, 1, 1), datetime(2024, 1, 12))
+    wait(backfill)
+    runner.stop()
+
+    assert sorted(groups) == [[1, 2, 3, 4, 5], [6, 7, 8, 9, 10], [11, 12]]
+    assert runner.status(backfill.id)["succeeded"] == 12
+    # Retries keep the data of their day, days of failed downloads get none
+    assert reports.data[7] == "data-7" and len(reports.days) == 13
+    assert reports.data[11] is None and reports.data[12] is None
+
+
+def test_invalid_ranges_are_rejected() -> None:
+    runner = BackfillRunner(Reports().report, workers=1, max_days=5)
+
+    with pytest.raises(ValueError):
+        runner.start(datetime(2024, 1, 2), datetime(2024, 1, 1))
+    with pytest.raises(ValueError):
+        runner.start(datetime(2024, 1, 1), datetime(2024, 1, 6))
+    assert runner.backfills == {}
+
+
+def test_finished_backfills_are_pruned() -> None:
+    """only the most recent finished backfills are kept"""
+
+    runner = BackfillRunner(Reports().report, workers=2, keep=2)
+    started = []
+    for day in range(1, 6):
+        backfill = runner.start(datetime(2024, 1, day), datetime(2024, 1, day))
+        wait(backfill)
+        started.append(backfill.id)
+    runner.stop()
+
+    assert list(runner.backfills) == started[-2:]
+    assert runner.get(started[0]) is None
@@ -0,0 +1,54 @@
+import os
+
+import pytest
+
+from gdrive import disk_cache
+
+
+@pytest.fixture
+def cache(tmp_path) -> disk_cache.DiskCache:
+    return disk_cache.DiskCache(str(tmp_path), max_bytes=10, name="test")
+
+
+def test_entries_are_keyed_by_version(cache) -> None:
+    """only the cached version of a key is served, older versions are replaced"""
+
+    assert cache.open("file", "v1") is None
+
+    cache.put("file", "v1", [b"abc", b"def"])
+    assert b"".join(disk_cache.read(cache.open("file", "v1"))) == b"abcdef"
+    assert cache.open("file", "v2") is None
+
+    cache.put("file", "v2", [b"ghi"])
+    assert cache.open("file", "v1") is None
+    assert b"".join(disk_cache.read(cache.open("file", "v2"), 1, 1)) == b"h"
+
+
+def test_least_recently_used_entries_are_evicted(cache) -> None:
+    """the cache is kept within its size cap"""
+
+    cache.put("old", "v", [b"1234"])
+    cache.put("used", "v", [b"1234"])
+    os.utime(cache.path("old", "v"), (0, 0))
+    os.utime(cache.path("used", "v"), (1, 1))
+    cache.open("used", "v").close()
+
+    cache.put("new", "v", [b"1234"])
+
+    assert cache.open("old", "v") is None
+    assert cache.open("used", "v") is not None
+    assert cache.open("new", "v") is not None
+
+
+def test_incomplete_tee_is_discarded(cache, tmp_path) -> None:
+    """entries are only added once all content was written"""
+
+    chunks = cache.tee("file", "v", iter([b"ab", b"cd"]))
+    assert next(chunks) == b"ab"
+    chunks.close()
+
+    assert cache.open("file", "v") is None
+    assert os.listdir(tmp_path) == []
+
+    assert b"".join(cache.tee("file", "v", iter([b"ab", b"cd"]))) == b"abcd"
+    assert cache.open("file", "v") is not None
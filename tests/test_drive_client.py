@@ -0,0 +1,315 @@
+import importlib
+import io
+import re
+import sys
+import threading
+from unittest.mock import patch
+
+import httplib2
+import pytest
+from googleapiclient.errors import HttpError
+
+import gdrive
+
+# Other tests replace the module with a mock. Import the real one without
+# credentials, then put back whatever was imported before, as modules collected
+# later import `gdrive.drive_client` and expect their mock.
+previous = sys.modules.pop("gdrive.drive_client", None)
+with patch(
+    "google.oauth2.service_account.Credentials.from_service_account_info"
+), patch("googleapiclient.discovery.build"):
+    drive_client = importlib.import_module("gdrive.drive_client")
+if previous is None:
+    del sys.modules["gdrive.drive_client"]
+    delattr(gdrive, "drive_client")
+else:
+    sys.modules["gdrive.drive_client"] = previous
+    gdrive.drive_client = previous
+
+FOLDER = "application/vnd.google-apps.folder"
+
+
+class FakeRequest:
+    def __init__(self, result, clients: list = None):
+        self.result = result
+        self.clients = clients if clients is not None else []
+
+    def execute(self, http=None):
+        self.clients.append(http)
+        if isinstance(self.result, Exception):
+            raise self.result
+        return self.result
+
+
+class FakeDrive:
+    """
+    Drive service listing the files of folders, or the files with a name, in pages
+    of `page_size` files. Every files.list and files.create call is recorded, as is
+    the http client each request was executed with. Creating files in a `deleted`
+    folder fails as it would in Drive.
+    """
+
+    def __init__(self, folders: dict = None, named: list = None, page_size=2):
+        self.folders = folders or {}
+        self.named = named or []
+        self.page_size = page_size
+        self.calls = []
+        self.created = []
+        self.clients = []
+        self.deleted = set()
+
+    def files(self):
+        return self
+
+    def matches(self, query: str) -> list:
+        parents = [
+            re.sub(r"\\(.)", r"\1", parent)
+            for parent in re.findall(r"'((?:[^'\\]|\\.)*)' in parents", query)
+        ]
+        if query.startswith("name = "):
+            return self.named
+        return [file for parent in parents for file in self.folders.get(parent, [])]
+
+    def list(self, **kwargs):
+        self.calls.append(kwargs)
+        files = self.matches(kwargs["q"])
+        start = int(kwargs.get("pageToken") or 0)
+        end = start + self.page_size
+        result = {"files": files[start:end]}
+        if end < len(files):
+            result["nextPageToken"] = str(end)
+        return FakeRequest(result, self.clients)
+
+    def delete(self, **kwargs):
+        self.deleted.add(kwargs["fileId"])
+        return FakeRequest({}, self.clients)
+
+    def create(self, **kwargs):
+        self.created.append(kwargs)
+        if set(kwargs["body"]["parents"]) & self.deleted:
+            return FakeRequest(
+                HttpError(httplib2.Response({"status": 404}), b"File not found"),
+                self.clients,
+            )
+        return FakeRequest({"id": "new-folder"}, self.clients)
+
+
+class FakeMirror:
+    """
+    Mirror of the root drive, always ready, finding the given files
+    """
+
+    def __init__(self, found: list, drive_id: str = "root") -> None:
+        self.found = found
+        self.drive_id = drive_id
+        self.added = []
+
+    def find(self, name: str, parent_id: str = None) -> list:
+        return self.found
+
+    def add(self, file: dict) -> None:
+        self.added.append(file)
+
+
+@pytest.fixture
+def drive(monkeypatch) -> FakeDrive:
+    fake = FakeDrive()
+    monkeypatch.setattr(drive_client, "service", fake)
+    monkeypatch.setattr(drive_client, "mirror", None)
+    monkeypatch.setattr(drive_client, "thread_http", lambda: None)
+    monkeypatch.setattr(drive_client.crud, "get_drive_folder", lambda *args: None)
+    monkeypatch.setattr(drive_client.crud, "record_drive_folder", lambda *args: None)
+    return fake
+
+
+def test_create_folder_checks_drive_on_mirror_miss(drive, monkeypatch) -> None:
+    """a folder the mirror does not know yet is looked up before it is created"""
+
+    mirror = FakeMirror([])
+    monkeypatch.setattr(drive_client, "mirror", mirror)
+    drive.named = [{"id": "existing", "name": "interaction"}]
+
+    assert drive_client.create_folder("interaction", "root") == "existing"
+    assert len(drive.calls) == 1
+    assert drive.created == []
+
+    drive.named = []
+    assert drive_client.create_folder("interaction", "root") == "new-folder"
+    assert mirror.added[0]["id"] == "new-folder"
+
+
+def test_create_folder_trusts_mirror_hits(drive, monkeypatch) -> None:
+    monkeypatch.setattr(
+        drive_client, "mirror", FakeMirror([{"id": "mirrored", "name": "a"}])
+    )
+
+    assert drive_client.create_folder("a", "root") == "mirrored"
+    assert drive.calls == []
+
+
+def test_get_files_searches_every_drive(drive, monkeypatch) -> None:
+    """only files of the mirrored drive are served by the mirror"""
+
+    monkeypatch.setattr(
+        drive_client, "mirror", FakeMirror([{"id": "mirrored", "name": "a.json"}])
+    )
+    drive.named = [{"id": "shared", "name": "a.json"}]
+
+    assert [file["id"] for file in drive_client.get_files("a.json", "id")] == ["shared"]
+    assert drive.calls[-1]["includeItemsFromAllDrives"] is True
+    assert "driveId" not in drive.calls[-1]
+
+    files = drive_client.get_files_by_drive_id("a.json", "root", "id")
+    assert [file["id"] for file in files] == ["mirrored"]
+    files = drive_client.get_files_by_drive_id("a.json", "other", "id")
+    assert [file["id"] for file in files] == ["shared"]
+    assert drive.calls[-1]["driveId"] == "other"
+
+
+def folders(count: int, files: int) -> dict:
+    return {
+        f"folder-{idx}": [{"id": f"file-{idx}-{file}"} for file in range(files)]
+        for idx in range(count)
+    }
+
+
+def test_parents_queries_split_at_batch_size() -> None:
+    queries = drive_client.parents_queries(["a", "b", "c"], 2)
+
+    assert queries == [
+        "('a' in parents or 'b' in parents) and trashed=false",
+        "('c' in parents) and trashed=false",
+    ]
+
+
+def test_parents_queries_split_at_max_length(monkeypatch) -> None:
+    """a query is closed before its parents exceed the query length limit"""
+
+    monkeypatch.setattr(drive_client.settings, "DRIVE_QUERY_MAX_LENGTH", 60)
+    ids = [f"folder-{idx}" for idx in range(5)]
+    queries = drive_client.parents_queries(ids, 50)
+
+    assert len(queries) == 3
+    assert all(query.count(" in parents") <= 2 for query in queries)
+    assert [id for id in ids if any(f"'{id}'" in query for query in queries)] == ids
+
+
+def test_folder_ids_are_escaped(drive) -> None:
+    drive.folders = {"it's\\": [{"id": "quoted"}]}
+
+    assert drive_client.parents_queries(["it's\\"], 50) == [
+        "('it\\'s\\\\' in parents) and trashed=false"
+    ]
+    assert drive_client.get_files_in_folders(["it's\\"], "id") == [{"id": "quoted"}]
+
+
+def test_list_files_follows_pages(drive) -> None:
+    drive.folders = folders(1, 5)
+
+    files = drive_client.list_files("('folder-0' in parents) and trashed=false")
+
+    assert [file["id"] for file in files] == [f"file-0-{idx}" for idx in range(5)]
+    assert [call["pageToken"] for call in drive.calls] == [None, "2", "4"]
+
+
+def test_get_files_in_folders_merges_pages(drive) -> None:
+    """the pages of every concurrent listing are merged, in the order of the folders"""
+
+    drive.folders = folders(5, 3)
+
+    files = drive_client.get_files_in_folders(list(drive.folders), "id", batch_size=2)
+
+    assert [file["id"] for file in files] == [
+        file["id"] for listed in drive.folders.values() for file in listed
+    ]
+    assert len({call["q"] for call in drive.calls}) == 3
+    assert len(drive.calls) == 3 + 3 + 2
+
+
+def test_name_query_escapes_values() -> None:
+    assert drive_client.query_value("it's") == "'it\\'s'"
+    assert drive_client.query_value("a\\'b") == "'a\\\\\\'b'"
+    assert drive_client.name_query("it's\\") == "name = 'it\\'s\\\\'"
+    assert (
+        drive_client.name_query("a'b", "folder'1")
+        == "name = 'a\\'b' and 'folder\\'1' in parents"
+    )
+
+
+def test_iter_files_pages_on_demand(drive) -> None:
+    """pages are requested as they are consumed, and no more once iteration stops"""
+
+    drive.folders = folders(1, 7)
+    query = "('folder-0' in parents) and trashed=false"
+
+    files = drive_client.iter_files(query, "id", driveId="root")
+    assert drive.calls == []
+    assert next(files) == {"id": "file-0-0"}
+    assert len(drive.calls) == 1
+    files.close()
+    assert len(drive.calls) == 1
+
+    files = [file["id"] for file in drive_client.iter_files(query, "id")]
+    assert files == [f"file-0-{idx}" for idx in range(7)]
+    assert [call["pageToken"] for call in drive.calls[1:]] == [None, "2", "4", "6"]
+    assert drive.calls[0]["driveId"] == "root"
+
+
+def test_requests_use_the_client_of_their_thread(drive, monkeypatch) -> None:
+    """the shared http client is not thread safe, worker threads use their own"""
+
+    monkeypatch.setattr(drive_client, "thread_http", threading.get_ident)
+    drive.folders = folders(1, 3)
+
+    def upload() -> None:
+        parent = drive_client.create_folder("interaction", "root")
+        drive_client.upload_basic("analytics.json", parent, io.BytesIO(b"{}"))
+        drive_client.list_files("('folder-0' in parents) and trashed=false")
+
+    worker = threading.Thread(target=upload)
+    worker.start()
+    worker.join()
+
+    assert len(drive.clients) == 5
+    assert set(drive.clients) == {worker.ident}
+
+
+def test_deleted_folder_is_created_again(drive, monkeypatch) -> None:
+    """a recorded folder deleted in Drive directly is forgotten on upload"""
+
+    folders = {("interaction", "root"): "deleted-folder"}
+    monkeypatch.setattr(
+        drive_client.crud, "get_drive_folder", lambda *key: folders.get(key)
+    )
+    monkeypatch.setattr(
+        drive_client.crud,
+        "record_drive_folder",
+        lambda name, parent, id: folders.setdefault((name, parent), id),
+    )
+    monkeypatch.setattr(
+        drive_client.crud,
+        "delete_drive_folder",
+        lambda id: [folders.pop(key) for key in [*folders] if folders[key] == id],
+    )
+    drive.deleted = {"deleted-folder"}
+    content = io.BytesIO(b"{}")
+
+    assert drive_client.upload_to_folder("interaction", "root", "a.json", content)
+    assert folders == {("interaction", "root"): "new-folder"}
+    assert [call["body"]["parents"] for call in drive.created] == [
+        ["deleted-folder"],
+        ["root"],
+        ["new-folder"],
+    ]
+    assert drive.created[-1]["media_body"].getbytes(0, 2) == b"{}"
+
+
+def test_delete_file_forgets_folder_and_exports(drive, monkeypatch) -> None:
+    forgotten = []
+    monkeypatch.setattr(drive_client.crud, "delete_drive_folder", forgotten.append)
+    monkeypatch.setattr(drive_client.crud, "delete_export_ledger", forgotten.append)
+
+    drive_client.delete_file("file-id")
+
+    assert drive.deleted == {"file-id"}
+    assert forgotten == ["file-id", "file-id"]
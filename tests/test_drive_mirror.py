@@ -0,0 +1,155 @@
+import pytest
+
+from gdrive import drive_mirror
+
+FOLDER = "application/vnd.google-apps.folder"
+
+
+class FakeRequest:
+    def __init__(self, result):
+        self.result = result
+
+    def execute(self, http=None):
+        return self.result
+
+
+class FakeDrive:
+    """
+    Drive service serving a fixed file listing and a feed of changes. Each poll of
+    the feed returns the changes made since the last one.
+    """
+
+    def __init__(self, files: list):
+        self.files_list = files
+        self.feed = []
+        self.calls = []
+
+    def files(self):
+        return self
+
+    def changes(self):
+        return self
+
+    def list(self, **kwargs):
+        self.calls.append(kwargs)
+        if "pageToken" in kwargs and "q" not in kwargs:
+            changes = self.feed[int(kwargs["pageToken"]) :]
+            return FakeRequest(
+                {"changes": changes, "newStartPageToken": str(len(self.feed))}
+            )
+        return FakeRequest({"files": self.files_list})
+
+    def getStartPageToken(self, **kwargs):
+        return FakeRequest({"startPageToken": str(len(self.feed))})
+
+
+@pytest.fixture
+def drive() -> FakeDrive:
+    return FakeDrive(
+        [
+            {
+                "id": "folder",
+                "name": "interaction",
+                "mimeType": FOLDER,
+                "parents": ["root"],
+            },
+            {
+                "id": "a",
+                "name": "a.json",
+                "mimeType": "text/plain",
+                "parents": ["folder"],
+            },
+        ]
+    )
+
+
+def make_mirror(drive, **kwargs) -> drive_mirror.DriveMirror:
+    return drive_mirror.DriveMirror(
+        drive, "root", poll_interval=0.01, max_staleness=60, **kwargs
+    )
+
+
+def test_lookups_wait_for_crawl(drive) -> None:
+    """the mirror only answers once the drive has been crawled"""
+
+    mirror = make_mirror(drive)
+    assert mirror.find("interaction") is None
+
+    mirror.sync()
+
+    assert [file["id"] for file in mirror.find("interaction", "root")] == ["folder"]
+    assert mirror.find("interaction", "other") == []
+    assert [file["id"] for file in mirror.children(["folder"])] == ["a"]
+
+
+def test_changes_are_applied(drive) -> None:
+    """created, moved and removed files are followed through the changes feed"""
+
+    mirror = make_mirror(drive)
+    mirror.sync()
+
+    drive.feed += [
+        {"fileId": "b", "file": {"id": "b", "name": "b.json", "parents": ["folder"]}},
+        {"fileId": "a", "file": {"id": "a", "name": "a.json", "parents": ["root"]}},
+    ]
+    mirror.sync()
+    assert [file["id"] for file in mirror.children(["folder"])] == ["b"]
+    assert [file["id"] for file in mirror.children(["root"])] == ["a", "folder"]
+
+    drive.feed += [
+        {"fileId": "a", "removed": True},
+        {"fileId": "b", "file": {"id": "b", "name": "b.json", "trashed": True}},
+    ]
+    mirror.sync()
+    assert mirror.children(["folder", "root"]) == [mirror.get("folder")]
+    assert mirror.find("b.json") == []
+
+
+def test_drive_changes_are_skipped(drive) -> None:
+    """changes of the shared drive itself have no file and do not stall the feed"""
+
+    mirror = make_mirror(drive)
+    mirror.sync()
+
+    drive.feed += [
+        {"changeType": "drive", "removed": False},
+        {
+            "changeType": "file",
+            "fileId": "b",
+            "file": {"id": "b", "name": "b.json", "parents": ["folder"]},
+        },
+    ]
+    mirror.sync()
+    assert mirror.page_token == str(len(drive.feed))
+    assert [file["id"] for file in mirror.children(["folder"])] == ["a", "b"]
+    assert "changeType" in drive.calls[-1]["fields"]
+
+
+def test_snapshot_resumes_from_page_token(drive, tmp_path) -> None:
+    """a restarted mirror loads its snapshot and only polls for new changes"""
+
+    snapshot = str(tmp_path / "mirror.json")
+    mirror = make_mirror(drive, snapshot_path=snapshot)
+    mirror.sync()
+    drive.feed.append(
+        {"fileId": "b", "file": {"id": "b", "name": "b.json", "parents": ["folder"]}}
+    )
+
+    drive.calls.clear()
+    restarted = make_mirror(drive, snapshot_path=snapshot)
+    restarted.load()
+    restarted.sync()
+
+    assert all("q" not in call for call in drive.calls)
+    assert [file["id"] for file in restarted.children(["folder"])] == ["a", "b"]
+
+
+def test_select_fields() -> None:
+    """only requests for mirrored fields are answered from the mirror"""
+
+    assert drive_mirror.covers("id, name,parents")
+    assert not drive_mirror.covers("*")
+    assert not drive_mirror.covers("id, owners")
+    assert drive_mirror.select([{"id": "a", "name": "a", "size": "1"}], "id,name") == [
+        {"id": "a", "name": "a"}
+    ]
@@ -0,0 +1,116 @@
+import gzip
+import json
+from unittest.mock import patch
+
+import pytest
+
+from gdrive import export_client
+from gdrive.export_client import ExportFormatEnum
+
+EVENTS = [
+    {"interactionId": "abc", "capabilityName": "logOutcome", "vendor": "Acme"},
+    {"interactionId": "abc", "capabilityName": "logOutcome", "vendor": "acme inc"},
+]
+
+
+@pytest.fixture(autouse=True)
+def code_names():
+    with patch.object(export_client.settings, "CODE_NAMES", {"acme": "vendor-a"}):
+        yield
+
+
+def read(format: ExportFormatEnum) -> bytes:
+    spool = export_client.serialize(EVENTS, format)
+    spool.seek(0)
+    return spool.read()
+
+
+def test_serialize_json_matches_pretty_printed_export() -> None:
+    """default format is unchanged"""
+
+    expected = export_client.codename(json.dumps(EVENTS, indent=2))
+    assert read(ExportFormatEnum.JSON).decode() == expected
+
+
+@pytest.mark.parametrize("format", [ExportFormatEnum.COMPACT, ExportFormatEnum.GZIP])
+def test_serialize_compact_formats(format) -> None:
+    """compact and gzip formats decode to the code named events"""
+
+    data = read(format)
+    if format == ExportFormatEnum.GZIP:
+        data = gzip.decompress(data)
+
+    events = json.loads(data)
+    assert [event["vendor"] for event in events] == ["vendor-a", "vendor-a inc"]
+    assert b" " not in data.replace(b"vendor-a inc", b"")
+
+
+def test_serialize_ndjson() -> None:
+    """ndjson writes one event per line"""
+
+    lines = read(ExportFormatEnum.NDJSON).decode().splitlines()
+    assert [json.loads(line)["vendor"] for line in lines] == [
+        "vendor-a",
+        "vendor-a inc",
+    ]
+
+
+def test_content_hash_depends_on_format() -> None:
+    """changing the format invalidates the export ledger"""
+
+    assert export_client.content_hash(
+        EVENTS, ExportFormatEnum.JSON
+    ) != export_client.content_hash(EVENTS, ExportFormatEnum.GZIP)
+
+
+class FakeSearch:
+    """
+    OpenSearch client finding the survey data events of the given interactions
+    """
+
+    def __init__(self, found: dict, **kwargs) -> None:
+        self.found = found
+        self.updates = []
+
+    def search(self, body: str, index: str) -> dict:
+        return {
+            "hits": {
+                "hits": [
+                    {
+                        "_source": {
+                            "interactionId": interaction_id,
+                            "capabilityName": "logOutcome",
+                            "properties": {
+                                "outcomeDescription": {"value": response_id}
+                            },
+                        }
+                    }
+                    for interaction_id, response_id in self.found.items()
+                ]
+            }
+        }
+
+    def update_by_query(self, index: str, body: dict, refresh: bool) -> None:
+        self.updates.append(body)
+
+
+def test_export_responses_only_updates_requested_interactions() -> None:
+    """documents of other interactions matched by the query are left unchanged"""
+
+    es = FakeSearch({"interaction-1": "response-1", "interaction-2": "response-2"})
+    with patch.object(export_client, "OpenSearch", return_value=es):
+        interaction_ids = export_client.export_responses(
+            {"response-1": {"q1": "a"}, "response-2": {"q1": "b"}}
+        )
+
+    assert interaction_ids == {
+        "response-1": ["interaction-1"],
+        "response-2": ["interaction-2"],
+    }
+    script = es.updates[0]["script"]
+    assert script["params"]["responses"] == {
+        "interaction-1": json.dumps({"q1": "a"}),
+        "interaction-2": json.dumps({"q1": "b"}),
+    }
+    assert "params.responses.containsKey(ctx._source.interactionId)" in script["source"]
+    assert "ctx.op = 'noop'" in script["source"]
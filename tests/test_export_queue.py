@@ -0,0 +1,135 @@
+import datetime
+from unittest.mock import MagicMock
+
+import pytest
+
+from gdrive import export_queue
+from gdrive.database import crud, database, models
+
+
+@pytest.fixture(autouse=True)
+def empty_queue():
+    with database.SessionLocal() as session:
+        session.query(models.ExportJobModel).delete()
+        session.commit()
+
+
+def make_pool(handler, max_attempts=3) -> export_queue.WorkerPool:
+    return export_queue.WorkerPool(
+        handler,
+        concurrency=1,
+        poll_interval=0.01,
+        visibility_timeout=60,
+        max_attempts=max_attempts,
+        backoff=0,
+    )
+
+
+def test_enqueue_deduplicates_by_response_id() -> None:
+    """queued jobs are not queued twice"""
+
+    first = crud.enqueue_export_job("queue-dedupe", "survey", "{}")
+    second = crud.enqueue_export_job("queue-dedupe", "survey", "{}")
+
+    assert first.id == second.id
+    assert second.state == models.ExportJobState.QUEUED
+
+
+def test_claim_hides_job_until_visibility_timeout() -> None:
+    """a claimed job is invisible to other workers"""
+
+    crud.enqueue_export_job("queue-claim", "survey", "{}")
+
+    job = crud.claim_export_job(visibility_timeout=60)
+
+    assert job.response_id == "queue-claim"
+    assert job.state == models.ExportJobState.RUNNING
+    assert job.attempts == 1
+    assert job.available_at > datetime.datetime.utcnow()
+    assert crud.claim_export_job(visibility_timeout=60) is None
+
+
+def test_failed_job_is_retried_then_succeeds() -> None:
+    """failures are retried with backoff and the final result recorded"""
+
+    handler = MagicMock(side_effect=[Exception("transient"), None])
+    pool = make_pool(handler)
+    crud.enqueue_export_job("queue-retry", "survey", "{}")
+
+    pool.process(crud.claim_export_job(visibility_timeout=60))
+    job = crud.get_export_job("queue-retry")
+    assert job.state == models.ExportJobState.QUEUED
+    assert job.last_error == "transient"
+
+    pool.process(crud.claim_export_job(visibility_timeout=60))
+    job = crud.get_export_job("queue-retry")
+    assert job.state == models.ExportJobState.SUCCEEDED
+    assert job.attempts == 2
+    assert job.payload is None
+    assert job.as_status()["runSeconds"] is not None
+
+
+def test_job_fails_after_max_attempts() -> None:
+    """jobs stop being retried after max attempts"""
+
+    pool = make_pool(MagicMock(side_effect=Exception("permanent")), max_attempts=1)
+    crud.enqueue_export_job("queue-fail", "survey", "{}")
+
+    pool.process(crud.claim_export_job(visibility_timeout=60))
+
+    job = crud.get_export_job("queue-fail")
+    assert job.state == models.ExportJobState.FAILED
+    assert crud.claim_export_job(visibility_timeout=60) is None
+
+
+def test_abandoned_job_fails_after_max_attempts() -> None:
+    """a job whose workers keep disappearing is failed instead of claimed again"""
+
+    crud.enqueue_export_job("queue-abandoned", "survey", "{}")
+
+    for attempt in range(1, 3):
+        job = crud.claim_export_job(visibility_timeout=0, max_attempts=2)
+        assert job.attempts == attempt
+    assert crud.claim_export_job(visibility_timeout=0, max_attempts=2) is None
+
+    job = crud.get_export_job("queue-abandoned")
+    assert job.state == models.ExportJobState.FAILED
+    assert job.attempts == 2
+    assert job.last_error == "Abandoned during attempt 2"
+    assert job.payload is None
+
+
+def test_succeeded_job_requires_force() -> None:
+    """exported responses are only queued again when forced"""
+
+    crud.enqueue_export_job("queue-force", "survey", "{}")
+    make_pool(MagicMock()).process(crud.claim_export_job(visibility_timeout=60))
+
+    job = crud.enqueue_export_job("queue-force", "survey", "{}")
+    assert job.state == models.ExportJobState.SUCCEEDED
+
+    job = crud.enqueue_export_job("queue-force", "survey", "{}", force=True)
+    assert job.state == models.ExportJobState.QUEUED
+
+
+def test_batch_jobs_are_processed_together() -> None:
+    """jobs of a bulk request are claimed and recorded together"""
+
+    items = [(f"queue-batch-{idx}", "survey", "{}", False) for idx in range(3)]
+    crud.enqueue_export_jobs(items, batch_id="batch")
+    batch_handler = MagicMock(return_value={"queue-batch-1": Exception("failed")})
+    pool = make_pool(MagicMock())
+    pool.batch_handler = batch_handler
+    pool.batch_size = 10
+
+    job = crud.claim_export_job(visibility_timeout=60)
+    jobs = [job] + crud.claim_export_jobs(60, batch_id=job.batch_id, limit=9)
+    pool.process_batch(jobs)
+
+    assert len(batch_handler.call_args.args[0]) == 3
+    states = {job.response_id: job.state for job in crud.get_export_batch("batch")}
+    assert states == {
+        "queue-batch-0": models.ExportJobState.SUCCEEDED,
+        "queue-batch-1": models.ExportJobState.QUEUED,
+        "queue-batch-2": models.ExportJobState.SUCCEEDED,
+    }
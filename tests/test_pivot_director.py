@@ -0,0 +1,97 @@
+import json
+import threading
+from concurrent import futures
+
+import pytest
+
+from gdrive.idva.pivot_director import IDVAPivotDirector
+
+COLUMNS = [
+    "eventName",
+    "firstUserCampaignName",
+    "firstUserMedium",
+    "firstUserSource",
+    "eventCount",
+]
+PIVOTS = [
+    "clicks",
+    "facebook",
+    "craigslist",
+    "reddit",
+    "twitter_x",
+    "linkedin",
+    "linked",
+    "pllpl",
+    "ffg",
+]
+
+
+@pytest.mark.parametrize("pivot", PIVOTS)
+def test_definitions_are_cached(pivot) -> None:
+    """a definition is built once per column mapping"""
+
+    director = IDVAPivotDirector()
+    col_dict = {name: idx for idx, name in enumerate(COLUMNS)}
+    build = getattr(director, pivot)
+
+    spec = build(col_dict)
+    assert build(dict(reversed(list(col_dict.items())))) is spec
+    assert json.dumps(spec) == json.dumps(
+        getattr(IDVAPivotDirector, pivot).__wrapped__(director, col_dict)
+    )
+
+    moved = {name: idx + 1 for idx, name in enumerate(COLUMNS)}
+    assert build(moved) is not spec
+    assert build(moved) != spec
+
+
+def test_definitions_are_read_only() -> None:
+    """shared definitions can not be changed by a report"""
+
+    spec = IDVAPivotDirector().facebook({name: idx for idx, name in enumerate(COLUMNS)})
+
+    with pytest.raises(TypeError):
+        spec["pivotTable"]["rows"] = []
+    with pytest.raises(TypeError):
+        spec["pivotTable"]["filterSpecs"][0].update(columnOffsetIndex=0)
+    with pytest.raises(AttributeError):
+        spec["pivotTable"]["values"].append({})
+
+
+def test_cache_is_bounded() -> None:
+    """the oldest definitions are dropped once the cache is full"""
+
+    director = IDVAPivotDirector(cache_size=2)
+    mappings = [
+        {name: idx + offset for idx, name in enumerate(COLUMNS)} for offset in range(3)
+    ]
+    first = director.clicks(mappings[0])
+    for col_dict in mappings[1:]:
+        director.clicks(col_dict)
+
+    assert len(director._specs) == 2
+    assert director.clicks(mappings[0]) is not first
+
+
+def test_cache_is_shared_between_threads() -> None:
+    """concurrent reports get the same definition, and the cache stays bounded"""
+
+    director = IDVAPivotDirector()
+    col_dict = {name: idx for idx, name in enumerate(COLUMNS)}
+    barrier = threading.Barrier(8)
+
+    def build(_) -> dict:
+        barrier.wait()
+        return director.facebook(col_dict)
+
+    with futures.ThreadPoolExecutor(max_workers=8) as executor:
+        specs = list(executor.map(build, range(8)))
+    assert all(spec is specs[0] for spec in specs)
+
+    director = IDVAPivotDirector(cache_size=2)
+    mappings = [
+        {name: idx + offset for idx, name in enumerate(COLUMNS)} for offset in range(8)
+    ]
+    with futures.ThreadPoolExecutor(max_workers=8) as executor:
+        list(executor.map(director.clicks, mappings * 4))
+    assert len(director._specs) == 2
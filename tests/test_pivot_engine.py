@@ -0,0 +1,150 @@
+import re
+import sys
+from unittest.mock import MagicMock
+
+import pandas as pd
+import pytest
+
+sys.modules.setdefault("gdrive.drive_client", MagicMock())
+sys.modules.setdefault("gdrive.sheets_client", MagicMock())
+sys.modules.setdefault("gdrive.analytics_client", MagicMock())
+
+from gdrive import settings
+from gdrive.idva import flow_analytics
+from gdrive.idva.pivot_director import IDVAPivotDirector
+from gdrive.sheets import pivot_engine
+from gdrive.sheets.plan import ReportPlan
+
+HEADER = [
+    "eventName",
+    "firstUserCampaignName",
+    "firstUserMedium",
+    "firstUserSource",
+    "isConversionEvent",
+    "linkUrl",
+    "eventCount",
+    "sessions",
+    "totalUsers",
+    "eventCountPerUser",
+    "conversions",
+]
+
+# (eventName, firstUserMedium, firstUserSource, eventCount)
+EVENTS = [
+    ("session_start", "social", "m.facebook.com", "10"),
+    ("first_visit", "fb", "(direct)", "4"),
+    ("session_start", "social", "FACEBOOK", "100"),  # regexmatch is case sensitive
+    ("session_start", "social", "fbxcom", "7"),  # "." matches any character
+    ("page_view", "social", "m.facebook.com", "1000"),
+    ("session_start_extra", "social", "facebook", "3"),  # partial match
+    ("session_start", "cl", "sfbay.craigslist.org", "5"),
+    ("first_visit", "referral", "reddit.com", "6"),
+    ("session_start", "rd", "redd.it", "2"),
+    ("session_start", "referral", "t.co", "8"),
+    ("first_visit", "tx", "x.com", "9"),
+    ("session_start", "ln", "lnkd.in", "11"),
+    ("first_visit", "referral", "linked.com", "12"),
+    ("session_start", "PLLPL_email", "newsletter", "13"),  # TEXT_CONTAINS ignores case
+    ("first_visit", "ffg", "(direct)", "14"),
+]
+
+# The filters of each pivot table, as written in its formulas
+SOURCES = {
+    "facebook": [
+        "firstUserSource:facebook",
+        "firstUserSource:fb.com",
+        "firstUserMedium:fb",
+    ],
+    "craigslist": ["firstUserSource:craigslist", "firstUserMedium:cl"],
+    "reddit": [
+        "firstUserSource:reddit",
+        "firstUserSource:redd.it",
+        "firstUserMedium:rd",
+    ],
+    "twitter_x": [
+        "firstUserSource:twitter",
+        "firstUserSource:x.com",
+        "firstUserMedium:tx",
+    ],
+    "linkedin": [
+        "firstUserSource:linkedin.com",
+        "firstUserSource:lnkd.in",
+        "firstUserMedium:ln",
+    ],
+    "linked": ["firstUserSource:linked.com", "firstUserMedium:linked.com"],
+}
+
+
+def sheet() -> pd.DataFrame:
+    rows = [
+        [event, "campaign", medium, source, "false", "", count, "1", "1", "1", "0"]
+        for event, medium, source, count in EVENTS
+    ]
+    return pd.DataFrame([HEADER] + rows)
+
+
+def shown(row: dict, pivot: str) -> bool:
+    """Evaluate the pivot table filters of a row one at a time, like Sheets does"""
+
+    if not (
+        re.search("session_start", row["eventName"])
+        or re.search("first_visit", row["eventName"])
+    ):
+        return False
+    if pivot in ("pllpl", "ffg"):
+        return pivot in row["firstUserMedium"].lower()
+    return any(
+        re.search(pattern, row[column])
+        for column, pattern in (f.split(":", 1) for f in SOURCES[pivot])
+    )
+
+
+@pytest.mark.parametrize("pivot", [*SOURCES, "pllpl", "ffg"])
+def test_local_pivot_matches_formulas(pivot) -> None:
+    """each pivot shows the rows its formulas would, with the same totals"""
+
+    df = sheet()
+    col_dict = {name: idx for idx, name in enumerate(HEADER)}
+    local = pivot_engine.LocalPivot(
+        pivot_engine.source(df), getattr(IDVAPivotDirector(), pivot)(col_dict)
+    )
+    rows = [dict(zip(HEADER, row)) for row in df.iloc[1:].values.tolist()]
+    expected = [row for row in rows if shown(row, pivot)]
+
+    assert len(local.filtered()) == len(expected)
+    for event in ["session_start", "first_visit"]:
+        assert local.get("SUM of eventCount", eventName=event) == sum(
+            int(row["eventCount"]) for row in expected if row["eventName"] == event
+        )
+
+    table = local.table()
+    assert table[0][-1] == "SUM of eventCount"
+    assert table[-1][0] == "Grand Total"
+    assert table[-1][-1] == sum(int(row["eventCount"]) for row in expected)
+
+
+def test_formula_evaluator() -> None:
+    """custom formulas are evaluated on every row at once"""
+
+    data = pivot_engine.source(sheet())
+    mask = pivot_engine.FormulaEvaluator(data).mask(
+        '=OR(regexmatch(firstUserSource,"facebook"),regexmatch(firstUserMedium,"fb"))'
+    )
+    assert data[mask]["eventCount"].tolist() == [10, 4, 1000, 3]
+
+    with pytest.raises(ValueError):
+        pivot_engine.FormulaEvaluator(data).mask('=regexmatch(missing,"x")')
+
+
+def test_report_writes_local_pivots(monkeypatch) -> None:
+    """without live pivots, the report holds values rather than pivot tables"""
+
+    monkeypatch.setattr(settings, "ANALYTICS_LIVE_PIVOTS", False)
+    plan = ReportPlan("report")
+    flow_analytics.plan_pivot_tables(sheet(), plan)
+
+    assert plan.pivots == []
+    cells = plan.cells[flow_analytics.SheetsEnum.REKREWT.value]
+    assert cells[(1, 2)] == 10 + 7  # FACEBOOK sessions, C2
+    assert cells[(2, 2)] == 4  # FACEBOOK first visits, C3
+    assert cells[(5, 0)] == "eventName"  # header of the FACEBOOK table, A6
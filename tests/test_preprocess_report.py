@@ -0,0 +1,90 @@
+import sys
+from unittest.mock import MagicMock
+
+import pandas as pd
+import pytest
+
+sys.modules.setdefault("gdrive.drive_client", MagicMock())
+sys.modules.setdefault("gdrive.sheets_client", MagicMock())
+sys.modules.setdefault("gdrive.analytics_client", MagicMock())
+
+from gdrive import settings
+from gdrive.idva import flow_analytics
+
+HEADER = [
+    "eventName",
+    "firstUserCampaignName",
+    "firstUserMedium",
+    "firstUserSource",
+    "isConversionEvent",
+    "linkUrl",
+    "eventCount",
+    "sessions",
+    "totalUsers",
+    "eventCountPerUser",
+    "conversions",
+]
+
+# (eventName, firstUserMedium, firstUserSource)
+EVENTS = [
+    ("session_start", "social", "m.facebook.com"),
+    ("session_start", "fb", "(direct)"),
+    ("first_visit", "cl", "sfbay.craigslist.org"),
+    ("first_visit", "referral", "craigslist.org"),  # needs a letter before
+    ("page_view", "rd", "reddit.com"),  # not a tracked event
+    ("session_start", "pllpl_email", "newsletter"),
+    ("first_visit", "social", "t.com"),  # "t.co" matches the start
+    ("session_start", None, None),
+]
+
+
+def sheet(events=EVENTS) -> pd.DataFrame:
+    rows = [
+        [event, "campaign", medium, source, "false", "", "1", "1", "1", "1", "0"]
+        for event, medium, source in events
+    ]
+    return pd.DataFrame([HEADER] + rows)
+
+
+def preprocess_loop(df: pd.DataFrame) -> pd.DataFrame:
+    """The former implementation, adding each placeholder row in turn"""
+    df = df.copy()
+    for event in settings.ANALYTICS_TRACKED_EVENTS:
+        tracked_df = df[df[0] == event]
+        for source in settings.ANALYTICS_TRACKED_SOURCES:
+            if tracked_df[tracked_df[3].str.match(source) == True].empty:  # noqa: E712
+                df.loc[len(df.index)] = (
+                    [event, "---", "---", source] + ["---"] * 2 + [0] * 5
+                )
+
+        for medium in settings.ANALYTICS_TRACKED_MEDIUMS:
+            if tracked_df[tracked_df[2].str.match(medium) == True].empty:  # noqa: E712
+                df.loc[len(df.index)] = [event, "---", medium] + ["---"] * 3 + [0] * 5
+    return df
+
+
+@pytest.mark.parametrize("events", [EVENTS, [], EVENTS[:1]])
+def test_placeholders_match_loop(events) -> None:
+    """the same placeholder rows are added, in the same order"""
+
+    df = sheet(events)
+    expected = preprocess_loop(df)
+    result = flow_analytics.preprocess_report(df)
+
+    assert result.values.tolist() == expected.values.tolist()
+    assert result.index.tolist() == list(range(len(expected)))
+    assert len(df) == len(events) + 1  # the data is not changed
+
+
+def test_tracked_patterns_are_configured(monkeypatch) -> None:
+    """only the configured events, sources and mediums get placeholders"""
+
+    monkeypatch.setattr(settings, "ANALYTICS_TRACKED_EVENTS", ["first_visit"])
+    monkeypatch.setattr(settings, "ANALYTICS_TRACKED_SOURCES", ["t.co", "bing"])
+    monkeypatch.setattr(settings, "ANALYTICS_TRACKED_MEDIUMS", [])
+
+    result = flow_analytics.preprocess_report(sheet())
+
+    assert result.iloc[len(EVENTS) + 1 :].values.tolist() == [
+        ["first_visit", "---", "---", "bing", "---", "---", 0, 0, 0, 0, 0]
+    ]
@@ -0,0 +1,35 @@
+import threading
+import time
+
+from gdrive.rate_limit import RateLimiter
+
+
+def test_burst_is_not_limited() -> None:
+    """requests up to the burst are sent right away"""
+
+    limiter = RateLimiter(rate=1, burst=5)
+    assert [limiter.acquire() for _ in range(5)] == [0.0] * 5
+    assert limiter.acquire() > 0.5
+
+
+def test_rate_is_shared_between_threads() -> None:
+    """requests of every thread are spaced to the rate"""
+
+    limiter = RateLimiter(rate=100, burst=1)
+    start = time.monotonic()
+    threads = [
+        threading.Thread(target=lambda: [limiter.acquire() for _ in range(5)])
+        for _ in range(4)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    # The first request is sent right away, the other 19 at 100 per second
+    assert time.monotonic() - start >= 0.18
+
+
+def test_no_rate_is_unlimited() -> None:
+    limiter = RateLimiter(rate=0)
+    assert sum(limiter.acquire() for _ in range(100)) == 0
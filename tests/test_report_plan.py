@@ -0,0 +1,260 @@
+import logging
+import sys
+from datetime import datetime
+from unittest.mock import MagicMock
+
+import pandas as pd
+import pytest
+
+sys.modules.setdefault("gdrive.drive_client", MagicMock())
+sys.modules.setdefault("gdrive.sheets_client", MagicMock())
+sys.modules.setdefault("gdrive.analytics_client", MagicMock())
+
+from gdrive import settings
+from gdrive.idva import flow_analytics
+from gdrive.sheets import batch
+from gdrive.sheets.plan import ReportCompiler, ReportPlan
+
+
+class Recorder:
+    """
+    Stand in for the Drive and Sheets API services, recording every call that is
+    executed, and the http client of each in `clients`. Resources and requests are
+    chained like googleapiclient's. Executing the `fail` call raises.
+    """
+
+    def __init__(
+        self, calls: list, path: str = "", fail: str = None, clients: list = None
+    ) -> None:
+        self.calls = calls
+        self.path = path
+        self.fail = fail
+        self.clients = clients if clients is not None else []
+
+    def __getattr__(self, name):
+        path = "%s.%s" % (self.path, name) if self.path else name
+
+        def call(**kwargs):
+            if name == "execute":
+                self.calls.append(self.path)
+                self.clients.append(kwargs.get("http"))
+                if self.path == self.fail:
+                    raise RuntimeError("quota exceeded")
+                return {"id": "sheets-id", "replies": []}
+            return Recorder(self.calls, path, self.fail, self.clients)
+
+        return call
+
+
+def report_plan():
+    df = pd.DataFrame(
+        [
+            [
+                "date",
+                "eventName",
+                "firstUserSource",
+                "firstUserMedium",
+                "firstUserCampaignName",
+                "eventCount",
+            ],
+            ["20240101", "session_start", "facebook", "fb", "rekrewt", 12],
+            ["20240101", "first_visit", "reddit", "social", "rekrewt", 3],
+        ]
+    )
+    return flow_analytics.plan_report(df, datetime(2024, 1, 1))
+
+
+def test_report_is_three_transactions() -> None:
+    """a small report is created with one Drive and two Sheets transactions"""
+
+    calls = []
+    compiler = ReportCompiler(Recorder(calls), Recorder(calls))
+    plan = report_plan()
+    plan.folder_id = "folder-id"
+
+    assert compiler.run(plan) == "sheets-id"
+    assert calls == [
+        "files.create",
+        "spreadsheets.batchUpdate",
+        "spreadsheets.values.update",
+    ]
+
+
+@pytest.mark.parametrize(
+    "fail", ["spreadsheets.batchUpdate", "spreadsheets.values.update"]
+)
+def test_partial_report_is_deleted(fail) -> None:
+    """a report that fails after it was created is deleted before raising"""
+
+    calls = []
+    compiler = ReportCompiler(Recorder(calls), Recorder(calls, fail=fail))
+    plan = report_plan()
+    plan.folder_id = "folder-id"
+
+    with pytest.raises(RuntimeError):
+        compiler.run(plan)
+    assert calls[0] == "files.create"
+    assert calls[-1] == "files.delete"
+    assert calls[-2] == fail
+
+
+def test_drive_requests_use_the_client_of_their_thread() -> None:
+    """reports are created from backfill workers, every request uses their client"""
+
+    calls = []
+    clients = []
+    compiler = ReportCompiler(
+        Recorder(calls, clients=clients),
+        Recorder(calls, fail="spreadsheets.values.update", clients=clients),
+        http=lambda: "thread-client",
+    )
+    plan = report_plan()
+    plan.folder_id = "folder-id"
+
+    with pytest.raises(RuntimeError):
+        compiler.run(plan)
+    assert calls[0] == "files.create"
+    assert calls[-1] == "files.delete"
+    assert clients == ["thread-client"] * len(calls)
+
+
+def test_data_is_written_in_blocks() -> None:
+    """the data page is sized to the data, which is written in blocks of rows"""
+
+    calls = []
+    compiler = ReportCompiler(Recorder(calls), Recorder(calls), chunk_rows=2, workers=2)
+    plan = ReportPlan("report")
+    plan.set_data(pd.DataFrame([[idx, idx * 2] for idx in range(5)]))
+
+    update, *blocks = compiler.compile(plan, "sheets-id")
+    assert update.params["body"]["requests"] == [batch.grid_properties_request(0, 5, 2)]
+    assert [block.params["range"] for block in blocks] == [
+        "'Sheet1'!A1:B2",
+        "'Sheet1'!A3:B4",
+        "'Sheet1'!A5:B5",
+    ]
+    assert blocks[2].params["body"]["values"] == [[4, 8]]
+
+    compiler.run(plan)
+    assert (
+        calls
+        == ["files.create", "spreadsheets.batchUpdate"]
+        + ["spreadsheets.values.update"] * 3
+    )
+
+
+def test_report_batch_content() -> None:
+    """pages, pivot tables and totals are all part of the batchUpdate"""
+
+    plan = report_plan()
+    compiler = ReportCompiler(MagicMock(), MagicMock())
+    update, data = compiler.compile(plan, "sheets-id")
+
+    assert data.params["body"]["values"][1][1] == "session_start"
+    assert data.params["range"] == "'Sheet1'!A1:F3"
+
+    requests = update.params["body"]["requests"]
+    assert update.requests == len(requests)
+    assert "updateSheetProperties" in requests[0]
+    assert [r["addSheet"]["properties"]["sheetId"] for r in requests[1:3]] == [1, 2]
+    assert (
+        sum(r.get("updateCells", {}).get("fields") == "pivotTable" for r in requests)
+        == 9
+    )
+
+    cells = [
+        r["updateCells"]
+        for r in requests
+        if r.get("updateCells", {}).get("fields") == "userEnteredValue"
+    ]
+    assert {"userEnteredValue": {"formulaValue": "=sum(C2:G2)"}} in [
+        value for c in cells for row in c["rows"] for value in row["values"]
+    ]
+
+
+def test_dry_run_sends_nothing() -> None:
+    """a dry run only logs the transactions"""
+
+    calls = []
+    compiler = ReportCompiler(Recorder(calls), Recorder(calls))
+
+    assert compiler.run(report_plan(), dry_run=True) is None
+    assert calls == []
+
+
+def test_batch_update_replies_are_recorded_per_entry(monkeypatch) -> None:
+    """each reply of the batchUpdate is recorded under its plan entry"""
+
+    compiler = ReportCompiler(Recorder([]), Recorder([]))
+    plan = report_plan()
+
+    def execute(transaction):
+        if transaction.method != "batchUpdate":
+            return {}
+        replies = []
+        for entry in transaction.entries:
+            if entry[0] == "page":
+                properties = {"title": entry[1], "sheetId": 100 + len(replies)}
+                replies.append({"addSheet": {"properties": properties}})
+            else:
+                replies.append({})
+        return {"replies": replies}
+
+    monkeypatch.setattr(compiler, "execute", execute)
+    compiler.run(plan)
+
+    assert plan.replies[("resize", "Sheet1")] == {}
+    for title, _, _ in plan.pages:
+        reply = plan.replies[("page", title)]["addSheet"]["properties"]
+        assert reply["title"] == title
+    assert all(("pivot", idx) in plan.replies for idx in range(len(plan.pivots)))
+    assert any(key[0] == "cells" for key in plan.replies)
+    update = next(compiler.compile(plan, "sheets-id"))
+    assert [*plan.replies] == update.entries
+    assert len(update.entries) == update.requests
+
+
+def test_template_report_is_two_transactions() -> None:
+    """a report copied from a template only appends its data"""
+
+    calls = []
+    compiler = ReportCompiler(Recorder(calls), Recorder(calls))
+    df = report_plan().data
+    plan = flow_analytics.plan_report(df, datetime(2024, 1, 1), template_id="tmpl")
+
+    assert plan.pages == [] and plan.pivots == []
+    assert plan.data.values.tolist() == df.iloc[1:].values.tolist()
+    assert compiler.run(plan) == "sheets-id"
+    assert calls == ["files.copy", "spreadsheets.values.append"]
+
+
+def test_template_ignores_local_pivots(monkeypatch, caplog) -> None:
+    """computed pivot tables do not apply to a report copied from a template"""
+
+    monkeypatch.setattr(settings, "ANALYTICS_LIVE_PIVOTS", False)
+    df = report_plan().data
+    with caplog.at_level(logging.WARNING):
+        plan = flow_analytics.plan_report(df, datetime(2024, 1, 1), template_id="tmpl")
+
+    assert plan.pivots == []
+    assert "ANALYTICS_LIVE_PIVOTS=False is ignored" in caplog.text
+
+
+def test_large_template_report_is_resized() -> None:
+    """data of several blocks is written after resizing the copied data page"""
+
+    calls = []
+    compiler = ReportCompiler(Recorder(calls), Recorder(calls), chunk_rows=2)
+    plan = ReportPlan("report", template_id="tmpl")
+    plan.set_data(pd.DataFrame([[idx] for idx in range(5)]), start_row=1)
+
+    resize, *blocks = compiler.compile(plan, "sheets-id")
+    assert resize.params["body"]["requests"] == [batch.grid_properties_request(0, 6, 1)]
+    assert blocks[0].params["range"] == "'Sheet1'!A2:A3"
+
+    compiler.run(plan)
+    assert (
+        calls
+        == ["files.copy", "spreadsheets.batchUpdate"]
+        + ["spreadsheets.values.update"] * 3
+    )
@@ -0,0 +1,52 @@
+import threading
+import time
+
+import pytest
+
+from gdrive.sheets import batch
+
+
+def test_cell_notation() -> None:
+    """A1 cells convert to and from zero based indexes"""
+
+    assert batch.parse_cell("C2") == (1, 2)
+    assert batch.parse_cell("AA35") == (34, 26)
+    assert batch.cell_name(34, 26) == "AA35"
+    assert batch.cell_name(0, 701) == "ZZ1"
+    with pytest.raises(ValueError):
+        batch.parse_cell("A1:B2")
+
+
+def test_adjacent_cells_are_merged() -> None:
+    """cells are covered by rectangles without covering any other cell"""
+
+    cells = {batch.parse_cell(cell): cell for cell in ["B1", "C1", "B2", "C2"]}
+    cells.update({batch.parse_cell(cell): cell for cell in ["A2", "A3", "E5"]})
+
+    assert batch.rectangles(cells) == [(0, 1, 1, 2), (1, 0, 2, 0), (4, 4, 4, 4)]
+
+
+def test_bounded_map_limits_running_calls() -> None:
+    """at most `workers` calls run at once, and results keep the order of the items"""
+
+    lock = threading.Lock()
+    running = []
+    most = []
+
+    def call(item):
+        with lock:
+            running.append(item)
+            most.append(len(running))
+        time.sleep(0.01)
+        with lock:
+            running.remove(item)
+        return item * 2
+
+    assert batch.bounded_map(call, iter(range(10)), 3) == [i * 2 for i in range(10)]
+    assert max(most) <= 3
+
+    def fail(item):
+        raise ValueError(item)
+
+    with pytest.raises(ValueError):
+        batch.bounded_map(fail, range(10), 2)